@@ -0,0 +1,237 @@
+import json
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from typing import Callable, Optional
+
+from retry_policy import THROTTLED, UNAVAILABLE, RetryExhaustedError, classify_error, retry_after_hint
+
+# 0 にするとバックエンドが飽和していてもリクエストを受け付ける (従来の動作)
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1") != "0"
+# 飽和の判定に使う直近のモデル呼び出しの期間 (秒)
+ADMISSION_WINDOW = float(os.environ.get("ADMISSION_WINDOW", "30"))
+# 期間内にこの回数以上呼び出し、その ADMISSION_THRESHOLD 以上が 429/5xx なら飽和とみなす
+ADMISSION_MIN_CALLS = int(os.environ.get("ADMISSION_MIN_CALLS", "20"))
+ADMISSION_THRESHOLD = float(os.environ.get("ADMISSION_THRESHOLD", "0.9"))
+# サーバーの待機指示がない場合に新しいリクエストを断る時間 (飽和が続くたびに倍、上限 ADMISSION_MAX_COOLDOWN)
+ADMISSION_COOLDOWN = float(os.environ.get("ADMISSION_COOLDOWN", "5"))
+ADMISSION_MAX_COOLDOWN = float(os.environ.get("ADMISSION_MAX_COOLDOWN", "30"))
+# 設定すると飽和状態をローカルのファイルで共有する (空ならコンテナ内のみ)
+ADMISSION_STORE_PATH = os.environ.get("ADMISSION_STORE_PATH", "")
+
+
+class SaturationStore(ABC):
+    """
+    Saturation deadline shared between instances.
+
+    `get` returns the wall-clock time (time.time()) until which the backend is
+    considered saturated, 0 if unknown. `extend` must only move it later
+    (e.g. DynamoDB update with a condition, Redis SET with GT); `clear` ends
+    the saturation after a call succeeded.
+    """
+
+    @abstractmethod
+    def get(self) -> float:
+        """The shared saturation deadline (time.time()), 0 if unknown."""
+
+    @abstractmethod
+    def extend(self, until: float):
+        """Move the deadline to `until` unless it is already later."""
+
+    @abstractmethod
+    def clear(self):
+        """End the saturation."""
+
+
+class LocalFileSaturationStore(SaturationStore):
+    """
+    Local stand-in for a shared store: the deadline in one file, replaced
+    atomically. Shared by processes on the same host (or a shared file system).
+
+    Args:
+        path (str): File holding the deadline
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self) -> float:
+        try:
+            with open(self.path, "r") as f:
+                return float(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0.0
+
+    def extend(self, until: float):
+        if until <= self.get():
+            return
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(until))
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def saturation_store_from_env() -> Optional[SaturationStore]:
+    return LocalFileSaturationStore(ADMISSION_STORE_PATH) if ADMISSION_STORE_PATH else None
+
+
+def rejection(retry_after: float) -> dict:
+    """429 response telling the caller when to come back."""
+    seconds = max(1, math.ceil(retry_after))
+    return {
+        "statusCode": 429,
+        "headers": {"Content-Type": "application/json; charset=utf-8", "Retry-After": str(seconds)},
+        "body": json.dumps({"error": f"Model backend is saturated, retry after {seconds} seconds", "RetryAfter": seconds}),
+    }
+
+
+class AdmissionController:
+    """
+    Reject new requests while the model backend is saturated.
+
+    Every model call outcome is recorded. When at least `min_calls` calls in the
+    last `window` seconds ended and `threshold` of them were 429/5xx, or when a
+    call gave up after all its retries on 429/5xx, the backend is marked
+    saturated for the server's retry hint (or `cooldown`, doubled per
+    consecutive saturation until a call succeeds). New requests arriving
+    before then are answered with a 429 and a Retry-After estimate instead of
+    sweeping every slot. Until a call succeeds again, only one request per
+    rejection period is admitted as a probe; a success (from a probe or from a
+    request admitted earlier) ends the saturation. With a store, the saturation is shared with other
+    instances; the call counts stay local.
+
+    Args:
+        window (float): Seconds of call outcomes considered
+        min_calls (int): Calls in the window needed before judging saturation
+        threshold (float): Share of 429/5xx outcomes that means saturation
+        cooldown (float): First rejection period in seconds without a retry hint
+        max_cooldown (float): Longest rejection period in seconds
+        store (SaturationStore): Shared saturation deadline (None = this instance only)
+        enabled (bool): False = record only, never reject
+        clock (Callable): Wall clock (injected by simulations)
+    """
+
+    def __init__(self, window: float = ADMISSION_WINDOW, min_calls: int = ADMISSION_MIN_CALLS,
+                 threshold: float = ADMISSION_THRESHOLD, cooldown: float = ADMISSION_COOLDOWN,
+                 max_cooldown: float = ADMISSION_MAX_COOLDOWN, store: Optional[SaturationStore] = None,
+                 enabled: bool = ADMISSION_CONTROL, clock: Callable[[], float] = time.time):
+        self.window = window
+        self.min_calls = min_calls
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.store = store
+        self.enabled = enabled
+        self.clock = clock
+        self.saturated_until = 0.0
+        self.stats = Counter()
+        self._outcomes = deque()  # (終了時刻, 429/5xx か)
+        self._overloaded = 0
+        self._trips = 0  # 成功を挟まずに続いた飽和の回数
+        self._hint = None  # 直近の 429/5xx に付いていた待機指示
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(store=saturation_store_from_env())
+
+    def _period(self) -> float:
+        seconds = self._hint if self._hint is not None else self.cooldown * 2 ** min(self._trips - 1, 10)
+        return min(seconds, self.max_cooldown)
+
+    def _trip(self, now: float, reason: str):
+        self._trips += 1
+        self.saturated_until = max(self.saturated_until, now + self._period())
+        self.stats[f"saturations.{reason}"] += 1
+        print(f"Model backend saturated ({reason}), rejecting new requests for {self.saturated_until - now:.1f}s")
+        if self.store is not None:
+            self.store.extend(self.saturated_until)
+
+    def record(self, error: Optional[Exception] = None):
+        """Record the outcome of one model call (None = success); other errors are ignored."""
+        overloaded = error is not None and classify_error(error) in (THROTTLED, UNAVAILABLE)
+        if error is not None and not overloaded:
+            return
+        with self._lock:
+            now = self.clock()
+            self._outcomes.append((now, overloaded))
+            self._overloaded += overloaded
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._overloaded -= self._outcomes.popleft()[1]
+            if not overloaded:
+                self._trips = 0
+                self._hint = None
+                if self.saturated_until > now:
+                    # バックエンドが回復した (断っている間も処理中だった呼び出しが成功した)
+                    self.saturated_until = now
+                    self.stats["recoveries"] += 1
+                    if self.store is not None:
+                        self.store.clear()
+                return
+            self._hint = retry_after_hint(error)
+            # 断っている間に終わった呼び出しでは延長しない (飽和の前に始まった呼び出しの結果のため)
+            if (now >= self.saturated_until and len(self._outcomes) >= self.min_calls
+                    and self._overloaded >= self.threshold * len(self._outcomes)):
+                self._trip(now, "window")
+
+    def record_exhausted(self, error: RetryExhaustedError):
+        """A call gave up after all its retries; saturated if the last failure was a 429/5xx."""
+        if error.last_error is None or classify_error(error.last_error) not in (THROTTLED, UNAVAILABLE):
+            return
+        with self._lock:
+            now = self.clock()
+            if now >= self.saturated_until:
+                self._trip(now, "exhausted")
+
+    def retry_after(self, probe: bool = True) -> Optional[float]:
+        """
+        Seconds until new requests are admitted again, or None to admit now.
+
+        Args:
+            probe: Grant this request the recovery probe once the cool-down ends; False only peeks
+                (for a check ahead of the one that admits the request)
+        """
+        saturated_until = self.saturated_until
+        if self.store is not None:
+            saturated_until = max(saturated_until, self.store.get())
+        now = self.clock()
+        remaining = saturated_until - now
+        if remaining <= 0:
+            if probe and self._trips and self.enabled:
+                self._probe(now)
+            return None
+        with self._lock:
+            self.stats["rejected" if self.enabled else "would_reject"] += 1
+        return remaining if self.enabled else None
+
+    def _probe(self, now: float):
+        # 回復を確かめるまでは冷却期間ごとに1リクエストだけ受け付ける (断ったリクエストが一斉に戻って失敗しない)
+        with self._lock:
+            if not self._trips or self.saturated_until > now:
+                return
+            self.saturated_until = now + self._period()
+            self.stats["probes"] += 1
+            if self.store is not None:
+                self.store.extend(self.saturated_until)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "saturated_seconds": round(max(0.0, self.saturated_until - self.clock()), 2),
+                "window_calls": len(self._outcomes),
+                "window_overloaded": self._overloaded,
+                **self.stats,
+            }
+
+
+admission = AdmissionController.from_env()
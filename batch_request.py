@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from deadline import DEADLINE_PAGE_RESERVE, Deadline, DeadlineExceededError
+from page_isolation import page_error
+from pipeline import prepare_file
+
+# 1回の呼び出しの中で同時に処理するページ数 (バッチ内の全ファイルで共有)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "20"))
+
+FILE_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "application/pdf": ".pdf"}
+
+
+def document_result(documents: list[dict], errors: list[dict], unprocessed_pages: list[int]) -> dict:
+    """
+    Status and body for one document from its per-page outcome.
+
+    Returns:
+        {"statusCode": int, "body": dict}; 504 when the deadline left no page processed,
+        500 when every page failed, 200 otherwise (with partial results)
+    """
+    if unprocessed_pages and not documents:
+        return {
+            "statusCode": 504,
+            "body": {
+                "error": "Deadline exceeded before any page was processed",
+                "UnprocessedPages": unprocessed_pages,
+                "Errors": errors,
+            },
+        }
+
+    if errors and not documents and not unprocessed_pages:
+        return {
+            "statusCode": 500,
+            "body": {
+                "error": f"Internal server error: {errors[0]['Message']}",
+                "Errors": errors,
+            },
+        }
+
+    body = {"Documents": documents}
+    if errors:
+        body["Errors"] = errors
+    if unprocessed_pages:
+        body["UnprocessedPages"] = unprocessed_pages
+    return {"statusCode": 200, "body": body}
+
+
+class BatchScheduler:
+    """
+    Process every page of a multi-file request through one bounded thread pool.
+
+    Files are split as they are read and their pages are queued immediately, so
+    pages of all files share `concurrency` model-call slots instead of each file
+    running its own serial page loop. The pool is shared by concurrent batch
+    requests in the same process. A page is not started once the deadline no
+    longer leaves room for it; identical files in one batch are processed once.
+
+    Args:
+        process_page: (page filepath, page, media type, type hint, deadline) -> (document, error);
+            raises DeadlineExceededError when the deadline runs out mid-page
+        concurrency (int): Pages processed at the same time
+    """
+
+    def __init__(self, process_page: Callable[[str, int, str, Optional[str], Deadline], tuple],
+                 concurrency: int = BATCH_CONCURRENCY):
+        self.process_page = process_page
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+        self._page_seconds = []
+        self._lock = threading.Lock()
+
+    def _page_reserve(self) -> float:
+        with self._lock:
+            recent = self._page_seconds[-20:]
+        return max(DEADLINE_PAGE_RESERVE, sum(recent) / len(recent) if recent else 0)
+
+    def _run_page(self, filepath: str, page: int, media_type: str, type_hint: Optional[str],
+                  deadline: Deadline) -> tuple[Optional[dict], Optional[dict], bool]:
+        # 残り時間が1ページ分の見込み時間を下回ったら新しいページを開始しない
+        if not deadline.allows(self._page_reserve()):
+            return None, None, True
+        started_at = time.perf_counter()
+        try:
+            document, error = self.process_page(filepath, page, media_type, type_hint, deadline)
+        except DeadlineExceededError as e:
+            print(f"Deadline exceeded on page {page} of {filepath}: {e}")
+            return None, None, True
+        except Exception as e:
+            print(f"Error processing page {page} of {filepath}: {e}")
+            return None, page_error(page, "preparation", e), False
+        if document:
+            with self._lock:
+                self._page_seconds.append(time.perf_counter() - started_at)
+        return document, error, False
+
+    def run(self, files: list[dict], deadline: Deadline) -> list[dict]:
+        """
+        Process the files of one batch request.
+
+        Args:
+            files: [{"name", "data", "media_type", "certificate_type_hint", "error"}, ...] as parsed by parse_batch_upload
+            deadline: Deadline of the whole request
+
+        Returns:
+            Per-file {"Name", "StatusCode", "Documents", "Errors", "UnprocessedPages"} in upload order
+        """
+        if len(files) > MAX_BATCH_FILES:
+            raise ValueError(f"Too many files ({len(files)}) in one batch. The limit is {MAX_BATCH_FILES}.")
+
+        temp_dir = tempfile.mkdtemp(prefix="ocr_batch_")
+        outcomes = [{"documents": [], "errors": [], "unprocessed": []} for _ in files]
+        futures = {}
+        duplicates = {}  # ファイルの番号 -> 同じ内容の先行ファイルの番号
+        first_seen = {}
+        page_dirs = []
+        try:
+            for index, item in enumerate(files):
+                if item.get("error") is not None:
+                    outcomes[index]["errors"].append(page_error(0, "upload", item["error"]))
+                    continue
+                filepath = os.path.join(temp_dir, f"file{index}{FILE_EXTENSIONS[item['media_type']]}")
+                with open(filepath, "wb") as f:
+                    f.write(item["data"])
+                prepared = prepare_file(filepath)
+                page_dirs.append(prepared["temp_dir"])
+                if prepared["error"]:
+                    print(f"Error processing {item['name']}: {prepared['error']}")
+                    outcomes[index]["errors"].append(page_error(0, "preparation", Exception(prepared["error"])))
+                    continue
+                key = (prepared["content_hash"], item["media_type"], item.get("certificate_type_hint"))
+                if key in first_seen:
+                    duplicates[index] = first_seen[key]
+                    continue
+                first_seen[key] = index
+                for page, page_filepath in prepared["pages"]:
+                    future = self._executor.submit(
+                        self._run_page, page_filepath, page, item["media_type"], item.get("certificate_type_hint"), deadline
+                    )
+                    futures[future] = (index, page)
+        finally:
+            wait(futures)
+            for directory in [temp_dir, *page_dirs]:
+                if directory:
+                    shutil.rmtree(directory, ignore_errors=True)
+
+        for future, (index, page) in sorted(futures.items(), key=lambda entry: entry[1]):
+            document, error, unprocessed = future.result()
+            outcomes[index]["documents"].extend([document] if document else [])
+            outcomes[index]["errors"].extend([error] if error else [])
+            outcomes[index]["unprocessed"].extend([page] if unprocessed else [])
+
+        results = []
+        for index, item in enumerate(files):
+            outcome = outcomes[duplicates.get(index, index)]
+            result = document_result(outcome["documents"], outcome["errors"], outcome["unprocessed"])
+            results.append({"Name": item["name"], "StatusCode": result["statusCode"], **result["body"]})
+        return results
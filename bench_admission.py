@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark for admission control against the fake Gemini backend.
+The fake answers 429 to every call for the first `--outage` seconds (quota
+exhausted in every region) and accepts every call afterwards. `--clients`
+callers keep invoking lambda_function.lambda_handler with a one-page image for
+`--duration` seconds; a caller waits for Retry-After after a 429 and
+`--client-backoff` seconds after any other failure. With admission control off
+every invocation sweeps all slots and backs off before failing; with it on,
+invocations during the outage are rejected in milliseconds. The benchmark
+reports the billed duration (the sum of handler durations), invocations by
+status and when the first request succeeded after the outage. The retry budget
+and the cool-downs are scaled down to keep the run short.
+
+Usage:
+    python bench_admission.py [--clients 8] [--outage 20] [--duration 40] [--retry-budget 20]
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+os.environ.setdefault("API_KEY", "bench")
+
+import fake_gemini
+import lambda_function
+from admission import AdmissionController
+from concurrency_limit import AdaptiveLimiter
+from quota_pool import SlotRouter
+from retry_policy import RetryPolicy
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def event(data: bytes) -> dict:
+    return {
+        "headers": {"Authorization": f"Bearer {os.environ['API_KEY']}", "Content-Type": "application/json"},
+        "body": json.dumps({"data": base64.b64encode(data).decode("ascii"), "media_type": "image/png"}),
+    }
+
+
+def run(enabled: bool, args) -> dict:
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed,
+                                        quota=lambda elapsed: 0 if elapsed < args.outage else 10 ** 6)
+    fake_gemini.install(lambda_function, fake)
+    # 冷却時間・リトライ・飽和の判定はシミュレーションの時間に合わせて短くする
+    lambda_function.slot_router = SlotRouter([("bench-project", None)], lambda_function.VERTEX_AI_REGIONS,
+                                             lambda_function.slot_router.client_factory, cooldown=0.2, max_cooldown=2.0)
+    lambda_function.retry_policy = RetryPolicy(base_delay=0.1, max_delay=args.retry_budget / 8,
+                                               total_budget=args.retry_budget)
+    lambda_function.admission = AdmissionController(window=5.0, cooldown=1.0, max_cooldown=4.0,
+                                                    enabled=enabled)
+    invocations = []  # (開始時刻, 処理時間, ステータス)
+    lock = threading.Lock()
+
+    def client(index: int):
+        number = 0
+        while time.monotonic() - fake.started_at < args.duration:
+            data = PNG_SIGNATURE + fake_gemini.make_document(str(number % 4 + 1), doc_id=f"{index}-{number}")
+            started_at = time.monotonic()
+            response = lambda_function.lambda_handler(event(data), None)
+            finished_at = time.monotonic()
+            with lock:
+                invocations.append((started_at - fake.started_at, finished_at - started_at, response["statusCode"]))
+            if response["statusCode"] == 429:
+                time.sleep(float(response["headers"]["Retry-After"]))
+            elif response["statusCode"] != 200:
+                time.sleep(args.client_backoff)
+            number += 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    statuses = Counter(status for _, _, status in invocations)
+    recovered = [started_at + seconds for started_at, seconds, status in invocations if status == 200]
+    return {
+        "billed_seconds": sum(seconds for _, seconds, _ in invocations),
+        "failed_seconds": sum(seconds for _, seconds, status in invocations if status != 200),
+        "statuses": statuses,
+        "first_success": min(recovered) if recovered else float("nan"),
+        "throttled": fake.throttled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="callers invoking the function at the same time")
+    parser.add_argument("--outage", type=float, default=20.0, help="seconds every call is throttled")
+    parser.add_argument("--duration", type=float, default=40.0)
+    parser.add_argument("--retry-budget", type=float, default=20.0, help="retry budget per model call in seconds")
+    parser.add_argument("--client-backoff", type=float, default=1.0, help="caller's pause after a failure")
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    lambda_function.call_limiter = AdaptiveLimiter(enabled=False)
+
+    print(f"{args.clients} clients, every call throttled for {args.outage:.0f} s of {args.duration:.0f} s, "
+          f"{len(lambda_function.VERTEX_AI_REGIONS)} regions, {args.retry_budget:.0f} s retry budget")
+    print(f"{'admission':<11}{'billed':>9}{'on failures':>13}{'200':>6}{'429':>6}{'5xx':>6}{'429s from model':>17}"
+          f"{'first success':>15}")
+    results = {}
+    for enabled in (False, True):
+        result = results[enabled] = run(enabled, args)
+        statuses = result["statuses"]
+        print(f"{'on' if enabled else 'off':<11}{result['billed_seconds']:>8.1f}s{result['failed_seconds']:>12.1f}s"
+              f"{statuses[200]:>6}{statuses[429]:>6}{sum(c for s, c in statuses.items() if s >= 500):>6}"
+              f"{result['throttled']:>17}{result['first_success']:>14.1f}s")
+    for key, label in (("billed_seconds", "billed duration"), ("failed_seconds", "billed on failed or rejected invocations")):
+        print(f"{label}: {results[False][key]:.1f}s -> {results[True][key]:.1f}s "
+              f"({1 - results[True][key] / results[False][key]:.0%} saved)")
+
+
+if __name__ == "__main__":
+    main()
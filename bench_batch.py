@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the multi-document batch endpoint against the fake Gemini backend.
+Sends one employee's set of certificates (a mix of multi-page PDFs and images)
+as N single lambda_handler requests, one after another and all at once (one
+invocation each, as the front end does today), and as one batch request whose
+pages share the batch scheduler. `--invocation-overhead` adds a fixed cost per
+invocation for the Function URL round trip and authentication.
+
+Usage:
+    python bench_batch.py [--files 8] [--max-pages 4] [--concurrency 8] [--invocation-overhead 0.1]
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+os.environ.setdefault("API_KEY", "bench")
+
+import batch_request
+import fake_gemini
+import lambda_function
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_files(count: int, max_pages: int, rng: random.Random, prefix: str) -> list[tuple[bytes, str]]:
+    files = []
+    for index in range(count):
+        pages = rng.randint(1, max_pages)
+        documents = [fake_gemini.make_document(rng.choice("1234"), rows=2, doc_id=f"{prefix}-{index}-{page}")
+                     for page in range(pages)]
+        if pages == 1:
+            files.append((PNG_SIGNATURE + documents[0], "image/png"))
+        else:
+            files.append((fake_gemini.make_pdf(documents, drawing_ops=200), "application/pdf"))
+    return files
+
+
+def event(body: dict, path: str = "/") -> dict:
+    return {
+        "rawPath": path,
+        "headers": {"Authorization": f"Bearer {os.environ['API_KEY']}", "Content-Type": "application/json"},
+        "body": json.dumps(body),
+    }
+
+
+def invoke(request: dict, overhead: float) -> dict:
+    time.sleep(overhead)
+    response = lambda_function.lambda_handler(request, None)
+    assert response["statusCode"] == 200, response
+    return json.loads(response["body"])
+
+
+def single_requests(files: list[tuple[bytes, str]]) -> list[dict]:
+    return [event({"data": base64.b64encode(data).decode("ascii"), "media_type": media_type})
+            for data, media_type in files]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8, help="files in one employee's set")
+    parser.add_argument("--max-pages", type=int, default=4, help="pages per file are drawn from 1..max-pages")
+    parser.add_argument("--concurrency", type=int, default=8, help="batch scheduler concurrency")
+    parser.add_argument("--invocation-overhead", type=float, default=0.0, help="seconds added per invocation")
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed)
+    fake_gemini.install(lambda_function, fake)
+    lambda_function.batch_scheduler = batch_request.BatchScheduler(lambda_function.process_page, args.concurrency)
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 重複排除が働かないよう、実行ごとに異なる文書を使う
+        requests = single_requests(make_files(args.files, args.max_pages, random.Random(args.seed), "sequential"))
+        started_at = time.perf_counter()
+        documents = sum(len(invoke(request, args.invocation_overhead)["Documents"]) for request in requests)
+        results["N single, sequential"] = (time.perf_counter() - started_at, len(requests), documents)
+
+        requests = single_requests(make_files(args.files, args.max_pages, random.Random(args.seed), "parallel"))
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+            bodies = list(pool.map(lambda request: invoke(request, args.invocation_overhead), requests))
+        results["N single, parallel"] = (
+            time.perf_counter() - started_at, len(requests), sum(len(body["Documents"]) for body in bodies)
+        )
+
+        files = make_files(args.files, args.max_pages, random.Random(args.seed), "batch")
+        request = event({"files": [
+            {"name": f"certificate{index}", "data": base64.b64encode(data).decode("ascii"), "media_type": media_type}
+            for index, (data, media_type) in enumerate(files)
+        ]}, "/batch")
+        started_at = time.perf_counter()
+        body = invoke(request, args.invocation_overhead)
+        results["1 batch request"] = (
+            time.perf_counter() - started_at, 1, sum(len(item["Documents"]) for item in body["Files"])
+        )
+
+    print(f"{args.files} files, {results['1 batch request'][2]} pages, batch concurrency {args.concurrency}, "
+          f"invocation overhead {args.invocation_overhead:.2f} s")
+    print(f"{'mode':<24}{'latency':>10}{'invocations':>13}{'documents':>11}")
+    for name, (elapsed, invocations, documents) in results.items():
+        print(f"{name:<24}{elapsed:>9.2f}s{invocations:>13}{documents:>11}")
+    print(f"batch vs. sequential: {results['N single, sequential'][0] / results['1 batch request'][0]:.1f}x, "
+          f"vs. parallel: {results['N single, parallel'][0] / results['1 batch request'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
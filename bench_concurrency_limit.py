@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the adaptive (AIMD) concurrency limit against the fake Gemini backend.
+Many workers keep calling lambda_function.execute_extraction on distinct pages
+while the fake backend's quota (concurrent calls it accepts before answering
+429) shifts between phases. Each run caps the in-flight model calls with a
+fixed limit or with the adaptive limit and reports pages per second, the 429s
+the backend returned, pages that failed after all retries and, per phase, the
+quota next to the mean limit.
+
+Usage:
+    python bench_concurrency_limit.py [--workers 48] [--quotas 24,6,16] [--phase-seconds 4] [--fixed 4,16,48]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+from concurrency_limit import AdaptiveLimiter
+from retry_policy import RetryPolicy
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def run(limiter: AdaptiveLimiter, quotas: list[int], phase_seconds: float, workers: int, args) -> dict:
+    quota = lambda elapsed: quotas[min(int(elapsed // phase_seconds), len(quotas) - 1)]
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed, quota=quota)
+    fake_gemini.install(lambda_function, fake)
+    lambda_function.call_limiter = limiter
+    duration = phase_seconds * len(quotas)
+    completed, failed = [], []
+    samples = [[] for _ in quotas]  # フェーズごとの上限の推移
+
+    def worker(index: int, directory: str):
+        rng = random.Random(args.seed + index)
+        number = 0
+        while time.monotonic() - fake.started_at < duration:
+            # 重複排除が働かないよう、ページごとに異なる文書を使う
+            filepath = os.path.join(directory, f"worker{index}-{number}.png")
+            with open(filepath, "wb") as f:
+                f.write(PNG_SIGNATURE + fake_gemini.make_document(rng.choice("1234"), doc_id=f"{index}-{number}"))
+            try:
+                lambda_function.execute_extraction(filepath, 1, "image/png")
+                completed.append(time.monotonic() - fake.started_at)
+            except Exception:
+                failed.append(time.monotonic() - fake.started_at)
+            number += 1
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=worker, args=(index, directory)) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        while (elapsed := time.monotonic() - fake.started_at) < duration:
+            samples[min(int(elapsed // phase_seconds), len(quotas) - 1)].append(limiter.summary()["limit"])
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+    # 終了時刻を過ぎて完了したページは数えない
+    pages = sum(1 for finished_at in completed if finished_at <= duration)
+    return {
+        "pages_per_second": pages / duration,
+        "throttled": fake.throttled,
+        "failed": len(failed),
+        "mean_limits": [sum(values) / len(values) if values else 0.0 for values in samples],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=48, help="threads issuing pages at the same time")
+    parser.add_argument("--quotas", default="24,6,16", help="concurrent calls the backend accepts in each phase")
+    parser.add_argument("--phase-seconds", type=float, default=4.0)
+    parser.add_argument("--fixed", default="4,16,48", help="fixed limits to compare against")
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    quotas = [int(value) for value in args.quotas.split(",")]
+    # 本番より短い待ち時間で再試行する (シミュレーションの時間に合わせる)
+    lambda_function.retry_policy = RetryPolicy(base_delay=0.05, max_delay=0.5, total_budget=10.0)
+
+    limiters = {f"fixed {limit}": AdaptiveLimiter(limit, limit, limit) for limit in map(int, args.fixed.split(","))}
+    limiters["adaptive"] = AdaptiveLimiter(enabled=True)
+    print(f"{args.workers} workers, quota {' -> '.join(map(str, quotas))} ({args.phase_seconds:.0f} s each)")
+    print(f"{'limit':<12}{'pages/s':>9}{'429s':>8}{'failed':>8}  mean limit per phase")
+    for name, limiter in limiters.items():
+        result = run(limiter, quotas, args.phase_seconds, args.workers, args)
+        print(f"{name:<12}{result['pages_per_second']:>9.2f}{result['throttled']:>8}{result['failed']:>8}  "
+              + "  ".join(f"{limit:.1f}/{quota}" for limit, quota in zip(result["mean_limits"], quotas)))
+
+
+if __name__ == "__main__":
+    main()
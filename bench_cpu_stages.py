@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the local CPU stages of the pipeline (no model calls).
+Times each stage on its own with synthetic inputs of realistic size: upload
+decoding (JSON + base64), PDF reading and per-page splitting for 1-19 page
+PDFs, the per-call file read and base64 encoding of a page, parsing and
+validating model output, the get_*_api_response builders (multi-row life
+insurance outputs) and response serialization.
+
+Each stage is calibrated to run at least `--min-time` seconds per sample
+(pyperf style) and `--samples` samples are taken; the report shows the median,
+the fastest sample and the spread per call, plus the peak traced memory of one
+call (measured separately, so tracing does not slow the timings). `--save`
+writes the results with the commit, Python and pypdf versions as JSON;
+`--compare` reads such a file, prints the ratio per stage and exits with
+status 1 when a stage got slower than `--threshold` times before. Stages are
+compared by their fastest sample, which is the least affected by other load
+on the machine, and a stage is only reported when even that sample is slower
+than the previous median plus one standard deviation.
+
+Usage:
+    python bench_cpu_stages.py [--pages 1,5,19] [--rows 1,10,30] [--filter pdf] [--save results.json]
+                               [--compare baseline.json] [--threshold 1.2]
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import pypdf
+
+import fake_gemini
+import lambda_function
+from response_format import COMPACT, FULL, dumps
+from structured_output import EXTRACTION_SCHEMAS, parse_output
+from upload import parse_upload
+
+
+def page_payload(certificate_type: str, page_kb: int, doc_id: str, rng: random.Random) -> bytes:
+    # スキャン画像に近い大きさにするため、圧縮できないデータを付け足す (改行を含まない16進数)
+    return fake_gemini.make_document(certificate_type, doc_id=doc_id) + b" " + rng.randbytes(page_kb * 512).hex().encode()
+
+
+def upload_event(data: bytes, media_type: str) -> dict:
+    return {
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"data": base64.b64encode(data).decode("ascii"), "media_type": media_type}),
+    }
+
+
+def split_pdf(data: bytes) -> list[bytes]:
+    # process_document と同じく、1ページずつ新しい PDF に書き出す
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    pages = []
+    for page in reader.pages:
+        writer = pypdf.PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+def write_and_read(directory: str, data: bytes) -> bytes:
+    # ページの一時ファイルへの書き出しと、モデル呼び出しごとの読み込み (分類・抽出の2回)
+    path = os.path.join(directory, "page.pdf")
+    with open(path, "wb") as f:
+        f.write(data)
+    for _ in range(2):
+        with open(path, "rb") as f:
+            data = f.read()
+    os.unlink(path)
+    return data
+
+
+def model_text(certificate_type: str, rows: int) -> str:
+    return json.dumps(fake_gemini.fake_rows(certificate_type, rows, f"rows-{rows}"), ensure_ascii=False)
+
+
+def build_response(pages: int, rows: int) -> dict:
+    documents = []
+    for page in range(1, pages + 1):
+        certificate_type = "1234"[page % 4]
+        _, get_api_response = lambda_function.CERTIFICATE_EXTRACTORS[certificate_type]
+        documents.append(get_api_response(page, fake_gemini.fake_rows(certificate_type, rows, f"doc-{page}"), certificate_type))
+    return {"Documents": documents}
+
+
+def stages(args, directory: str) -> dict:
+    """Stage name -> zero-argument callable; inputs are built here so only the stage itself is timed."""
+    rng = random.Random(args.seed)
+    result = {}
+    for pages in args.pages:
+        pdf = fake_gemini.make_pdf([page_payload("1234"[page % 4], args.page_kb, str(page), rng) for page in range(pages)],
+                                   args.drawing_ops)
+        event = upload_event(pdf, "application/pdf")
+        result[f"upload.decode.{pages}p"] = lambda event=event: parse_upload(event)
+        result[f"pdf.read.{pages}p"] = lambda pdf=pdf: len(pypdf.PdfReader(io.BytesIO(pdf)).pages)
+        result[f"pdf.split.{pages}p"] = lambda pdf=pdf: split_pdf(pdf)
+
+    page = split_pdf(fake_gemini.make_pdf([page_payload("1", args.page_kb, "page", rng)], args.drawing_ops))[0]
+    image = b"\x89PNG\r\n\x1a\n" + page_payload("1", args.page_kb, "image", rng)
+    result["upload.decode.image"] = lambda event=upload_event(image, "image/png"): parse_upload(event)
+    result["file.write_read.page"] = lambda: write_and_read(directory, page)
+    result["base64.encode.page"] = lambda: base64.b64encode(page)
+
+    for rows in args.rows:
+        text = model_text("1", rows)
+        result[f"output.parse.life.{rows}rows"] = lambda text=text: parse_output(text, EXTRACTION_SCHEMAS["1"])
+    for certificate_type, (_, get_api_response) in lambda_function.CERTIFICATE_EXTRACTORS.items():
+        for rows in args.rows if certificate_type == "1" else args.rows[:1]:
+            outputs = fake_gemini.fake_rows(certificate_type, rows, f"rows-{rows}")
+            result[f"response.build.{certificate_type}.{rows}rows"] = (
+                lambda get=get_api_response, outputs=outputs, certificate_type=certificate_type:
+                get(1, outputs, certificate_type)
+            )
+
+    body = build_response(max(args.pages), max(args.rows))
+    for response_format in (FULL, COMPACT):
+        result[f"response.dumps.{response_format}.{max(args.pages)}p"] = (
+            lambda response_format=response_format: dumps(body, response_format)
+        )
+    return result
+
+
+def calibrate(call, min_time: float) -> int:
+    loops = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(loops):
+            call()
+        if time.perf_counter() - started_at >= min_time or loops >= 1 << 20:
+            return loops
+        loops *= 2
+
+
+def measure(call, samples: int, min_time: float) -> dict:
+    call()  # 初回のみのコスト (遅延インポートなど) は除く
+    loops = calibrate(call, min_time)
+    timings = []
+    for _ in range(samples):
+        started_at = time.perf_counter()
+        for _ in range(loops):
+            call()
+        timings.append((time.perf_counter() - started_at) / loops)
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "stdev_ms": statistics.stdev(timings) * 1000 if len(timings) > 1 else 0.0,
+        "loops": loops,
+        "samples": samples,
+        "peak_kb": peak / 1024,
+    }
+
+
+def metadata() -> dict:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout
+    return {
+        "commit": f"{commit}{'-dirty' if dirty.strip() else ''}" if commit else None,
+        "python": platform.python_version(),
+        "pypdf": pypdf.__version__,
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="1,5,19", help="PDF page counts")
+    parser.add_argument("--rows", default="1,10,30", help="certificate rows in the model outputs")
+    parser.add_argument("--page-kb", type=int, default=300, help="size of one scanned page")
+    parser.add_argument("--drawing-ops", type=int, default=2000, help="line drawings per PDF page")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per sample")
+    parser.add_argument("--filter", default="", help="only stages whose name contains this")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio of the fastest samples reported as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.pages = [int(value) for value in args.pages.split(",")]
+    args.rows = [int(value) for value in args.rows.split(",")]
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        baseline = previous["stages"]
+        print(f"compared with {args.compare} (commit {previous['meta'].get('commit')}, "
+              f"Python {previous['meta'].get('python')}, pypdf {previous['meta'].get('pypdf')})")
+
+    results = {}
+    regressions = []
+    print(f"{'stage':<34}{'median':>11}{'min':>11}{'stdev':>10}{'peak mem':>12}" + (f"{'vs. before':>12}" if baseline else ""))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, call in stages(args, directory).items():
+            if args.filter not in name:
+                continue
+            result = results[name] = measure(call, args.samples, args.min_time)
+            line = (f"{name:<34}{result['median_ms']:>9.3f}ms{result['min_ms']:>9.3f}ms{result['stdev_ms']:>8.3f}ms"
+                    f"{result['peak_kb']:>9.0f} KB")
+            if name in baseline:
+                ratio = result["min_ms"] / baseline[name]["min_ms"]
+                line += f"{ratio:>11.2f}x"
+                # 計測のばらつきの範囲内の差は回帰とみなさない
+                noise = baseline[name]["median_ms"] + baseline[name]["stdev_ms"]
+                if ratio > args.threshold and result["min_ms"] > noise:
+                    line += "  REGRESSION"
+                    regressions.append(name)
+            elif baseline:
+                line += f"{'new':>12}"
+            print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": metadata(), "stages": results}, f, indent=2)
+        print(f"saved to {args.save}")
+    if regressions:
+        print(f"{len(regressions)} stages slower than {args.threshold:.2f}x: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark for per-page failure isolation under injected model failures.
+Compares the previous behaviour (one failing page fails the whole document and
+the client resubmits it) with per-page isolation plus stage-level retries,
+and reports the model calls wasted on results that were never delivered.
+By default the injected failures are terminal, so with isolation they only
+cost their own page. With `--failure-status 503` they are retryable and the
+call-level retry policy is limited to one sweep over a single region, so an
+extraction that exhausts it is retried by the page stage from its
+checkpoint, without classifying the page again.
+
+Usage:
+    python bench_failure_isolation.py [--documents 20] [--pages 5] [--failure-rate 0.1] [--failure-status 503]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+from page_isolation import run_page
+from quota_pool import SlotRouter
+from retry_policy import RetryPolicy
+
+
+def run_legacy(documents: list[list[str]], client_retries: int) -> int:
+    """Any page failure aborts the document; the client resubmits the whole document."""
+    delivered = 0
+    for filepaths in documents:
+        for _ in range(client_retries + 1):
+            try:
+                for page, filepath in enumerate(filepaths, start=1):
+                    lambda_function.execute_extraction(filepath, page, "image/png")
+            except Exception:
+                continue
+            delivered += len(filepaths)
+            break
+    return delivered
+
+
+def run_isolated(documents: list[list[str]], retries: int) -> int:
+    delivered = 0
+    for filepaths in documents:
+        for page, filepath in enumerate(filepaths, start=1):
+            document, _ = run_page(
+                lambda checkpoint: lambda_function.execute_extraction(filepath, page, "image/png", checkpoint=checkpoint),
+                page,
+                retries,
+            )
+            delivered += 1 if document else 0
+    return delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--retries", type=int, default=1, help="client resubmissions (legacy) / stage retries (isolated)")
+    parser.add_argument("--failure-status", type=int, default=None, help="HTTP status of the failures (default: terminal)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.failure_status is not None:
+        # 呼び出し単位の再試行は1リージョンを1巡で諦め、ページ段階の再試行に任せる
+        lambda_function.retry_policy = RetryPolicy(base_delay=0.0, max_delay=0.0, max_sweeps=1)
+        lambda_function.slot_router = SlotRouter(
+            [(os.environ["VERTEX_AI_PROJECT_ID"], None)], ["us-central1"], lambda_function.slot_router.client_factory
+        )
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        documents = []
+        for doc_index in range(args.documents):
+            filepaths = []
+            for page in range(args.pages):
+                filepath = os.path.join(temp_dir, f"doc_{doc_index}_page_{page}.png")
+                with open(filepath, "wb") as f:
+                    f.write(fake_gemini.make_document(rng.choice("1234"), doc_id=f"{doc_index}-{page}"))
+                filepaths.append(filepath)
+            documents.append(filepaths)
+
+        total_pages = args.documents * args.pages
+        print(f"{'mode':<10} {'delivered':>10} {'model calls':>12} {'failed calls':>13} {'wasted calls':>13} {'calls/page':>11}")
+        for mode in ("legacy", "isolated"):
+            fake = fake_gemini.FakeGeminiClient(0.0, 0.0, seed=args.seed, failure_rate=args.failure_rate,
+                                                failure_status=args.failure_status)
+            fake_gemini.install(lambda_function, fake)
+            with contextlib.redirect_stdout(io.StringIO()):
+                if mode == "legacy":
+                    delivered = run_legacy(documents, args.retries)
+                else:
+                    delivered = run_isolated(documents, args.retries)
+            calls = sum(fake.calls.values())
+            # 配信されたページは判定と抽出の2回の呼び出しのみが有効
+            wasted = calls - 2 * delivered
+            print(
+                f"{mode:<10} {delivered:>5}/{total_pages:<4} {calls:>12} {fake.failures:>13} {wasted:>13} "
+                f"{calls / max(delivered, 1):>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark for per-stage model routing against the fake Gemini backend.
+Runs the same pages with flash for every call (the previous configuration),
+with a light classification model and no escalation, with the light model
+plus escalation to flash, and with light models for both stages plus
+escalation, and reports per-page latency, calls and tokens per
+tier and accuracy against the ground truth. The fake makes the light model
+faster but wrong on `--weak-error-rate` of its calls (misclassifying or
+dropping extracted fields). `--wrong-type-share` of the misclassifications
+name another certificate type instead of "0"; escalation only fires on "0",
+so these pages stay wrong, and each configuration reports the accuracy it
+loses next to the latency and tokens it saves against flash only. Recorded
+traffic is compared the same way with evaluate_corpus.py, whose report
+includes the per-tier counters.
+
+Usage:
+    python bench_model_routing.py [--pages 200] [--weak-error-rate 0.05] [--wrong-type-share 0.5]
+                                  [--unknown-share 0.05]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+from load_test import percentile
+from model_routing import ModelRouter
+from page_isolation import run_page
+
+FLASH = "gemini-2.5-flash"
+LITE = "gemini-2.5-flash-lite"
+
+CONFIGURATIONS = (
+    ("flash only", ModelRouter(FLASH, FLASH, FLASH)),
+    ("lite, no escalation", ModelRouter(LITE, FLASH, LITE)),
+    ("lite + escalation", ModelRouter(LITE, FLASH, FLASH)),
+    ("all lite + escalation", ModelRouter(LITE, LITE, FLASH)),
+)
+
+
+def expected_document(certificate_type: str, rows: int, doc_id: str) -> dict:
+    if certificate_type not in lambda_function.CERTIFICATE_EXTRACTORS:
+        return lambda_function.get_default_api_response()
+    _, get_api_response = lambda_function.CERTIFICATE_EXTRACTORS[certificate_type]
+    return get_api_response(1, fake_gemini.fake_rows(certificate_type, rows, doc_id), certificate_type)
+
+
+def run(pages: list[tuple[str, str, dict]], router: ModelRouter, args) -> dict:
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed,
+                                        weak_models=(LITE,), weak_error_rate=args.weak_error_rate,
+                                        weak_latency_factor=args.weak_latency_factor,
+                                        weak_wrong_type_share=args.wrong_type_share)
+    fake_gemini.install(lambda_function, fake)
+    lambda_function.model_router = router
+
+    latencies = []
+    correct_types = correct_documents = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for filepath, certificate_type, expected in pages:
+            started_at = time.perf_counter()
+            document, _ = run_page(
+                lambda checkpoint: lambda_function.execute_extraction(filepath, 1, "image/png", checkpoint=checkpoint),
+                1,
+            )
+            latencies.append(time.perf_counter() - started_at)
+            correct_types += document is not None and document["CertificateType"] == certificate_type
+            correct_documents += document == expected
+    return {
+        "latencies": sorted(latencies),
+        "type_accuracy": correct_types / len(pages),
+        "document_accuracy": correct_documents / len(pages),
+        "summary": router.summary(),
+    }
+
+
+def tokens(result: dict) -> float:
+    return sum((stats["input_tokens_per_call"] + stats["output_tokens_per_call"]) * stats["calls"]
+               for stats in result["summary"]["tiers"].values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=3, help="certificate rows per page")
+    parser.add_argument("--unknown-share", type=float, default=0.05, help="pages that really are type 0")
+    parser.add_argument("--weak-error-rate", type=float, default=0.05)
+    parser.add_argument("--wrong-type-share", type=float, default=0.5,
+                        help="misclassifications that name another type instead of \"0\"")
+    parser.add_argument("--weak-latency-factor", type=float, default=0.5)
+    parser.add_argument("--classify-latency", type=float, default=0.02)
+    parser.add_argument("--extract-latency", type=float, default=0.04)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pages = []
+        for index in range(args.pages):
+            certificate_type = "0" if rng.random() < args.unknown_share else rng.choice("1234")
+            filepath = os.path.join(temp_dir, f"page_{index:04d}.png")
+            with open(filepath, "wb") as f:
+                f.write(fake_gemini.make_document(certificate_type, rows=args.rows, doc_id=str(index)))
+            pages.append((filepath, certificate_type, expected_document(certificate_type, args.rows, str(index))))
+
+        print(f"{args.pages} pages, light model error rate {args.weak_error_rate:.0%} "
+              f"({args.wrong_type_share:.0%} of misclassifications name a wrong type), {args.unknown_share:.0%} unknown pages")
+        print(f"{'configuration':<22}{'p50':>8}{'p95':>8}{'type acc':>10}{'doc acc':>10}  tiers (calls, tokens/call)")
+        baseline = None
+        for name, router in CONFIGURATIONS:
+            result = run(pages, router, args)
+            baseline = baseline or result
+            tiers = ", ".join(
+                f"{tier} {stats['calls']} x {stats['input_tokens_per_call'] + stats['output_tokens_per_call']:.0f}"
+                for tier, stats in result["summary"]["tiers"].items()
+            )
+            print(f"{name:<22}{percentile(result['latencies'], 0.5):>7.3f}s{percentile(result['latencies'], 0.95):>7.3f}s"
+                  f"{result['type_accuracy']:>10.1%}{result['document_accuracy']:>10.1%}  {tiers}")
+            if result["summary"]["escalations"]:
+                print(f"{'':<22}escalations: {result['summary']['escalations']}")
+            if result is not baseline:
+                # 節約と引き換えに失う精度 (種類の取り違えは昇格では直らない)
+                print(f"{'':<22}vs. flash only: p50 {1 - percentile(result['latencies'], 0.5) / percentile(baseline['latencies'], 0.5):.0%} "
+                      f"faster, tokens {tokens(result) / tokens(baseline) - 1:+.0%}, "
+                      f"type accuracy {(result['type_accuracy'] - baseline['type_accuracy']) * 100:+.1f} pts, "
+                      f"document accuracy {(result['document_accuracy'] - baseline['document_accuracy']) * 100:+.1f} pts")
+
+
+if __name__ == "__main__":
+    main()
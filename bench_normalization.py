@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark for local normalization against the fake Gemini backend.
+Runs lambda_function.execute_extraction on synthetic certificates with the
+prompts from before local normalization (read from git, `--baseline-ref`) and
+model output used as returned, and with the current, shorter prompts and the
+local normalization layer, and reports input tokens per call and field
+agreement with the ground truth. The fake backend copies dates, amounts and names as printed when the
+prompt does not ask it to convert them, as the model does. Schema-less JSON
+mode is included because amounts are only returned as text there.
+
+Usage:
+    python bench_normalization.py [--pages 200] [--rows 2] [--baseline-ref <commit>]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import subprocess
+import tempfile
+from collections import Counter
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+import structured_output
+from evaluate_corpus import compare_documents
+from normalization import normalize_output
+from model_routing import ModelRouter
+
+PROMPT_FILES = ["prompt_certificate_type.txt", *(prompt for prompt, _ in lambda_function.CERTIFICATE_EXTRACTORS.values())]
+
+
+def baseline_ref() -> str:
+    # 正規化を追加したコミットの親 (未コミットなら HEAD) のプロンプトを比較対象にする
+    added = subprocess.run(
+        ["git", "log", "--diff-filter=A", "--format=%H", "--", "normalization.py"],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return f"{added[-1]}^" if added else "HEAD"
+
+
+def write_prompts(ref: str, directory: str):
+    for prompt_file in PROMPT_FILES:
+        text = subprocess.run(["git", "show", f"{ref}:{prompt_file}"], capture_output=True, text=True, check=True).stdout
+        with open(os.path.join(directory, prompt_file), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def expected_document(certificate_type: str, rows: int, doc_id: str, page: int) -> dict:
+    _, get_api_response = lambda_function.CERTIFICATE_EXTRACTORS[certificate_type]
+    return get_api_response(page, fake_gemini.fake_rows(certificate_type, rows, doc_id), certificate_type)
+
+
+def run(pages: list[tuple[str, str, dict]], prompt_dir: str, normalize: bool, schemas: bool) -> tuple[float, float, int]:
+    fake_gemini.install(lambda_function, fake_gemini.FakeGeminiClient(0, 0, jitter=0))
+    lambda_function.STRUCTURED_OUTPUT_SCHEMAS = schemas
+    lambda_function.model_router = ModelRouter.from_env()
+    # 以前のプロンプトはモデルに書式を変換させていたため、出力をそのまま使う
+    structured_output.normalize_output = normalize_output if normalize else lambda value, schema: value
+
+    counts = Counter()
+    failed_pages = 0
+    cwd = os.getcwd()
+    os.chdir(prompt_dir)  # プロンプトはカレントディレクトリから読まれる
+    lambda_function.read_prompt.cache_clear()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for page, (filepath, certificate_type, expected) in enumerate(pages, start=1):
+                try:
+                    document = lambda_function.execute_extraction(filepath, page, "image/png", certificate_type)
+                except Exception:
+                    failed_pages += 1
+                    document = {}
+                counts.update(compare_documents([expected], [document]))
+    finally:
+        os.chdir(cwd)
+
+    tiers = lambda_function.model_router.summary()["tiers"].values()
+    calls = sum(tier["calls"] for tier in tiers)
+    input_tokens = sum(tier["input_tokens_per_call"] * tier["calls"] for tier in tiers) / calls
+    fields = sum(count for key, count in counts.items() if key.endswith(".fields"))
+    correct = sum(count for key, count in counts.items() if key.endswith(".correct"))
+    return input_tokens, correct / fields, failed_pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=2, help="certificate rows per page")
+    parser.add_argument("--baseline-ref", default=None, help="git revision with the previous prompts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pages = []
+        for index in range(args.pages):
+            certificate_type = rng.choice("1234")
+            filepath = os.path.join(temp_dir, f"page_{index:04d}.png")
+            with open(filepath, "wb") as f:
+                f.write(fake_gemini.make_document(certificate_type, rows=args.rows, doc_id=str(index)))
+            pages.append((filepath, certificate_type, expected_document(certificate_type, args.rows, str(index), index + 1)))
+        baseline_dir = os.path.join(temp_dir, "baseline")
+        os.makedirs(baseline_dir)
+        ref = args.baseline_ref or baseline_ref()
+        write_prompts(ref, baseline_dir)
+
+        print(f"{args.pages} pages x {args.rows} rows, previous prompts from {ref}")
+        print(f"{'prompts':<10}{'normalization':<15}{'output':<8}{'input tokens/call':>19}{'agreement':>11}{'failed':>8}")
+        for schemas in (True, False):
+            for name, prompt_dir, normalize in (("previous", baseline_dir, False), ("current", os.getcwd(), True)):
+                input_tokens, agreement, failed_pages = run(pages, prompt_dir, normalize, schemas)
+                print(f"{name:<10}{'on' if normalize else 'off':<15}{'schema' if schemas else 'json':<8}"
+                      f"{input_tokens:>19.1f}{agreement:>11.1%}{failed_pages:>8}")
+
+
+if __name__ == "__main__":
+    main()
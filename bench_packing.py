@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark for packing same-type small certificates into one extraction call.
+Sends one batch request of `--files` one-page images (mostly social insurance
+and small mutual aid certificates, the rest life and earthquake insurance)
+through lambda_function.lambda_handler against the fake Gemini backend, once
+per pack size. Reports the extraction calls, the input tokens sent per
+extracted page (the prompt is sent once per call, each image adds its own
+tokens), the batch latency, the packer's counters and how many fields agree
+with the unpacked run. The last row drops one image's result from
+`--mismatch-rate` of the packed calls to show the fallback to single calls.
+
+Usage:
+    python bench_packing.py [--files 20] [--pack-sizes 1,2,4,8] [--concurrency 8] [--mismatch-rate 0.3]
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from collections import Counter
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+os.environ.setdefault("API_KEY", "bench")
+
+import batch_request
+import fake_gemini
+import lambda_function
+from evaluate_corpus import compare_documents
+from model_routing import ModelRouter
+from packing import ExtractionPacker
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def batch_event(files: int, small_share: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    items = []
+    for index in range(files):
+        certificate_type = rng.choice("34") if rng.random() < small_share else rng.choice("12")
+        data = PNG_SIGNATURE + fake_gemini.make_document(certificate_type, rows=1, doc_id=f"packing-{index}")
+        items.append({"name": f"certificate{index}", "data": base64.b64encode(data).decode("ascii"),
+                      "media_type": "image/png"})
+    return {
+        "rawPath": "/batch",
+        "headers": {"Authorization": f"Bearer {os.environ['API_KEY']}", "Content-Type": "application/json"},
+        "body": json.dumps({"files": items}),
+    }
+
+
+def run(request: dict, pack_size: int, mismatch_rate: float, args) -> dict:
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed,
+                                        pack_error_rate=mismatch_rate)
+    fake_gemini.install(lambda_function, fake)
+    lambda_function.model_router = ModelRouter()
+    lambda_function.extraction_packer = ExtractionPacker(pack_size=pack_size, linger=args.linger)
+    lambda_function.batch_scheduler = batch_request.BatchScheduler(lambda_function.process_page, args.concurrency)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started_at = time.perf_counter()
+        response = lambda_function.lambda_handler(request, None)
+        elapsed = time.perf_counter() - started_at
+    assert response["statusCode"] == 200, response
+    files = [item["Documents"] for item in json.loads(response["body"])["Files"]]
+
+    tiers = lambda_function.model_router.summary()["tiers"]
+    extraction = [tier for key, tier in tiers.items() if key.startswith("extraction@")]
+    return {
+        "elapsed": elapsed,
+        "calls": sum(tier["calls"] for tier in extraction),
+        "input_tokens": sum(tier["input_tokens_per_call"] * tier["calls"] for tier in extraction),
+        "pages": sum(len(documents) for documents in files),
+        "files": files,
+        "packing": lambda_function.extraction_packer.summary(),
+    }
+
+
+def agreement(expected: list[list[dict]], actual: list[list[dict]]) -> float:
+    # 1ページの画像ばかりなので、ファイルごとに比べる
+    counts = Counter()
+    for expected_documents, actual_documents in zip(expected, actual):
+        counts.update(compare_documents(expected_documents, actual_documents))
+    fields = sum(value for key, value in counts.items() if key.endswith(".fields"))
+    correct = sum(value for key, value in counts.items() if key.endswith(".correct"))
+    return correct / fields if fields else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20, help="one-page images in the batch")
+    parser.add_argument("--small-share", type=float, default=0.75, help="share of social insurance / small mutual aid")
+    parser.add_argument("--pack-sizes", default="1,2,4,8")
+    parser.add_argument("--concurrency", type=int, default=8, help="batch scheduler concurrency")
+    parser.add_argument("--linger", type=float, default=0.3, help="seconds the first page waits for others")
+    parser.add_argument("--mismatch-rate", type=float, default=0.3, help="share of packed calls missing a result")
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    pack_sizes = [int(value) for value in args.pack_sizes.split(",")]
+
+    request = batch_event(args.files, args.small_share, args.seed)
+    runs = [(f"pack {size}", size, 0.0) for size in pack_sizes]
+    runs.append((f"pack {max(pack_sizes)}, {args.mismatch_rate:.0%} mismatch", max(pack_sizes), args.mismatch_rate))
+
+    print(f"{args.files} one-page files, {args.small_share:.0%} social insurance / small mutual aid, "
+          f"batch concurrency {args.concurrency}, linger {args.linger:.2f} s")
+    print(f"{'run':<24}{'latency':>9}{'extract calls':>15}{'tokens/page':>13}{'packed':>8}{'mismatches':>12}"
+          f"{'fallbacks':>11}{'agreement':>11}")
+    baseline = None
+    for name, pack_size, mismatch_rate in runs:
+        result = run(request, pack_size, mismatch_rate, args)
+        baseline = baseline or result
+        packing = result["packing"]
+        print(f"{name:<24}{result['elapsed']:>8.2f}s{result['calls']:>15}{result['input_tokens'] / result['pages']:>13.0f}"
+              f"{packing.get('packed_images', 0):>8}{packing.get('mismatches', 0):>12}{packing.get('fallback_calls', 0):>11}"
+              f"{agreement(baseline['files'], result['files']):>11.1%}")
+        if result is not baseline:
+            print(f"{'':<24}calls {result['calls'] / baseline['calls'] - 1:+.0%}, input tokens "
+                  f"{result['input_tokens'] / baseline['input_tokens'] - 1:+.0%}, "
+                  f"latency {result['elapsed'] / baseline['elapsed']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
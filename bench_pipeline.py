@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the multi-process batch pipeline against the fake Gemini backend.
+Runs the same synthetic PDFs through the sequential main.py loop and through
+BatchPipeline, and prints per-stage utilization for sizing the pools.
+
+Usage:
+    python bench_pipeline.py [--files 20] [--pages 5] [--processes 4] [--io-workers 16]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from pprint import pprint
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import main as batch
+from pipeline import BatchPipeline
+from progress import BatchProgress
+from result_store import JsonlResultStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--drawing-ops", type=int, default=20000, help="vector drawing ops per page (PDF size/CPU cost)")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--io-workers", type=int, default=16)
+    parser.add_argument("--classify-latency", type=float, default=0.1)
+    parser.add_argument("--extract-latency", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed)
+    fake_gemini.install(batch, fake)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepaths = []
+        for file_index in range(args.files):
+            documents = [fake_gemini.make_document(rng.choice("1234"), doc_id=f"{file_index}-{page}")
+                         for page in range(args.pages)]
+            filepath = os.path.join(temp_dir, f"file_{file_index:03d}.pdf")
+            with open(filepath, "wb") as f:
+                f.write(fake_gemini.make_pdf(documents, args.drawing_ops))
+            filepaths.append(filepath)
+        size_mb = sum(os.path.getsize(path) for path in filepaths) / 1024 / 1024
+        print(f"{args.files} PDFs x {args.pages} pages ({size_mb:.1f} MB)")
+
+        store = JsonlResultStore(os.path.join(temp_dir, "sequential.jsonl"))
+        progress = BatchProgress(len(filepaths))
+        started_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for filepath in filepaths:
+                batch.process_and_record(filepath, store, "bench", progress)
+        sequential = time.perf_counter() - started_at
+
+        store = JsonlResultStore(os.path.join(temp_dir, "pipeline.jsonl"))
+        pipeline = BatchPipeline(
+            lambda page_filepath, page, mime_type, checkpoint: batch.execute_extraction(
+                page_filepath, page, mime_type, checkpoint=checkpoint
+            ),
+            store, "bench", processes=args.processes, io_workers=args.io_workers, queue_size=args.io_workers * 4,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = pipeline.run(filepaths)
+
+    total_pages = args.files * args.pages
+    print(f"sequential: {sequential:6.2f} s ({total_pages / sequential:6.1f} pages/s)")
+    print(f"pipeline:   {report['wall_seconds']:6.2f} s ({total_pages / report['wall_seconds']:6.1f} pages/s), "
+          f"{args.processes} processes, {args.io_workers} I/O workers")
+    print("Stage utilization:")
+    pprint(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark for quota pooling across GCP projects against the fake Gemini backend.
+The fake accepts `--slot-quota` concurrent calls per project x region slot and
+answers 429 beyond that. Many workers keep calling
+lambda_function.execute_extraction on distinct pages for `--duration` seconds
+while the slot router spreads the calls over 1, 2 and 4 projects in the same
+regions, and the benchmark reports pages per second, the 429s returned, pages
+that failed after all retries and how the calls were spread over the slots.
+The global adaptive limit is turned off so only the pool limits the calls.
+
+Usage:
+    python bench_quota_pool.py [--projects 1,2,4] [--regions 2] [--slot-quota 4] [--workers 48] [--duration 8]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+from concurrency_limit import AdaptiveLimiter
+from quota_pool import SlotRouter
+from retry_policy import RetryPolicy
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def run(projects: int, args) -> dict:
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed,
+                                        slot_quota=args.slot_quota)
+    fake_gemini.install(lambda_function, fake)
+    # 冷却時間はシミュレーションの遅延に合わせて短くする
+    lambda_function.slot_router = SlotRouter(
+        [(f"project-{index}", None) for index in range(projects)],
+        lambda_function.VERTEX_AI_REGIONS[:args.regions],
+        lambda_function.slot_router.client_factory,
+        capacity=args.slot_quota * 2,
+        cooldown=0.2,
+        max_cooldown=2.0,
+    )
+    completed, failed = [], []
+
+    def worker(index: int, directory: str):
+        rng = random.Random(args.seed + index)
+        number = 0
+        while time.monotonic() - fake.started_at < args.duration:
+            # 重複排除が働かないよう、ページごとに異なる文書を使う
+            filepath = os.path.join(directory, f"worker{index}-{number}.png")
+            with open(filepath, "wb") as f:
+                f.write(PNG_SIGNATURE + fake_gemini.make_document(rng.choice("1234"), doc_id=f"{index}-{number}"))
+            try:
+                lambda_function.execute_extraction(filepath, 1, "image/png")
+                completed.append(time.monotonic() - fake.started_at)
+            except Exception:
+                failed.append(time.monotonic() - fake.started_at)
+            number += 1
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=worker, args=(index, directory)) for index in range(args.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    total_calls = sum(fake.slot_calls.values())
+    return {
+        "pages_per_second": sum(1 for finished_at in completed if finished_at <= args.duration) / args.duration,
+        "throttled": fake.throttled,
+        "failed": len(failed),
+        "busiest_slot_share": max(fake.slot_calls.values()) / total_calls if total_calls else 0.0,
+        "slots_used": sum(1 for calls in fake.slot_calls.values() if calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", default="1,2,4", help="project counts to compare")
+    parser.add_argument("--regions", type=int, default=2, help="regions per project")
+    parser.add_argument("--slot-quota", type=int, default=4, help="concurrent calls each slot accepts")
+    parser.add_argument("--workers", type=int, default=48, help="threads issuing pages at the same time")
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    lambda_function.call_limiter = AdaptiveLimiter(enabled=False)
+    lambda_function.retry_policy = RetryPolicy(base_delay=0.05, max_delay=0.5, total_budget=10.0)
+
+    print(f"{args.workers} workers, {args.regions} regions, {args.slot_quota} concurrent calls per slot, "
+          f"{args.duration:.0f} s")
+    print(f"{'projects':<10}{'slots':>6}{'pages/s':>9}{'429s':>8}{'failed':>8}{'busiest slot':>14}")
+    baseline = None
+    for projects in map(int, args.projects.split(",")):
+        result = run(projects, args)
+        baseline = baseline or result["pages_per_second"]
+        print(f"{projects:<10}{result['slots_used']:>6}{result['pages_per_second']:>9.2f}{result['throttled']:>8}"
+              f"{result['failed']:>8}{result['busiest_slot_share']:>13.0%}"
+              f"  {result['pages_per_second'] / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
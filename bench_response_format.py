@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the response formats on large multi-row documents.
+Builds Lambda response bodies with the real response builders and compares
+payload size and serialization time of the full (default) and compact formats.
+
+Usage:
+    python bench_response_format.py [--pages 19] [--rows 30] [--repeat 50]
+"""
+
+import argparse
+import json
+import os
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+import response_format
+
+
+def build_body(pages: int, rows: int) -> dict:
+    documents = []
+    for page in range(1, pages + 1):
+        certificate_type = "1234"[page % 4]
+        outputs = fake_gemini.fake_rows(certificate_type, rows, f"doc-{page}")
+        _, get_api_response = lambda_function.CERTIFICATE_EXTRACTORS[certificate_type]
+        documents.append(get_api_response(page, outputs, certificate_type))
+    return {"Documents": documents}
+
+
+def measure(serialize, body: dict, repeat: int) -> tuple[int, float]:
+    payload = serialize(body)
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        serialize(body)
+    return len(payload.encode("utf-8")), (time.perf_counter() - started_at) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=19, help="pages per response (the handler accepts up to 19)")
+    parser.add_argument("--rows", type=int, default=30, help="certificate rows per page")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    body = build_body(args.pages, args.rows)
+    # 互換性の確認: compact は placeholder の位置と空リストを除いた full と同じ内容になる
+    full = json.loads(response_format.dumps(body))
+    assert full == json.loads(json.dumps(body, ensure_ascii=False))
+    assert json.loads(response_format.dumps(body, response_format.COMPACT)) == response_format.compact(full)
+
+    variants = [
+        ("full (json)", lambda b: response_format.dumps(b, response_format.FULL)),
+        ("compact (json)", lambda b: json.dumps(response_format.compact(b), ensure_ascii=False, separators=(",", ":"))),
+    ]
+    if response_format.orjson is not None:
+        variants.append(("compact (orjson)", lambda b: response_format.dumps(b, response_format.COMPACT)))
+    else:
+        print("orjson is not installed; compact responses fall back to json")
+
+    print(f"{args.pages} pages x {args.rows} rows")
+    print(f"{'format':<18}{'bytes':>12}{'ms':>10}{'size':>8}{'time':>8}")
+    baseline_size, baseline_time = None, None
+    for name, serialize in variants:
+        size, seconds = measure(serialize, body, args.repeat)
+        baseline_size = baseline_size or size
+        baseline_time = baseline_time or seconds
+        print(f"{name:<18}{size:>12,}{seconds * 1000:>10.2f}{size / baseline_size:>8.0%}{seconds / baseline_time:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
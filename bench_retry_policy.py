@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Simulation comparing the retry policy engine with the previous fixed retry loop
+(0.5-1.0 s sleep before every attempt, 2**retry backoff after sweeping all regions).
+Runs on a virtual clock, so it finishes instantly and spends no quota.
+
+Usage:
+    python bench_retry_policy.py [--calls 200] [--seed 0]
+"""
+
+import argparse
+import contextlib
+import io
+import random
+
+from google.genai import errors
+
+from retry_policy import RetryPolicy
+
+REGIONS = 11
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+        self.idle = 0.0
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+        self.idle += seconds
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class SimulatedVertex:
+    """
+    Regions with token-bucket quotas and an optional outage window.
+
+    Args:
+        clock (VirtualClock): Shared virtual clock
+        rates (list[float]): Allowed calls per second for each region
+        latency (float): Seconds per successful call
+        outage (tuple): (start, end) virtual seconds during which every region returns 503
+        terminal_every (int): Every n-th call fails with 400 INVALID_ARGUMENT (0 = never)
+    """
+
+    def __init__(self, clock: VirtualClock, rates: list[float], latency: float = 1.0,
+                 outage: tuple = (0.0, 0.0), terminal_every: int = 0):
+        self.clock = clock
+        self.rates = rates
+        self.latency = latency
+        self.outage = outage
+        self.terminal_every = terminal_every
+        self.tokens = [1.0] * len(rates)
+        self.updated_at = [0.0] * len(rates)
+        self.region = 0
+        self.attempts = 0
+        self.calls = 0
+
+    def failover(self):
+        self.region = (self.region + 1) % len(self.rates)
+
+    def reset(self):
+        self.region = 0
+
+    def call(self, index: int):
+        self.attempts += 1
+        self.clock.advance(0.05)  # エラー応答までの往復時間
+        region = self.region
+        rate = self.rates[region]
+        self.tokens[region] = min(1.0, self.tokens[region] + (self.clock.now - self.updated_at[region]) * rate)
+        self.updated_at[region] = self.clock.now
+
+        if self.terminal_every and index % self.terminal_every == 0:
+            raise errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT", "message": "bad"}})
+        if self.outage[0] <= self.clock.now < self.outage[1]:
+            raise errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "Service unavailable"}})
+        if self.tokens[region] < 1.0:
+            retry_delay = (1.0 - self.tokens[region]) / rate
+            raise errors.ClientError(429, {"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Resource exhausted",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay:.3f}s"}],
+            }})
+        self.tokens[region] -= 1.0
+        self.clock.advance(self.latency)
+        self.calls += 1
+        return {"ok": True}
+
+
+def legacy_execute(call, backend: SimulatedVertex, sleep, rng: random.Random, max_retries: int = 3):
+    """The retry loop previously found in `__execute_vertex_ai_with_retry`."""
+    def is_429(e):
+        return "429" in str(e) or "Resource exhausted" in str(e)
+
+    def is_503(e):
+        return "503" in str(e) or "Service unavailable" in str(e) or "Candidates token count is None" in str(e)
+
+    for region_attempt in range(REGIONS):
+        try:
+            sleep(rng.uniform(0.5, 1.0))
+            result = call()
+            if region_attempt > 0:
+                backend.reset()
+            return result
+        except Exception as e:
+            if is_429(e) or is_503(e):
+                backend.failover()
+                continue
+            raise e
+
+    for retry in range(max_retries):
+        sleep((2**retry) + rng.uniform(0, 1))
+        for _ in range(REGIONS):
+            try:
+                result = call()
+                backend.reset()
+                return result
+            except Exception as e:
+                if not is_429(e) and not is_503(e):
+                    raise e
+                backend.failover()
+
+    raise Exception("All retries exhausted")
+
+
+def simulate(name: str, scenario: dict, calls: int, seed: int) -> dict:
+    clock = VirtualClock()
+    backend = SimulatedVertex(clock, **scenario)
+    rng = random.Random(seed)
+    policy = RetryPolicy(sleep=clock.sleep, clock=lambda: clock.now, rng=random.Random(seed))
+
+    succeeded = failed = 0
+    for index in range(1, calls + 1):
+        call = lambda timeout=None: backend.call(index)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if name == "legacy":
+                    legacy_execute(call, backend, clock.sleep, rng)
+                else:
+                    policy.execute(call, regions=REGIONS, failover=backend.failover, recovered=backend.reset)
+            succeeded += 1
+        except Exception:
+            failed += 1
+
+    return {
+        "elapsed": clock.now,
+        "idle": clock.idle,
+        "attempts": backend.attempts,
+        "succeeded": succeeded,
+        "failed": failed,
+    }
+
+
+SCENARIOS = {
+    # 東京リージョンのみ余裕があり、他のリージョンも低いクォータを持つ
+    "steady_quota": {"rates": [0.8] + [0.1] * (REGIONS - 1)},
+    # 全リージョンが混雑している
+    "saturated": {"rates": [0.3] * REGIONS},
+    # 10〜25秒の間は全リージョンが503を返す
+    "outage": {"rates": [5.0] * REGIONS, "outage": (10.0, 25.0)},
+    # 20回に1回リトライ不可能なエラー
+    "terminal_errors": {"rates": [5.0] * REGIONS, "terminal_every": 20},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'scenario':<16} {'engine':<8} {'elapsed s':>10} {'idle s':>9} {'idle/call':>10} {'attempts':>9} {'ok':>5} {'failed':>7}")
+    for scenario_name, scenario in SCENARIOS.items():
+        for engine in ("legacy", "policy"):
+            result = simulate(engine, scenario, args.calls, args.seed)
+            print(
+                f"{scenario_name:<16} {engine:<8} {result['elapsed']:>10.1f} {result['idle']:>9.1f} "
+                f"{result['idle'] / args.calls:>10.2f} {result['attempts']:>9} {result['succeeded']:>5} {result['failed']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
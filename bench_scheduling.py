@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark for batch scheduling policies against the fake Gemini backend.
+Builds a mixed-customer run (one folder per customer, a few large PDFs among
+many single-page images, one customer with far more files than the others)
+and processes it with main.process_file in FIFO (name) order, shortest job
+first and fair share, reporting the measured mean / p95 completion time, each
+customer's mean completion time and the estimate main.py prints for the same
+run. The largest customer's scans are also the smallest files, so shortest job
+first alone serves that customer before anyone else.
+
+Usage:
+    python bench_scheduling.py [--images 60] [--large-pdfs 3] [--large-pages 19]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import main as pipeline
+from scheduling import POLICIES, CompletionTracker, file_cost, order_files
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 顧客ごとのファイル数の比率と画像の大きさ (最初の顧客が大半を占め、画像も小さい)
+CUSTOMERS = {"customer_a": (0.6, 0), "customer_b": (0.25, 20_000), "customer_c": (0.15, 40_000)}
+
+
+def build_corpus(root: str, images: int, large_pdfs: int, large_pages: int, rng: random.Random) -> list[str]:
+    filepaths = []
+    for customer, (share, padding) in CUSTOMERS.items():
+        os.makedirs(os.path.join(root, customer))
+        for index in range(max(1, round(images * share))):
+            filepath = os.path.join(root, customer, f"{index:04d}.png")
+            with open(filepath, "wb") as f:
+                f.write(PNG_SIGNATURE + fake_gemini.make_document(rng.choice("1234"), doc_id=f"{customer}-{index}"))
+                f.write(b"\0" * padding)
+            filepaths.append(filepath)
+    for index in range(large_pdfs):
+        # 大きな PDF は名前順で先頭に来るようにする
+        filepath = os.path.join(root, "customer_a", f"0000_bundle_{index}.pdf")
+        documents = [fake_gemini.make_document(rng.choice("1234"), doc_id=f"bundle-{index}-{page}")
+                     for page in range(large_pages)]
+        with open(filepath, "wb") as f:
+            f.write(fake_gemini.make_pdf(documents, drawing_ops=50))
+        filepaths.append(filepath)
+    return sorted(filepaths)
+
+
+def run(filepaths: list[str], policy: str, costs: dict) -> dict:
+    tracker = CompletionTracker()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for filepath in order_files(filepaths, policy, costs):
+            pipeline.process_file(filepath)
+            tracker.done(filepath)
+    return tracker.report(policy, filepaths, costs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=60, help="single-page images across all customers")
+    parser.add_argument("--large-pdfs", type=int, default=3)
+    parser.add_argument("--large-pages", type=int, default=19)
+    parser.add_argument("--classify-latency", type=float, default=0.01)
+    parser.add_argument("--extract-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed)
+    fake_gemini.install(pipeline, fake)
+
+    with tempfile.TemporaryDirectory() as root:
+        filepaths = build_corpus(root, args.images, args.large_pdfs, args.large_pages, random.Random(args.seed))
+        costs = {filepath: file_cost(filepath) for filepath in filepaths}
+        print(f"{len(filepaths)} files, {sum(pages for pages, _ in costs.values())} pages, "
+              f"{len(CUSTOMERS)} customers")
+        print(f"{'policy':<8}{'mean':>9}{'p95':>9}{'estimated':>11}{'vs fifo':>9}  mean per customer")
+        baseline = None
+        for policy in POLICIES:
+            report = run(filepaths, policy, costs)
+            baseline = baseline or report["mean_completion_seconds"]
+            print(f"{policy:<8}{report['mean_completion_seconds']:>8.2f}s{report['p95_completion_seconds']:>8.2f}s"
+                  f"{report['estimated_mean_completion_seconds'][policy]:>10.2f}s"
+                  f"{baseline / report['mean_completion_seconds']:>8.1f}x  "
+                  + "  ".join(f"{os.path.basename(folder)} {seconds:.2f}s"
+                              for folder, seconds in report["folder_mean_completion_seconds"].items()))
+
+
+if __name__ == "__main__":
+    main()
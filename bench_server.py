@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the self-hosted server against the fake Gemini backend.
+Sends the same number of documents through a sequential lambda_handler
+invocation loop (one request at a time, as a single Lambda instance sees them)
+and through server.py with concurrent HTTP clients, and compares throughput
+and latency.
+
+Usage:
+    python bench_server.py [--requests 64] [--workers 8] [--clients 16]
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+os.environ.setdefault("API_KEY", "bench")
+
+import requests
+
+import fake_gemini
+import lambda_function
+from load_test import percentile
+from server import ExtractionServer
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_documents(count: int, rng: random.Random, prefix: str) -> list[bytes]:
+    # 重複排除が働かないよう、すべて異なる内容にする
+    return [PNG_SIGNATURE + fake_gemini.make_document(rng.choice("1234"), rows=3, doc_id=f"{prefix}-{index}")
+            for index in range(count)]
+
+
+def headers() -> dict:
+    return {"Authorization": f"Bearer {os.environ['API_KEY']}", "Content-Type": "image/png"}
+
+
+def run_sequential(documents: list[bytes]) -> tuple[float, list[float]]:
+    latencies = []
+    started_at = time.perf_counter()
+    for document in documents:
+        event = {"headers": headers(), "body": base64.b64encode(document).decode("ascii"), "isBase64Encoded": True}
+        request_started_at = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        assert response["statusCode"] == 200, response
+        latencies.append(time.perf_counter() - request_started_at)
+    return time.perf_counter() - started_at, latencies
+
+
+def run_server(documents: list[bytes], workers: int, clients: int, port: int) -> tuple[float, list[float], str]:
+    server = ExtractionServer(lambda_function.lambda_handler, workers=workers,
+                              authorize=lambda_function.authorization_error)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve("127.0.0.1", port),), daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{port}/"
+    for _ in range(50):
+        with contextlib.suppress(requests.exceptions.ConnectionError):
+            if requests.get(url + "healthz", timeout=1).status_code == 200:
+                break
+        time.sleep(0.1)
+
+    local = threading.local()
+
+    def send(document: bytes) -> float:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        request_started_at = time.perf_counter()
+        response = local.session.post(url, data=document, headers=headers(), timeout=60)
+        assert response.status_code == 200, response.text
+        return time.perf_counter() - request_started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(send, documents))
+    elapsed = time.perf_counter() - started_at
+    metrics = requests.get(url + "metrics", timeout=5).text
+    server.stop(loop)
+    thread.join(timeout=10)
+    return elapsed, latencies, metrics
+
+
+def report(name: str, elapsed: float, latencies: list[float]):
+    latencies = sorted(latencies)
+    print(f"{name:<22}{elapsed:8.2f} s {len(latencies) / elapsed:8.2f} req/s   "
+          f"p50 {percentile(latencies, 0.5):.2f} s   p95 {percentile(latencies, 0.95):.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=8, help="server worker concurrency")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent HTTP clients")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed)
+    fake_gemini.install(lambda_function, fake)
+    rng = random.Random(args.seed)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sequential = run_sequential(make_documents(args.requests, rng, "sequential"))
+        # COALESCING_STORE_DIR が設定されていると逐次実行の結果が再利用されるため、別の文書を使う
+        served = run_server(make_documents(args.requests, rng, "server"), args.workers, args.clients, args.port)
+
+    print(f"{args.requests} requests, {args.workers} server workers, {args.clients} clients")
+    report("sequential handler", *sequential)
+    report("server.py", served[0], served[1])
+    print(f"speedup: {sequential[0] / served[0]:.1f}x")
+    print("\n".join(line for line in served[2].splitlines() if line.startswith(("ocr_requests_total", "ocr_queue_wait"))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark for speculative extraction against the fake Gemini backend.
+Compares per-page latency with speculation off and on, and reports the
+extraction calls wasted on wrong guesses.
+
+Usage:
+    python bench_speculative_extraction.py [--pages 40] [--mix 1=0.85,2=0.05,3=0.05,4=0.05] [--budget 0.2]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+from speculation import SpeculativeExtractor
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        certificate_type, weight = item.split("=")
+        mix[certificate_type.strip()] = float(weight)
+    return mix
+
+
+def run(filepaths: list[str], budget: float, fake: fake_gemini.FakeGeminiClient) -> dict:
+    lambda_function.speculative_extractor = SpeculativeExtractor(budget, lambda_function.CERTIFICATE_EXTRACTORS)
+    fake.calls.clear()
+
+    latencies = []
+    for page, filepath in enumerate(filepaths, start=1):
+        start_time = time.perf_counter()
+        lambda_function.execute_extraction(filepath, page, "image/png")
+        latencies.append(time.perf_counter() - start_time)
+
+    stats = lambda_function.speculative_extractor.stats
+    return {
+        "mean_latency": sum(latencies) / len(latencies),
+        "total_latency": sum(latencies),
+        "model_calls": sum(fake.calls.values()),
+        "speculated": stats["speculated"],
+        "hits": stats["hits"],
+        "wasted_calls": stats["wasted_calls"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("1=0.85,2=0.05,3=0.05,4=0.05"))
+    parser.add_argument("--budget", type=float, default=0.2)
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency, seed=args.seed)
+    fake_gemini.install(lambda_function, fake)
+
+    rng = random.Random(args.seed)
+    certificate_types = rng.choices(list(args.mix), weights=list(args.mix.values()), k=args.pages)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepaths = []
+        for index, certificate_type in enumerate(certificate_types):
+            filepath = os.path.join(temp_dir, f"page_{index}.png")
+            with open(filepath, "wb") as f:
+                f.write(fake_gemini.make_document(certificate_type, rows=2, doc_id=str(index)))
+            filepaths.append(filepath)
+
+        baseline = run(filepaths, 0.0, fake)
+        speculative = run(filepaths, args.budget, fake)
+
+    saved = baseline["mean_latency"] - speculative["mean_latency"]
+    print("\n" + "=" * 50)
+    print(f"Pages: {args.pages}, mix: {args.mix}, budget: {args.budget}")
+    for name, result in (("sequential", baseline), ("speculative", speculative)):
+        print(
+            f"{name:>12}: mean {result['mean_latency'] * 1000:7.1f} ms/page, "
+            f"total {result['total_latency']:6.2f} s, model calls {result['model_calls']}"
+        )
+    print(
+        f"Latency saved: {saved * 1000:.1f} ms/page ({saved / baseline['mean_latency']:.1%}), "
+        f"speculated {speculative['speculated']} pages, hits {speculative['hits']}, "
+        f"wasted calls {speculative['wasted_calls']} ({speculative['wasted_calls'] / args.pages:.1%} of pages)"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark for schema-constrained output against the fake Gemini backend.
+Runs the same pages with JSON mode only (no response_schema, the previous
+configuration) and with per-type response schemas, and reports output tokens
+per call, the parse failure rate and how many failures the targeted retry
+recovered. The fake returns fenced, indented JSON without a schema (as the
+few-shot examples show) and truncates `--malformed-rate` of those outputs;
+with a schema it returns compact JSON. Real before/after numbers come from
+the same counters in the main.py summary and the Lambda logs.
+
+Usage:
+    python bench_structured_output.py [--pages 200] [--rows 3] [--malformed-rate 0.05]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+from pprint import pprint
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+
+import fake_gemini
+import lambda_function
+import structured_output
+from page_isolation import run_page
+
+
+def run(filepaths: list[str], schemas: bool, malformed_rate: float, seed: int) -> tuple[dict, int, int]:
+    fake = fake_gemini.FakeGeminiClient(0, 0, jitter=0, seed=seed, malformed_rate=malformed_rate)
+    fake_gemini.install(lambda_function, fake)
+    lambda_function.STRUCTURED_OUTPUT_SCHEMAS = schemas
+    stats = structured_output.OutputStats()
+    lambda_function.output_stats = stats
+
+    failed_pages = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for page, filepath in enumerate(filepaths, start=1):
+            # ページ単位のリトライは無効にし、呼び出し単位のやり直しだけを測る
+            _, error = run_page(
+                lambda checkpoint: lambda_function.execute_extraction(filepath, page, "image/png", checkpoint=checkpoint),
+                page,
+                retries=0,
+            )
+            failed_pages += 1 if error else 0
+    return stats.summary(), failed_pages, sum(fake.calls.values())
+
+
+def totals(summary: dict) -> tuple[float, float, int, int]:
+    calls = sum(stage["calls"] for stage in summary.values())
+    tokens = sum(stage["output_tokens_per_call"] * stage["calls"] for stage in summary.values())
+    failures = sum(stage["parse_failure_rate"] * stage["calls"] for stage in summary.values())
+    recovered = sum(stage["recovered"] for stage in summary.values())
+    return tokens / calls, failures / calls, round(failures), recovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=3, help="certificate rows per page")
+    parser.add_argument("--malformed-rate", type=float, default=0.05, help="truncated outputs without a schema")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="print per-stage counters")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepaths = []
+        for index in range(args.pages):
+            filepath = os.path.join(temp_dir, f"page_{index:04d}.png")
+            with open(filepath, "wb") as f:
+                f.write(fake_gemini.make_document(rng.choice("1234"), rows=args.rows, doc_id=str(index)))
+            filepaths.append(filepath)
+
+        print(f"{args.pages} pages x {args.rows} rows, malformed rate without schema {args.malformed_rate:.0%}")
+        print(f"{'mode':<14}{'tokens/call':>12}{'parse fail':>12}{'recovered':>11}{'failed pages':>14}{'calls':>8}")
+        for name, schemas in (("json mode", False), ("schema", True)):
+            summary, failed_pages, calls = run(filepaths, schemas, args.malformed_rate, args.seed)
+            tokens, failure_rate, failures, recovered = totals(summary)
+            print(f"{name:<14}{tokens:>12.1f}{failure_rate:>12.1%}{f'{recovered}/{failures}':>11}"
+                  f"{failed_pages:>14}{calls:>8}")
+            if args.verbose:
+                pprint(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark for warm-up pings against the fake Gemini backend.
+Starts a fresh Python process per run as a stand-in for a new Lambda container
+and measures the latency of the first real request: in a cold container the
+user also waits for the module initialization (imports, clients) and the first
+connection to Vertex AI; in a warmed container a warm-up event has already paid
+for those. `--connect-latency` is the credentials and TLS setup the fake adds to
+its first request.
+
+Usage:
+    python bench_warmup.py [--runs 3] [--pages 2] [--connect-latency 0.3]
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "bench-project")
+os.environ.setdefault("API_KEY", "bench")
+
+
+def event(data: bytes, media_type: str) -> dict:
+    return {
+        "headers": {"Authorization": f"Bearer {os.environ['API_KEY']}", "Content-Type": "application/json"},
+        "body": json.dumps({"data": base64.b64encode(data).decode("ascii"), "media_type": media_type}),
+    }
+
+
+def child(mode: str, args):
+    # 起動直後から計測するため、パイプラインのモジュールはここで読み込む
+    started_at = time.perf_counter()
+    import fake_gemini
+    import lambda_function
+    initialized_at = time.perf_counter()
+
+    fake = fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency,
+                                        connect_latency=args.connect_latency)
+    fake_gemini.install(lambda_function, fake)
+    timings = {"init": initialized_at - started_at}
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "warm":
+            warmup_started_at = time.perf_counter()
+            response = lambda_function.lambda_handler({"warmup": True}, None)
+            assert response["statusCode"] == 200, response
+            timings["warmup"] = time.perf_counter() - warmup_started_at
+        for request in ("first", "second"):
+            documents = [fake_gemini.make_document(str(page % 4 + 1), doc_id=f"{request}-{page}") for page in range(args.pages)]
+            request_started_at = time.perf_counter()
+            response = lambda_function.lambda_handler(event(fake_gemini.make_pdf(documents, 200), "application/pdf"), None)
+            assert response["statusCode"] == 200, response
+            timings[request] = time.perf_counter() - request_started_at
+    # コールドスタートでは初期化もユーザーの待ち時間に含まれる
+    timings["user_wait"] = timings["first"] + (timings["init"] if mode == "cold" else 0.0)
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per mode")
+    parser.add_argument("--pages", type=int, default=2, help="pages of the first request")
+    parser.add_argument("--connect-latency", type=float, default=0.3)
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--extract-latency", type=float, default=0.4)
+    parser.add_argument("--child", choices=("cold", "warm"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args)
+        return
+
+    options = [f"--pages={args.pages}", f"--connect-latency={args.connect_latency}",
+               f"--classify-latency={args.classify_latency}", f"--extract-latency={args.extract_latency}"]
+    results = {}
+    for mode in ("cold", "warm"):
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-W", "ignore", __file__, "--child", mode, *options],
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[mode] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+    print(f"{args.pages}-page first request, connect latency {args.connect_latency:.2f} s, "
+          f"median of {args.runs} fresh processes")
+    print(f"{'container':<11}{'init':>8}{'warm-up':>9}{'first':>8}{'second':>8}{'user wait':>11}")
+    for mode, timings in results.items():
+        warmup = f"{timings['warmup']:.2f}s" if "warmup" in timings else "-"
+        print(f"{mode:<11}{timings['init']:>7.2f}s{warmup:>9}{timings['first']:>7.2f}s{timings['second']:>7.2f}s"
+              f"{timings['user_wait']:>10.2f}s")
+    print(f"first-request wait after warm-up: {results['cold']['user_wait'] / results['warm']['user_wait']:.1f}x shorter")
+
+
+if __name__ == "__main__":
+    main()
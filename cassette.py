@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from google.genai import types
+
+# 記録・再生するカセットファイル (.gz なら圧縮)。空なら無効
+GEMINI_CASSETTE = os.environ.get("GEMINI_CASSETTE", "")
+GEMINI_CASSETTE_MODE = os.environ.get("GEMINI_CASSETTE_MODE", "replay")  # record | replay
+# 1 にすると再生時に記録したレイテンシを再現する
+GEMINI_CASSETTE_LATENCY = os.environ.get("GEMINI_CASSETTE_LATENCY", "0") == "1"
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def fingerprint(model: str, contents: types.Content, config: Optional[types.GenerateContentConfig]) -> str:
+    """
+    Stable hash of a generate_content request: model, prompt text, input bytes and
+    generation config. Per-attempt HTTP options (timeouts) are not part of the key.
+    """
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for part in contents.parts:
+        if part.text is not None:
+            digest.update(b"\0text\0" + part.text.encode("utf-8"))
+        if part.inline_data is not None:
+            digest.update(b"\0blob\0" + (part.inline_data.mime_type or "").encode("utf-8"))
+            digest.update(hashlib.sha256(part.inline_data.data or b"").digest())
+    if config is not None:
+        settings = config.model_dump(mode="json", exclude_none=True, exclude={"http_options"})
+        digest.update(b"\0config\0" + json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """
+    Record/replay layer for `client.models.generate_content`.
+
+    In record mode every request is forwarded to the client and the response
+    (with its latency) is appended to a JSONL cassette keyed by `fingerprint()`;
+    repeated requests are stored once. In replay mode responses are served from
+    the cassette without calling the model, optionally after the recorded
+    latency. A request missing from the cassette raises CassetteMissError.
+
+    Args:
+        path (str): Cassette file (".gz" for gzip-compressed JSONL); empty = pass-through
+        mode (str): "record" or "replay"
+        replay_latency (bool): Sleep for the recorded latency when replaying
+    """
+
+    def __init__(self, path: str = "", mode: str = REPLAY, replay_latency: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.entries = {}  # fingerprint -> (レスポンス, レイテンシ)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> "Cassette":
+        return cls(GEMINI_CASSETTE, GEMINI_CASSETTE_MODE, GEMINI_CASSETTE_LATENCY)
+
+    def _load(self):
+        with _open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 記録中に中断された行
+                self.entries[record["key"]] = (record["response"], record.get("latency", 0.0))
+
+    def generate_content(self, client, model: str, contents: types.Content,
+                         config: Optional[types.GenerateContentConfig] = None) -> types.GenerateContentResponse:
+        if not self.path:
+            return client.models.generate_content(model=model, contents=contents, config=config)
+
+        key = fingerprint(model, contents, config)
+        if self.mode == REPLAY:
+            entry = self.entries.get(key)
+            with self._lock:
+                self.stats["hits" if entry else "misses"] += 1
+            if entry is None:
+                raise CassetteMissError(f"Request {key[:12]} is not in cassette {self.path}")
+            response, latency = entry
+            if self.replay_latency:
+                time.sleep(latency)
+            return types.GenerateContentResponse.model_validate(response)
+
+        started_at = time.perf_counter()
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+        latency = time.perf_counter() - started_at
+        with self._lock:
+            self.stats["recorded"] += 1
+            if key in self.entries:
+                return response
+            data = response.model_dump(mode="json", exclude_none=True)
+            self.entries[key] = (data, latency)
+            with _open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "model": model, "latency": round(latency, 4), "response": data},
+                                   ensure_ascii=False, separators=(",", ":")) + "\n")
+        return response
+
+
+cassette = Cassette.from_env()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Callable, Optional
+
+from deadline import DEADLINE_PAGE_RESERVE, Deadline
+
+# 別インスタンスの処理結果を待つ最大時間 (秒)。Lambda の最大実行時間に合わせる
+COALESCING_WAIT_SECONDS = float(os.environ.get("COALESCING_WAIT_SECONDS", "300"))
+# 完了した結果をストアに残す時間 (秒)。タイムアウト後の再送にも結果を返せるようにする
+COALESCING_RESULT_TTL = float(os.environ.get("COALESCING_RESULT_TTL", "300"))
+COALESCING_POLL_SECONDS = float(os.environ.get("COALESCING_POLL_SECONDS", "0.5"))
+# 設定するとインスタンス間の重複排除にローカルのファイルストアを使う (空なら同一プロセス内のみ)
+COALESCING_STORE_DIR = os.environ.get("COALESCING_STORE_DIR", "")
+
+
+def content_key(data: bytes, *parts: str) -> str:
+    """Coalescing key: sha256 of the document plus anything else that changes the result."""
+    digest = hashlib.sha256(data)
+    for part in parts:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CoalescingStore(ABC):
+    """
+    Lock and result store shared between instances.
+
+    Implementations must make `acquire` atomic (e.g. DynamoDB conditional put,
+    Redis SET NX PX) and expire locks after `ttl` so a crashed holder does not
+    block others. Results must be JSON-serializable.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, ttl: float) -> bool:
+        """Take the lock for `key` unless another holder has it; True if taken."""
+
+    @abstractmethod
+    def release(self, key: str):
+        """Release the lock for `key`."""
+
+    @abstractmethod
+    def get_result(self, key: str) -> Optional[Any]:
+        """The stored result for `key`, or None if there is none (or it expired)."""
+
+    @abstractmethod
+    def put_result(self, key: str, result: Any, ttl: float):
+        """Store the result for `key` for `ttl` seconds."""
+
+
+class LocalFileCoalescingStore(CoalescingStore):
+    """
+    Local stand-in for a shared store: lock files created with O_EXCL and JSON
+    result files in one directory. Shared by processes on the same host (or on a
+    shared file system), which is enough to test the cross-instance path.
+
+    Args:
+        directory (str): Directory for lock and result files
+    """
+
+    def __init__(self, directory: str, clock: Callable[[], float] = time.time):
+        self.directory = directory
+        self.clock = clock
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def acquire(self, key: str, ttl: float) -> bool:
+        path = self._path(key, ".lock")
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path, "r") as f:
+                        expires_at = float(f.read() or 0)
+                except (FileNotFoundError, ValueError):
+                    expires_at = 0
+                if expires_at > self.clock():
+                    return False
+                # 期限切れのロック (保持していたインスタンスが落ちた) は取り除いてやり直す
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(self.clock() + ttl))
+            return True
+        return False
+
+    def release(self, key: str):
+        try:
+            os.unlink(self._path(key, ".lock"))
+        except FileNotFoundError:
+            pass
+
+    def get_result(self, key: str) -> Optional[Any]:
+        try:
+            with open(self._path(key, ".json"), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if record.get("expires_at", 0) <= self.clock():
+            return None
+        return record.get("result")
+
+    def put_result(self, key: str, result: Any, ttl: float):
+        path = self._path(key, ".json")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": self.clock() + ttl, "result": result}, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+def coalescing_store_from_env() -> Optional[CoalescingStore]:
+    return LocalFileCoalescingStore(COALESCING_STORE_DIR) if COALESCING_STORE_DIR else None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent requests for the same document.
+
+    Within a process, callers with the same key wait for the first caller (the
+    leader) and receive its result or exception. With a `store`, the leader also
+    takes a shared lock so that leaders on other instances wait for its result
+    instead of running the pipeline again; only results accepted by `cacheable`
+    are published. A store failure never fails the request: the work just runs
+    without coalescing.
+
+    Args:
+        store (CoalescingStore | None): Shared lock/result store (None = this process only)
+        cacheable (Callable): Whether a result may be shared through the store
+        wait_seconds (float): Maximum time to wait for another instance's result
+        result_ttl (float): How long a published result is served to later duplicates
+        poll_seconds (float): Polling interval while another instance holds the lock
+    """
+
+    def __init__(self, store: Optional[CoalescingStore] = None,
+                 cacheable: Callable[[Any], bool] = lambda result: True,
+                 wait_seconds: float = COALESCING_WAIT_SECONDS, result_ttl: float = COALESCING_RESULT_TTL,
+                 poll_seconds: float = COALESCING_POLL_SECONDS, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        self.store = store
+        self.cacheable = cacheable
+        self.wait_seconds = wait_seconds
+        self.result_ttl = result_ttl
+        self.poll_seconds = poll_seconds
+        self.sleep = sleep
+        self.clock = clock
+        self.stats = Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Any], deadline: Optional[Deadline] = None) -> tuple[Any, Optional[str]]:
+        """
+        Run `fn` once per key across concurrent callers.
+
+        Returns:
+            (result, source): source is None when this call ran `fn`, "local" when the
+            result came from a concurrent call in this process, "remote" when it came
+            from the shared store
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            remaining = deadline.remaining() if deadline else float("inf")
+            if call.done.wait(None if remaining == float("inf") else remaining):
+                with self._lock:
+                    self.stats["coalesced_local"] += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result, "local"
+            # 先行リクエストが締め切りまでに終わらない場合は自分で処理する
+            with self._lock:
+                self.stats["wait_timeouts"] += 1
+            return fn(), None
+
+        try:
+            call.result, source = self._run_shared(key, fn, deadline)
+            return call.result, source
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _store_call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            print(f"Coalescing store {method} failed: {e}")
+            with self._lock:
+                self.stats["store_errors"] += 1
+            return None
+
+    def _run_shared(self, key: str, fn: Callable[[], Any], deadline: Optional[Deadline]) -> tuple[Any, Optional[str]]:
+        if self.store is None:
+            with self._lock:
+                self.stats["executed"] += 1
+            return fn(), None
+
+        waited_at = self.clock()
+        locked = False
+        while True:
+            result = self._store_call("get_result", key)
+            if result is not None:
+                with self._lock:
+                    self.stats["coalesced_remote"] += 1
+                return result, "remote"
+            locked = self._store_call("acquire", key, self.wait_seconds)
+            if locked is not False:  # 取得できた、またはストアの障害 (None) のときは待たない
+                locked = bool(locked)
+                break
+            timed_out = self.clock() - waited_at >= self.wait_seconds
+            if timed_out or (deadline is not None and not deadline.allows(DEADLINE_PAGE_RESERVE)):
+                with self._lock:
+                    self.stats["wait_timeouts"] += 1
+                break
+            self.sleep(self.poll_seconds)
+
+        with self._lock:
+            self.stats["executed"] += 1
+        try:
+            result = fn()
+            if locked and self.cacheable(result):
+                self._store_call("put_result", key, result, self.result_ttl)
+            return result, None
+        finally:
+            if locked:
+                self._store_call("release", key)
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Optional
+
+from deadline import DeadlineExceededError
+from retry_policy import THROTTLED, UNAVAILABLE, classify_error
+
+# 0 にすると同時実行数を制限しない (従来の動作)
+ADAPTIVE_CONCURRENCY = os.environ.get("ADAPTIVE_CONCURRENCY", "1") != "0"
+CONCURRENCY_INITIAL = float(os.environ.get("CONCURRENCY_INITIAL", "8"))
+CONCURRENCY_MIN = float(os.environ.get("CONCURRENCY_MIN", "1"))
+CONCURRENCY_MAX = float(os.environ.get("CONCURRENCY_MAX", "64"))
+# 429/503 または遅延の急増で上限に掛ける係数
+CONCURRENCY_DECREASE = float(os.environ.get("CONCURRENCY_DECREASE", "0.5"))
+# 平常時の遅延の何倍を超えたら急増とみなすか
+CONCURRENCY_LATENCY_TOLERANCE = float(os.environ.get("CONCURRENCY_LATENCY_TOLERANCE", "2.0"))
+# 遅延の基準値を決めるまでに必要な成功回数
+LATENCY_WARMUP_CALLS = 10
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on in-flight model calls.
+
+    Each success with normal latency raises the limit by 1/limit (about +1 per
+    round of calls); a 429/503 or a latency above `latency_tolerance` times the
+    stage's usual latency multiplies it by `decrease`. Only calls started after
+    the last decrease can trigger another one, so a burst of failures from the
+    same overloaded round cuts the limit once. Callers over the limit wait.
+
+    Args:
+        initial (float): Starting limit
+        minimum (float): Lower bound of the limit
+        maximum (float): Upper bound of the limit
+        decrease (float): Multiplicative decrease factor
+        latency_tolerance (float): Latency spike threshold relative to the usual latency
+        enabled (bool): False = pass-through (no limit, only counting)
+        clock (Callable): Monotonic clock (injected by simulations)
+    """
+
+    def __init__(self, initial: float = CONCURRENCY_INITIAL, minimum: float = CONCURRENCY_MIN,
+                 maximum: float = CONCURRENCY_MAX, decrease: float = CONCURRENCY_DECREASE,
+                 latency_tolerance: float = CONCURRENCY_LATENCY_TOLERANCE, enabled: bool = ADAPTIVE_CONCURRENCY,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.enabled = enabled
+        self.clock = clock
+        self.in_flight = 0
+        self.stats = Counter()
+        self._baselines = {}  # ステージ -> (平常時の遅延の指数移動平均, 成功回数)
+        self._last_decrease_at = float("-inf")
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveLimiter":
+        return cls()
+
+    def _acquire(self, timeout: Optional[float]) -> float:
+        with self._condition:
+            if self.enabled and not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                self.stats["timeouts"] += 1
+                raise DeadlineExceededError(f"No model call slot within {timeout:.1f}s (limit {int(self.limit)})")
+            self.in_flight += 1
+            return self.clock()
+
+    def _decrease(self, started_at: float, reason: str):
+        # 直前の減少より前に開始した呼び出しの失敗では重ねて減らさない
+        if started_at < self._last_decrease_at:
+            return
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self._last_decrease_at = self.clock()
+        self.stats[f"decreases.{reason}"] += 1
+
+    def _release(self, started_at: float, stage: str, error: Optional[Exception]):
+        latency = self.clock() - started_at
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None:
+                if classify_error(error) in (THROTTLED, UNAVAILABLE):
+                    self.stats["overloaded"] += 1
+                    self._decrease(started_at, "overload")
+            else:
+                self.stats["successes"] += 1
+                baseline, count = self._baselines.get(stage, (latency, 0))
+                if count >= LATENCY_WARMUP_CALLS and latency > baseline * self.latency_tolerance:
+                    self.stats["latency_spikes"] += 1
+                    self._decrease(started_at, "latency")
+                elif self.in_flight + 1 >= self.limit / 2:
+                    # 上限の半分も使っていない間は上限を上げない (負荷の低い時間帯に上限だけが膨らむのを防ぐ)
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self._baselines[stage] = (baseline + (latency - baseline) * 0.1, count + 1)
+            self._condition.notify_all()
+
+    def run(self, call: Callable[[], Any], stage: str = "", timeout: Optional[float] = None) -> Any:
+        """
+        Run `call` in a slot, waiting at most `timeout` seconds for one, and adjust the limit from its outcome.
+
+        Raises:
+            DeadlineExceededError: no slot became free within `timeout`
+        """
+        started_at = self._acquire(timeout)
+        try:
+            result = call()
+        except Exception as e:
+            self._release(started_at, stage, e)
+            raise
+        self._release(started_at, stage, None)
+        return result
+
+    def summary(self) -> dict:
+        with self._condition:
+            return {"limit": self.limit, "in_flight": self.in_flight, **self.stats}
+
+
+call_limiter = AdaptiveLimiter.from_env()
@@ -0,0 +1,52 @@
+import math
+import os
+import time
+from typing import Optional
+
+# Lambda のハードタイムアウト前にレスポンスを返すための余裕 (秒)
+DEADLINE_SAFETY_MARGIN = float(os.environ.get("DEADLINE_SAFETY_MARGIN", "5"))
+# 新しいページの処理を開始するために最低限必要な残り時間 (秒)
+DEADLINE_PAGE_RESERVE = float(os.environ.get("DEADLINE_PAGE_RESERVE", "15"))
+# 1回のモデル呼び出しを開始するために最低限必要な残り時間 (秒)
+DEADLINE_CALL_RESERVE = float(os.environ.get("DEADLINE_CALL_RESERVE", "2"))
+
+
+class DeadlineExceededError(Exception):
+    """Raised when there is not enough time left to start or finish a model call."""
+
+
+class Deadline:
+    """
+    Absolute time budget for one request.
+
+    Args:
+        expires_at (float | None): time.monotonic() value at which the budget ends (None = no deadline)
+    """
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_lambda_context(cls, context, safety_margin: float = DEADLINE_SAFETY_MARGIN) -> "Deadline":
+        """Build a deadline from `context.get_remaining_time_in_millis()`, or an unbounded one without a context."""
+        get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+        if get_remaining_time is None:
+            return cls()
+        return cls.after(get_remaining_time() / 1000 - safety_margin)
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def allows(self, seconds: float) -> bool:
+        """True when at least `seconds` are left."""
+        return self.remaining() >= seconds
+
+    def check(self, seconds: float = 0.0):
+        if not self.allows(seconds):
+            raise DeadlineExceededError(f"Deadline exceeded ({self.remaining():.1f}s left, {seconds:.1f}s needed)")
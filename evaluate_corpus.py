@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of main.py over a labeled corpus.
+Runs `process_file` on every labeled file (normally with responses replayed
+from a cassette, so no quota is spent), compares the extracted documents field
+by field with the labels and reports accuracy per certificate type together
+with the CPU and wall time spent in the pipeline. Save the report with
+`--output` and pass it to `--compare` on the next change to see the deltas.
+
+The labels file maps file paths (relative to the labels file) to the expected
+list of documents, in the same shape as the API response. `--write-labels`
+bootstraps it from the current output; review it by hand before relying on it.
+
+Usage:
+    GEMINI_CASSETTE=corpus.jsonl.gz GEMINI_CASSETTE_MODE=record python evaluate_corpus.py labels.json
+    GEMINI_CASSETTE=corpus.jsonl.gz python evaluate_corpus.py labels.json [--output report.json] [--compare old.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from collections import Counter
+
+labels_dir = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "evaluation-project")
+
+import main as pipeline
+from cassette import cassette
+from model_routing import model_router
+from structured_output import output_stats
+
+# 座標は常に 0 のため比較しない
+IGNORED_KEYS = {"Position", "Angle"}
+
+
+def flatten(value, prefix: str = "") -> dict:
+    """Flatten one document into {"Lifes[0].ContractNumber": "...", ...} leaves."""
+    if isinstance(value, dict):
+        if set(value) >= {"Value", "Position"}:
+            return {prefix: value["Value"]}
+        leaves = {}
+        for key, item in value.items():
+            if key not in IGNORED_KEYS:
+                leaves.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return leaves
+    if isinstance(value, list):
+        leaves = {}
+        for index, item in enumerate(value):
+            leaves.update(flatten(item, f"{prefix}[{index}]"))
+        return leaves
+    return {prefix: value}
+
+
+def compare_documents(expected: list[dict], actual: list[dict]) -> Counter:
+    """Count matching fields per certificate type; documents are paired by page."""
+    counts = Counter()
+    actual_by_page = {document.get("Page"): document for document in actual}
+    for document in expected:
+        certificate_type = str(document.get("CertificateType", "0"))
+        expected_leaves = flatten(document)
+        actual_leaves = flatten(actual_by_page.get(document.get("Page"), {}))
+        for path in expected_leaves.keys() | actual_leaves.keys():
+            counts[f"{certificate_type}.fields"] += 1
+            counts[f"{certificate_type}.correct"] += expected_leaves.get(path) == actual_leaves.get(path)
+        counts[f"{certificate_type}.documents"] += 1
+        counts[f"{certificate_type}.exact"] += expected_leaves == actual_leaves
+    return counts
+
+
+def evaluate(labels: dict, base_dir: str) -> tuple[dict, dict]:
+    counts = Counter()
+    outputs = {}
+    failed_pages = 0
+    cpu_started_at = time.process_time()
+    wall_started_at = time.perf_counter()
+    for name, expected in sorted(labels.items()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = pipeline.process_file(os.path.join(base_dir, name))
+        documents, errors = result if result is not None else ([], [])
+        failed_pages += len(errors)
+        outputs[name] = documents
+        counts.update(compare_documents(expected, documents))
+    cpu_seconds = time.process_time() - cpu_started_at
+    wall_seconds = time.perf_counter() - wall_started_at
+
+    tiers = model_router.summary()["tiers"].values()
+    calls = sum(tier["calls"] for tier in tiers)
+    input_tokens = sum(tier["input_tokens_per_call"] * tier["calls"] for tier in tiers)
+
+    certificate_types = sorted({key.split(".")[0] for key in counts})
+    fields = sum(counts[f"{t}.fields"] for t in certificate_types)
+    correct = sum(counts[f"{t}.correct"] for t in certificate_types)
+    report = {
+        "files": len(labels),
+        "documents": sum(counts[f"{t}.documents"] for t in certificate_types),
+        "failed_pages": failed_pages,
+        "field_accuracy": correct / fields if fields else 0.0,
+        "per_type": {
+            t: {
+                "documents": counts[f"{t}.documents"],
+                "exact_documents": counts[f"{t}.exact"],
+                "field_accuracy": counts[f"{t}.correct"] / counts[f"{t}.fields"] if counts[f"{t}.fields"] else 0.0,
+            }
+            for t in certificate_types
+        },
+        "input_tokens_per_call": input_tokens / calls if calls else 0.0,
+        "cpu_seconds": cpu_seconds,
+        "wall_seconds": wall_seconds,
+        "cassette": dict(cassette.stats),
+        "model_output": output_stats.summary(),
+        "model_tiers": model_router.summary(),
+    }
+    return report, outputs
+
+
+def print_comparison(report: dict, previous: dict):
+    print(f"{'':<22}{'previous':>12}{'current':>12}{'delta':>12}")
+    for key in ("field_accuracy", "failed_pages", "input_tokens_per_call", "cpu_seconds", "wall_seconds"):
+        old, new = previous.get(key, 0), report[key]
+        print(f"{key:<22}{old:>12.4g}{new:>12.4g}{new - old:>+12.4g}")
+    for certificate_type, stats in report["per_type"].items():
+        old = previous.get("per_type", {}).get(certificate_type, {}).get("field_accuracy", 0.0)
+        new = stats["field_accuracy"]
+        print(f"{f'type {certificate_type} accuracy':<22}{old:>12.4g}{new:>12.4g}{new - old:>+12.4g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("labels", help="JSON file mapping file paths to expected documents")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--compare", metavar="REPORT", help="previous report to compare against")
+    parser.add_argument("--write-labels", action="store_true",
+                        help="overwrite the labels with the current output (bootstrap; review by hand)")
+    args = parser.parse_args()
+
+    labels_path = os.path.join(labels_dir, args.labels)
+    with open(labels_path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+
+    report, outputs = evaluate(labels, os.path.dirname(labels_path))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(os.path.join(labels_dir, args.compare), "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(os.path.join(labels_dir, args.output), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.write_labels:
+        with open(labels_path, "w", encoding="utf-8") as f:
+            json.dump(outputs, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
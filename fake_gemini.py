@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Fake Vertex AI (Gemini) client for local benchmarks.
+It mimics `client.models.generate_content` with configurable latency so the
+pipeline can be measured without spending quota.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any
+
+from google.genai import errors, types
+
+# プロンプト1行目のキーワード -> 呼び出し種別
+PROMPT_KINDS = {
+    "帳票から": "classify",
+    "生命保険控除証明書から": "1",
+    "地震保険控除証明書から": "2",
+    "社会保険控除証明書から": "3",
+    "小規模共済控除証明書から": "4",
+}
+
+
+def make_document(certificate_type: str, rows: int = 1, doc_id: str = "") -> bytes:
+    """
+    Build a synthetic document payload understood by FakeGeminiClient.
+
+    Args:
+        certificate_type (str): Ground-truth certificate type ("0"-"4")
+        rows (int): Number of certificate rows on the page
+        doc_id (str): Free-form identifier to make payloads distinct
+    """
+    return json.dumps(
+        {"fake_certificate": certificate_type, "rows": rows, "id": doc_id}
+    ).encode("utf-8")
+
+
+def make_pdf(documents: list[bytes], drawing_ops: int = 2000) -> bytes:
+    """
+    Build a PDF with one page per synthetic document. The document payload is kept
+    as a comment in the (uncompressed) page content stream, so it survives page
+    splitting; `drawing_ops` adds line drawings to give pypdf realistic work.
+    """
+    import io
+    import pypdf
+    from pypdf.generic import DecodedStreamObject, NameObject
+
+    writer = pypdf.PdfWriter()
+    drawing = b"".join(b"%d %d m %d %d l S\n" % (i % 595, i % 842, (i * 7) % 595, (i * 13) % 842) for i in range(drawing_ops))
+    for document in documents:
+        page = writer.add_blank_page(595, 842)
+        stream = DecodedStreamObject()
+        stream.set_data(b"% " + document + b"\n" + drawing)
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+DOCUMENT_PATTERN = re.compile(rb'\{"fake_certificate".*?\}')
+
+
+def read_document(data: bytes) -> dict:
+    match = DOCUMENT_PATTERN.search(data)
+    try:
+        document = json.loads(match.group(0).decode("utf-8")) if match else None
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        document = None
+    return document if isinstance(document, dict) else {"fake_certificate": "0", "rows": 1, "id": ""}
+
+
+def prompt_kind(prompt: str) -> str:
+    first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+    for keyword, kind in PROMPT_KINDS.items():
+        if keyword in first_line:
+            return kind
+    return "unknown"
+
+
+def fake_rows(certificate_type: str, rows: int, doc_id: str) -> list[dict]:
+    outputs = []
+    for index in range(rows):
+        if certificate_type == "1":
+            outputs.append({
+                "保険区分": str(index % 3 + 1),
+                "保険会社名": "△△生命保険株式会社",
+                "契約番号": f"{doc_id}-{index:04d}",
+                "保険種類": "終身",
+                "契約日": "20200701",
+                "保険期間": "終身",
+                "保険契約者名": "佐藤太郎",
+                "保険受取人名": "佐藤花子",
+                "新・旧制度区分": "2",
+                "証明額": 50000 + index * 1000,
+                "年金支払開始日": "20400301",
+            })
+        elif certificate_type == "2":
+            outputs.append({
+                "保険会社名": "東京海上日動火災保険株式会社",
+                "契約番号": f"{doc_id}-{index:04d}",
+                "保険種類": "地震保険",
+                "契約開始日": "20000101",
+                "契約終了日": "20301231",
+                "保険期間": "30年",
+                "保険契約者名": "鈴木一郎",
+                "保険対象物件": "建物及び家財",
+                "地震控除証明額": 25000,
+                "旧長期控除証明額": 10000,
+                "満期返戻金有無": "2",
+            })
+        elif certificate_type == "3":
+            outputs.append({
+                "保険種類": "国民年金",
+                "保険料支払先名称": "日本年金機構",
+                "保険料負担者氏名": "山田太郎",
+                "保険料支払額": 72000 + index,
+            })
+        elif certificate_type == "4":
+            outputs.append({
+                "掛金の種類": "3",
+                "掛金": 120000 + index,
+            })
+    return outputs
+
+
+def printed_date(value: str) -> str:
+    """yyyyMMdd as printed on a certificate: wareki for Heisei and Reiwa dates (full-width for Heisei)."""
+    year, month, day = int(value[:4]), int(value[4:6]), int(value[6:])
+    if year >= 2019:
+        return f"令和{year - 2018}年{month}月{day}日"
+    if year >= 1989:
+        return f"平成{year - 1988}年{month}月{day}日".translate(FULLWIDTH_DIGITS)
+    return f"{year}/{month:02d}/{day:02d}"
+
+
+FULLWIDTH_DIGITS = str.maketrans("0123456789", "０１２３４５６７８９")
+DATE_KEYS = ("契約日", "年金支払開始日", "契約開始日", "契約終了日")
+NAME_KEYS = ("保険契約者名", "保険料負担者氏名")
+
+
+def as_printed(rows: list[dict], prompt: str, amounts: bool) -> list[dict]:
+    """
+    Copy values the way they are printed when the prompt does not ask for a format:
+    dates without the yyyyMMdd instruction, amounts with separators (only when no
+    schema forces integers) and names with the surrounding spaces of the form
+    without the instruction to remove them.
+    """
+    printed = []
+    for row in rows:
+        row = dict(row)
+        for key in DATE_KEYS:
+            if "yyyyMMdd" not in prompt and row.get(key):
+                row[key] = printed_date(row[key])
+        for key, value in row.items():
+            if amounts and "数値のみ記載" not in prompt and isinstance(value, int):
+                row[key] = f"{value:,}円"
+        for key in NAME_KEYS:
+            if "前後の不要な空白" not in prompt and row.get(key):
+                row[key] = f"\u3000{row[key]} "
+        printed.append(row)
+    return printed
+
+
+class FakeInjectedError(RuntimeError):
+    """Failure injected by FakeGeminiClient (classified as non-retryable by the retry policy)."""
+
+
+class FakeGeminiClient:
+    """
+    Drop-in stand-in for `genai.Client` used by the benchmark scripts.
+
+    Args:
+        classify_latency (float): Seconds spent on a classification call
+        extract_latency (float): Seconds spent on an extraction call
+        jitter (float): Relative latency jitter (0.1 = +-10%)
+        seed (int): Seed for the latency jitter and failure injection
+        failure_rate (float): Probability that a call raises an injected failure
+        failure_kinds (tuple): Call kinds ("classify", "1"-"4") eligible for failures (empty = all)
+        failure_status (int): HTTP status of the injected failures (None = FakeInjectedError, which is terminal)
+        malformed_rate (float): Probability that a call without response_schema returns truncated JSON
+        weak_models (tuple): Model names that answer faster but less reliably (e.g. "gemini-2.5-flash-lite")
+        weak_error_rate (float): Probability that a weak model misclassifies or drops the extracted fields
+        weak_wrong_type_share (float): Share of a weak model's classification errors that name another
+            certificate type instead of "0" (confidently wrong, so escalation on "0" does not catch them)
+        weak_latency_factor (float): Latency of a weak model relative to the configured latency
+        quota (Callable): seconds since creation -> concurrent calls allowed; calls beyond it get a 429
+        connect_latency (float): Seconds added to the first request (credentials and TLS handshake)
+        slot_quota (int): Concurrent calls each project x region slot accepts; calls beyond it get a 429
+        pack_latency_factor (float): Latency added per extra attached image, relative to a single-image call
+        pack_error_rate (float): Probability that a multi-image call leaves out the last image's result
+    """
+
+    def __init__(self, classify_latency: float = 0.2, extract_latency: float = 0.4,
+                 jitter: float = 0.1, seed: int = 0, failure_rate: float = 0.0,
+                 failure_kinds: tuple = (), malformed_rate: float = 0.0, weak_models: tuple = (),
+                 weak_error_rate: float = 0.0, weak_latency_factor: float = 0.5, weak_wrong_type_share: float = 0.5,
+                 quota=None,
+                 connect_latency: float = 0.0, slot_quota: int | None = None, pack_latency_factor: float = 0.5,
+                 pack_error_rate: float = 0.0, failure_status: int | None = None):
+        self.classify_latency = classify_latency
+        self.extract_latency = extract_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_kinds = failure_kinds
+        self.failure_status = failure_status
+        self.malformed_rate = malformed_rate
+        self.weak_models = weak_models
+        self.weak_error_rate = weak_error_rate
+        self.weak_latency_factor = weak_latency_factor
+        self.weak_wrong_type_share = weak_wrong_type_share
+        self.quota = quota
+        self.connect_latency = connect_latency
+        self.slot_quota = slot_quota
+        self.pack_latency_factor = pack_latency_factor
+        self.pack_error_rate = pack_error_rate
+        self.slot_in_flight = Counter()
+        self.slot_calls = Counter()
+        self.connected = threading.Event()
+        self.in_flight = 0
+        self.throttled = 0
+        self.started_at = time.monotonic()
+        self.calls = Counter()
+        self.images = Counter()
+        self.model_calls = Counter()
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = self
+
+    def _latency(self, kind: str, weak: bool = False) -> float:
+        base = self.classify_latency if kind == "classify" else self.extract_latency
+        base *= self.weak_latency_factor if weak else 1
+        with self._lock:
+            return max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _connect(self):
+        # 最初のリクエストだけが認証トークンの取得と接続の確立を待つ
+        if not self.connected.is_set():
+            time.sleep(self.connect_latency)
+            self.connected.set()
+
+    def list(self, config=None):
+        """`client.models.list`: opens the connection and returns no models."""
+        self._connect()
+        return iter(())
+
+    def slot(self, project: str | None, location: str | None) -> "FakeSlotClient":
+        """Client view for one project x region slot (what `genai.Client(project=..., location=...)` returns)."""
+        return FakeSlotClient(self, (project, location))
+
+    def generate_content(self, model: str, contents: types.Content, config=None, slot: tuple | None = None):
+        self._connect()
+        with self._lock:
+            self.in_flight += 1
+            self.slot_in_flight[slot] += 1
+            self.slot_calls[slot] += 1
+            over_quota = (
+                (self.quota is not None and self.in_flight > self.quota(time.monotonic() - self.started_at))
+                or (self.slot_quota is not None and self.slot_in_flight[slot] > self.slot_quota)
+            )
+            self.throttled += 1 if over_quota else 0
+        try:
+            if over_quota:
+                # クォータ超過は短時間で 429 を返す
+                time.sleep(self._latency("classify") * 0.25)
+                raise errors.ClientError(429, {"error": {
+                    "code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Quota exceeded (fake)"}})
+            return self._generate_content(model, contents, config)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.slot_in_flight[slot] -= 1
+
+    def _payload(self, kind: str, document: dict, weak_error: bool, prompt: str, config,
+                 wrong_type: str | None = None) -> Any:
+        if kind == "classify":
+            if wrong_type is not None:
+                return {"帳票の種類": wrong_type}
+            return {"帳票の種類": "0" if weak_error else document.get("fake_certificate", "0")}
+        if kind != document.get("fake_certificate"):
+            return []
+        payload = fake_rows(kind, int(document.get("rows", 1)), str(document.get("id", "")))
+        if weak_error:
+            payload = [dict.fromkeys(row) for row in payload]
+        return as_printed(payload, prompt, amounts=config is None or config.response_schema is None)
+
+    def _generate_content(self, model: str, contents: types.Content, config=None):
+        prompt = contents.parts[0].text
+        documents = [read_document(part.inline_data.data) for part in contents.parts[1:]]
+        kind = prompt_kind(prompt)
+        weak = model in self.weak_models
+        with self._lock:
+            self.calls[kind] += 1
+            self.images[kind] += len(documents)
+            self.model_calls[model] += 1
+            # 軽量モデルは一定の割合で判定を誤るか、項目を読み落とす
+            weak_error = weak and self._random.random() < self.weak_error_rate
+            # 判定の誤りの一部は "0" ではなく別の種類を答える (確信をもった誤り)
+            wrong_type = None
+            if weak_error and kind == "classify" and self._random.random() < self.weak_wrong_type_share:
+                actual = documents[0].get("fake_certificate")
+                wrong_type = self._random.choice([value for value in "1234" if value != actual])
+
+        # 複数の画像を添付すると出力が長くなる分だけ遅くなる
+        time.sleep(self._latency(kind, weak) * (1 + self.pack_latency_factor * (len(documents) - 1)))
+
+        if self.failure_rate and (not self.failure_kinds or kind in self.failure_kinds):
+            with self._lock:
+                failed = self._random.random() < self.failure_rate
+            if failed:
+                with self._lock:
+                    self.failures += 1
+                if self.failure_status is not None:
+                    # 再試行できる失敗 (5xx など) は呼び出し単位の再試行ポリシーの対象になる
+                    error_class = errors.ServerError if self.failure_status >= 500 else errors.ClientError
+                    raise error_class(self.failure_status, {"error": {
+                        "code": self.failure_status, "message": f"Injected failure on {kind} call (fake)"}})
+                raise FakeInjectedError(f"Injected failure on {kind} call")
+
+        if len(documents) == 1:
+            payload = self._payload(kind, documents[0], weak_error, prompt, config, wrong_type)
+        else:
+            # まとめた抽出では画像ごとの結果を画像番号付きで返す
+            payload = [{"画像番号": number, "証明書": self._payload(kind, document, weak_error, prompt, config)}
+                       for number, document in enumerate(documents, start=1)]
+            with self._lock:
+                dropped = self._random.random() < self.pack_error_rate
+            if dropped:
+                payload = payload[:-1]
+        if config is not None and config.response_schema is not None:
+            text = json.dumps(payload, ensure_ascii=False)
+        else:
+            # スキーマなしの JSON モードでは few-shot 例にならったインデント付き・コードフェンス付きの出力を模す
+            text = "```json\n" + json.dumps(payload, ensure_ascii=False, indent=2) + "\n```"
+            with self._lock:
+                malformed = self._random.random() < self.malformed_rate
+            if malformed:
+                text = text[: len(text) // 2]  # 途中で切れた出力
+
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=[types.Part(text=text)])
+                )
+            ],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=len(prompt) + 258 * len(documents),  # 画像1枚あたり 258 トークン
+                candidates_token_count=len(text),
+            ),
+        )
+
+
+class FakeSlotClient:
+    """The fake seen through one project x region slot; calls count against that slot's quota."""
+
+    def __init__(self, fake: FakeGeminiClient, slot: tuple):
+        self.fake = fake
+        self.slot = slot
+        self.models = self
+
+    def generate_content(self, model: str, contents: types.Content, config=None):
+        return self.fake.generate_content(model, contents, config, slot=self.slot)
+
+    def list(self, config=None):
+        return self.fake.list(config)
+
+
+def install(module, fake: FakeGeminiClient):
+    """Point a pipeline module (lambda_function / main) at the fake client, for every project x region slot."""
+    module.genai = SimpleNamespace(Client=lambda **kwargs: fake.slot(kwargs.get("project"), kwargs.get("location")))
+    if hasattr(module, "slot_router"):
+        module.slot_router.reset()  # 以前のクライアントとスロットの状態を使わない
@@ -1,19 +1,42 @@
+import functools
+import io
 import json
 import os
-import random
-import base64
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
 import time
 import pypdf
 import tempfile
+from admission import admission, rejection
+from batch_request import BatchScheduler, document_result
+from cassette import cassette
+from coalescing import SingleFlight, coalescing_store_from_env, content_key
+from concurrency_limit import call_limiter
+from deadline import DEADLINE_PAGE_RESERVE, Deadline, DeadlineExceededError
+from model_routing import model_router
+from packing import ExtractionPacker, packed_prompt, packed_schema
+from page_isolation import page_error, run_page
+from profiling import profiled, request_profiler
+from response_format import dumps, requested_format
+from result_store import prompt_version
+from quota_pool import SlotRouter
+from retry_policy import RetryExhaustedError, RetryPolicy
+from speculation import SpeculativeExtractor, SPECULATIVE_EXTRACTION_BUDGET
+from structured_output import (
+    CLASSIFICATION_SCHEMA,
+    EXTRACTION_SCHEMAS,
+    STRUCTURED_OUTPUT_SCHEMAS,
+    MalformedOutputError,
+    output_stats,
+    parse_output,
+)
+from upload import is_batch_request, parse_batch_upload, parse_upload
+from warmup import WARMUP_REGIONS, Warmer, is_warmup_event, lambda_invoker, warmup_concurrency
 
 VERTEX_AI_PROJECT_ID = os.environ.get("VERTEX_AI_PROJECT_ID")
 VERTEX_AI_LOCATION = os.environ.get("VERTEX_AI_LOCATION", "asia-northeast1")
 API_KEY = os.environ.get("API_KEY")
-client = genai.Client(
-    vertexai=True, project=VERTEX_AI_PROJECT_ID, location=VERTEX_AI_LOCATION
-)
 VERTEX_AI_REGIONS = [
     "asia-northeast1",  # Tokyo
     "us-central1",  # Iowa
@@ -27,106 +50,100 @@ VERTEX_AI_REGIONS = [
     "europe-west4",  # Netherlands
     "global"
 ]
-available_regions = VERTEX_AI_REGIONS.copy()
-current_region_index = 0
-
-def __switch_to_next_region():
-    global current_region_index
-    current_region_index = (current_region_index + 1) % len(available_regions)
-    current_region = available_regions[current_region_index]
-    print(f"Switching to region: {current_region}")
-    __initialize_vertex_client()
-
-def __initialize_vertex_client():
-    global current_region_index, client
-    current_region = available_regions[current_region_index]
-    client = genai.Client(vertexai=True, project=VERTEX_AI_PROJECT_ID, location=current_region)
-
-def __execute_vertex_ai_with_retry(filepath: str, prompt: str, mime_type: str, max_retries: int = 3,
-    ) -> list[dict]:
-        """Execute with multi-region failover and exponential backoff"""
-        global current_region_index
-
-        # Phase 1: Try all regions
-        for region_attempt in range(len(available_regions)):
-            try:
-                # リージョン間の負荷分散用遅延
-                time.sleep(random.uniform(0.5, 1.0))
-
-                result = execute_gemini(filepath, prompt, mime_type)
-                if region_attempt > 0:
-                    current_region_index = 0
-                return result
-
-            except Exception as e:
-                if _is_error_429(e):
-                    print(f"Region {available_regions[current_region_index]} quota exhausted, switching region")
-                    __switch_to_next_region()
-                    continue
-                elif _is_error_503(e):
-                    print(f"Region {available_regions[current_region_index]} service unavailable, switching region")
-                    __switch_to_next_region()
-                    continue
-                else:
-                    raise e
-
-        # Phase 2: Exponential backoff across all regions if all failed with 429
-        for retry in range(max_retries):
-            delay = (2**retry) + random.uniform(0, 1)
-            print(f"All regions exhausted, retry {retry + 1}/{max_retries} after {delay:.1f}s")
-            __async_delay(delay)
-
-            for region_attempt in range(len(available_regions)):
-                try:
-                    result = execute_gemini(filepath, prompt, mime_type)
-                    current_region_index = 0
-                    return result
-
-                except Exception as e:
-                    if not _is_error_429(e) and not _is_error_503(e):
-                        raise e
-                    __switch_to_next_region()
-
-        # All retries exhausted
-        raise Exception("All retries exhausted")
-
-
-def _is_error_429(error: Exception) -> bool:
-        return "429" in str(error) or "Resource exhausted" in str(error)
-
-def _is_error_503(error: Exception) -> bool:
-    return "503" in str(error) or "Service unavailable" in str(error) or "Candidates token count is None" in str(error)
-
-def __async_delay(seconds: float):
-    time.sleep(seconds)
-
-def json_string_to_json(json_string) -> list[dict]:
-    try:
-        cleaned_json_string = (
-            json_string.replace("```json", "").replace("```", "").strip()
-        )
-        python_dict = json.loads(cleaned_json_string)
-        return python_dict
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        return []
+# プロジェクト x リージョンのスロットに呼び出しを分散する (VERTEX_AI_LOCATION を最優先)
+slot_router = SlotRouter.from_env(
+    VERTEX_AI_PROJECT_ID,
+    [VERTEX_AI_LOCATION, *(region for region in VERTEX_AI_REGIONS if region != VERTEX_AI_LOCATION)],
+    lambda project, region, credentials: genai.Client(
+        vertexai=True, project=project, location=region, credentials=credentials
+    ),
+)
 
-def execute_gemini(filepath: str, prompt: str, mime_type: str) -> list[dict]:
-    with open(filepath, "rb") as f:
-        file_data = f.read()
-        data = base64.b64encode(file_data).decode("utf-8")
+retry_policy = RetryPolicy.from_env()
+
+@profiled
+def __execute_vertex_ai_with_retry(filepath: str | list[str], prompt: str, mime_type: str, schema: types.Schema, stage: str,
+                                   deadline: Deadline | None = None) -> dict | list[dict]:
+    """
+    Execute on the project x region slots with the configured retry policy; malformed output is retried once.
+    Every attempt counts against the adaptive concurrency limit and is recorded for admission control.
+    Output the stage's light model handles poorly is redone on the escalation model.
+    """
+    def call(model: str, attempt: int, timeout: float | None):
+        try:
+            output = call_limiter.run(
+                lambda: slot_router.run(
+                    lambda client: execute_gemini(client, filepath, prompt, mime_type, schema, stage, model, timeout, attempt)
+                ),
+                stage,
+                timeout,
+            )
+        except Exception as e:
+            admission.record(e)
+            raise
+        admission.record()
+        return output
+
+    def run(model: str, attempt: int):
+        try:
+            return retry_policy.execute(
+                lambda timeout: call(model, attempt, timeout),
+                regions=len(slot_router.slots),
+                failover=lambda: None,  # 失敗したスロットは冷却中になり、次の呼び出しは別のスロットを選ぶ
+                deadline=deadline,
+            )
+        except RetryExhaustedError as e:
+            admission.record_exhausted(e)
+            raise
+
+    model = model_router.model(stage)
+    try:
+        output = run(model, 0)
+    except MalformedOutputError as e:
+        # 不正な出力はこの呼び出しだけを1回やり直す (ページ全体は再処理しない)。軽量モデルなら昇格する
+        if model_router.can_escalate(stage):
+            model_router.record_escalation(stage, "malformed")
+            model = model_router.escalation_model
+        print(f"Malformed {stage} output, retrying once on {model}: {e}")
+        try:
+            output = run(model, 1)
+        except MalformedOutputError:
+            output_stats.record_retry(stage, recovered=False)
+            raise
+        output_stats.record_retry(stage, recovered=True)
+        return output
+
+    reason = model_router.escalation_reason(stage, output)
+    if reason is not None:
+        print(f"Escalating {stage} from {model} to {model_router.escalation_model}: {reason}")
+        model_router.record_escalation(stage, reason)
+        try:
+            output = run(model_router.escalation_model, 0)
+        except Exception as e:
+            # 昇格に失敗した場合は軽量モデルの結果を使う
+            print(f"Escalation of {stage} failed, keeping the {model} result: {e}")
+    return output
 
-    output = []
+def execute_gemini(client, filepath: str | list[str], prompt: str, mime_type: str, schema: types.Schema, stage: str,
+                  model: str, timeout: float | None = None, attempt: int = 0) -> dict | list[dict]:
+    # まとめた抽出では複数の画像を順に添付する
+    file_data = []
+    for path in filepath if isinstance(filepath, list) else [filepath]:
+        with open(path, "rb") as f:
+            file_data.append(f.read())
 
     # --- 固定プロンプト & 入力画像 ----------------------------------
     contents = types.Content(
         role="user",
         parts=[
             types.Part(text=prompt),
-            types.Part(
-                inline_data=types.Blob(
-                    mime_type=mime_type, data=base64.b64decode(data)
+            *(
+                types.Part(
+                    inline_data=types.Blob(
+                        mime_type=mime_type, data=data
+                    )
                 )
+                for data in file_data
             ),
         ]
     )
@@ -136,34 +153,45 @@ def execute_gemini(filepath: str, prompt: str, mime_type: str) -> list[dict]:
         temperature=0,
         max_output_tokens=10240,
         response_mime_type="application/json",
+        response_schema=schema if STRUCTURED_OUTPUT_SCHEMAS else None,
         candidate_count=1,
         top_k=1,
         top_p=0.0,
-        seed=1234567890,
+        seed=1234567890 + attempt,  # 不正な出力のやり直しでは別の seed を使う
         thinking_config=types.ThinkingConfig(thinking_budget=0),
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
     )
 
     # --- 推論 --------------------------------
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
+    started_at = time.perf_counter()
+    response = cassette.generate_content(
+        client,
+        model=model,
         contents=contents,
         config=cfg,
     )
+    model_router.record(stage, model, time.perf_counter() - started_at, getattr(response, "usage_metadata", None))
     # --- レスポンスの処理 ------------------------------------------
+    text = None
     if response and response.candidates and len(response.candidates) > 0:
         candidate = response.candidates[0]
         if hasattr(candidate, "content") and candidate.content:
             text = candidate.content.parts[0].text if candidate.content.parts else None
-            if text:
-                output = json_string_to_json(text)
         elif hasattr(candidate, "text"):
             text = candidate.text
-            output = json_string_to_json(text)
         else:
             print("No text content in candidate")
     else:
         print("No candidates in response")
 
+    usage = getattr(response, "usage_metadata", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    try:
+        output = parse_output(text, schema)
+    except MalformedOutputError:
+        output_stats.record(stage, output_tokens, parse_failed=True)
+        raise
+    output_stats.record(stage, output_tokens)
     return output
 
 def get_default_api_response():
@@ -613,37 +641,74 @@ def get_small_mutual_aid_api_response(page: int, outputs: list[dict], certificat
         "SmallMutuals": small_mutual_aids,
     }
 
-def execute_extraction(filepath: str, page: int, mime_type: str) -> dict:
+# 帳票の種類 -> (抽出プロンプト, レスポンス生成関数)
+CERTIFICATE_EXTRACTORS = {
+    "1": ("prompt_life_insurance.txt", get_life_insurance_api_response),  # 生命保険控除証明書
+    "2": ("prompt_earthquake_insurance.txt", get_earthquake_insurance_api_response),  # 地震保険控除証明書
+    "3": ("prompt_social_insurance.txt", get_social_insurance_api_response),  # 社会保険控除証明書
+    "4": ("prompt_small_mutual_aid.txt", get_small_mutual_aid_api_response),  # 小規模共済控除証明書
+}
+speculative_extractor = SpeculativeExtractor(SPECULATIVE_EXTRACTION_BUDGET, CERTIFICATE_EXTRACTORS)
+# 成功したレスポンスのみインスタンス間で共有する
+single_flight = SingleFlight(coalescing_store_from_env(), cacheable=lambda result: result["statusCode"] == 200)
+PROMPT_VERSION = prompt_version(extra=model_router.version())
+
+@functools.cache
+def read_prompt(prompt_file: str) -> str:
+    # プロンプトはデプロイ後に変わらないため、コンテナごとに1回だけ読み込む
+    with open(prompt_file, "r", encoding="utf-8") as file:
+        return file.read()
+
+@profiled
+def execute_extraction(filepath: str, page: int, mime_type: str, type_hint: str | None = None,
+                       deadline: Deadline | None = None, checkpoint: dict | None = None,
+                       packer: ExtractionPacker | None = None) -> dict:
     print(f"[EXTRACTING]: {os.path.basename(filepath)}...")
     start_time = time.time()
 
-    with open("prompt_certificate_type.txt", "r", encoding="utf-8") as file:
-        prompt_certificate_type = file.read()
-
-    output = __execute_vertex_ai_with_retry(filepath, prompt_certificate_type, mime_type)
-
-    certificate_type = output.get("帳票の種類")
-    if certificate_type == "1": # 生命保険控除証明書
-        with open("prompt_life_insurance.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        outputs = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_life_insurance_api_response(page, outputs, certificate_type)
-
-    elif certificate_type == "2": # 地震保険控除証明書
-        with open("prompt_earthquake_insurance.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_earthquake_insurance_api_response(page, output, certificate_type)
-    elif certificate_type == "3": # 社会保険控除証明書
-        with open("prompt_social_insurance.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_social_insurance_api_response(page, output, certificate_type)
-    elif certificate_type == "4": # 小規模共済控除証明書
-        with open("prompt_small_mutual_aid.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_small_mutual_aid_api_response(page, output, certificate_type)
+    prompt_certificate_type = read_prompt("prompt_certificate_type.txt")
+
+    def classify():
+        output = __execute_vertex_ai_with_retry(
+            filepath, prompt_certificate_type, mime_type, CLASSIFICATION_SCHEMA, "classification", deadline
+        )
+        certificate_type = output.get("帳票の種類")
+        if checkpoint is not None:
+            checkpoint["certificate_type"] = certificate_type
+        return certificate_type
+
+    def extract(certificate_type):
+        prompt_file, _ = CERTIFICATE_EXTRACTORS[certificate_type]
+        prompt = read_prompt(prompt_file)
+        schema = EXTRACTION_SCHEMAS[certificate_type]
+        stage = f"extraction-{certificate_type}"
+        extract_single = lambda: __execute_vertex_ai_with_retry(filepath, prompt, mime_type, schema, stage, deadline)
+        if packer is None or not packer.accepts(certificate_type):
+            return extract_single()
+        # 同時に処理中の同じ種類のページと1回の呼び出しにまとめる (プロンプトを送るのは1回だけ)
+        return packer.extract(
+            (certificate_type, mime_type),
+            filepath,
+            lambda filepaths: __execute_vertex_ai_with_retry(
+                filepaths, packed_prompt(prompt, len(filepaths)), mime_type, packed_schema(schema), stage, deadline
+            ),
+            extract_single,
+            # 昇格の判定はページごとに行う (疎な結果のページだけ1画像の呼び出しでやり直す)
+            lambda output: model_router.escalation_reason(stage, output) is not None,
+        )
+
+    if checkpoint is not None and "certificate_type" in checkpoint:
+        # 前回の試行で判定済みの場合は抽出のみ再実行する
+        certificate_type = checkpoint["certificate_type"]
+        outputs = extract(certificate_type) if certificate_type in CERTIFICATE_EXTRACTORS else None
+    else:
+        # 残り時間が少ない場合は投機的な抽出を行わない
+        allow_speculation = deadline is None or deadline.allows(DEADLINE_PAGE_RESERVE)
+        certificate_type, outputs = speculative_extractor.run(classify, extract, type_hint, allow_speculation)
+
+    if certificate_type in CERTIFICATE_EXTRACTORS:
+        _, get_api_response = CERTIFICATE_EXTRACTORS[certificate_type]
+        api_response = get_api_response(page, outputs, certificate_type)
     else: # 判別できない場合
         print(f"Unknown certificate type: {certificate_type}. Using default response.")
         api_response = get_default_api_response()
@@ -652,97 +717,256 @@ def execute_extraction(filepath: str, page: int, mime_type: str) -> dict:
     print(f"Processed {os.path.basename(filepath)} in {elapsed:.2f} seconds.")
     return api_response
 
+def process_document(media_data: bytes, media_type: str, type_hint: str | None, deadline: Deadline) -> dict:
+    """
+    Run the extraction pipeline on one uploaded document.
+
+    Returns:
+        {"statusCode": int, "body": dict}; the body is serialized by the caller
+    """
+    # Create temporary file to save the media data
+    if media_type == "image/jpeg":
+        file_extension = ".jpg"
+    elif media_type == "image/png":
+        file_extension = ".png"
+    elif media_type == "application/pdf":
+        file_extension = ".pdf"
+    else:
+        raise ValueError(f"Unsupported media type: {media_type}")
+
+    temp_fd, filepath = tempfile.mkstemp(suffix=file_extension)
+
+    try:
+        # Save the media data to the temporary file
+        with os.fdopen(temp_fd, 'wb') as temp_file:
+            temp_file.write(media_data)
+
+        documents = []
+        page_errors = []  # ページ単位のエラー
+        unprocessed_pages = []  # 残り時間不足で処理できなかったページ
+        page_seconds = []
+        if media_type == "image/jpeg" or media_type == "image/png":
+            try:
+                document, error = run_page(
+                    lambda checkpoint: execute_extraction(filepath, 1, media_type, type_hint, deadline, checkpoint), 1
+                )
+                documents.extend([document] if document else [])
+                page_errors.extend([error] if error else [])
+            except DeadlineExceededError as e:
+                print(f"Deadline exceeded on page 1 of {filepath}: {e}")
+                unprocessed_pages.append(1)
+        elif media_type == "application/pdf":
+            with open(filepath, 'rb') as file:
+                pdf_reader = pypdf.PdfReader(file)
+                num_pages = len(pdf_reader.pages)
+
+                if num_pages >= 20:
+                    raise ValueError(f"Too many pages ({num_pages}) in {filepath}. Please split the PDF into smaller files.")
+
+                for page_num in range(num_pages):
+                    page = page_num + 1
+                    # 残り時間が1ページ分の見込み時間を下回ったら新しいページを開始しない
+                    page_reserve = max(DEADLINE_PAGE_RESERVE, sum(page_seconds) / len(page_seconds) if page_seconds else 0)
+                    if unprocessed_pages or not deadline.allows(page_reserve):
+                        print(f"Deadline approaching ({deadline.remaining():.1f}s left), skipping page {page}")
+                        unprocessed_pages.append(page)
+                        continue
+
+                    page_started_at = time.time()
+                    new_pdf_writer = pypdf.PdfWriter()
+                    new_pdf_writer.add_page(pdf_reader.pages[page_num])
+                    temp_fd_page, temp_page_filepath = tempfile.mkstemp(suffix=f'_page_{page}.pdf')
+
+                    try:
+                        with os.fdopen(temp_fd_page, 'wb') as temp_file:
+                            new_pdf_writer.write(temp_file)
+                        document, error = run_page(
+                            lambda checkpoint: execute_extraction(
+                                temp_page_filepath, page, media_type, type_hint, deadline, checkpoint
+                            ),
+                            page,
+                        )
+                        if document:
+                            documents.append(document)
+                            page_seconds.append(time.time() - page_started_at)
+                        else:
+                            page_errors.append(error)
+                    except DeadlineExceededError as e:
+                        print(f"Deadline exceeded on page {page} of {filepath}: {e}")
+                        unprocessed_pages.append(page)
+                    except Exception as e:
+                        print(f"Error processing page {page} of {filepath}: {e}")
+                        page_errors.append(page_error(page, "preparation", e))
+                    finally:
+                        if os.path.exists(temp_page_filepath):
+                            os.unlink(temp_page_filepath)
+
+        return document_result(documents, page_errors, unprocessed_pages)
+
+    finally:
+        # Clean up the main temporary file
+        if os.path.exists(filepath):
+            os.unlink(filepath)
+
+# バッチリクエストでは同じ種類の小さな帳票の抽出をまとめる
+extraction_packer = ExtractionPacker.from_env()
+
+def process_page(filepath: str, page: int, media_type: str, type_hint: str | None, deadline: Deadline):
+    return run_page(
+        lambda checkpoint: execute_extraction(
+            filepath, page, media_type, type_hint, deadline, checkpoint, extraction_packer
+        ),
+        page,
+    )
+
+# バッチリクエストのページはすべて1つのプールで処理する
+batch_scheduler = BatchScheduler(process_page)
+
+def process_batch(event, deadline: Deadline, response_format: str) -> dict:
+    """Process a multi-file upload in one invocation and return per-file documents and errors."""
+    files = parse_batch_upload(event)
+    started_at = time.time()
+    results = batch_scheduler.run(files, deadline)
+    print(f"Processed batch of {len(files)} files in {time.time() - started_at:.2f} seconds.")
+    print(f"Model output stats: {output_stats.summary()}")
+    print(f"Model tier stats: {model_router.summary()}")
+    print(f"Concurrency limit: {call_limiter.summary()}")
+    print(f"Quota pool slots: {slot_router.summary()}")
+    print(f"Admission control: {admission.summary()}")
+    print(f"Extraction packing: {extraction_packer.summary()}")
+
+    # 1ファイルでも成功すれば 200 (ファイルごとの結果は StatusCode で返す)
+    statuses = [result["StatusCode"] for result in results]
+    return {
+        "statusCode": 200 if 200 in statuses else max(statuses),
+        "headers": {"Content-Type": "application/json; charset=utf-8"},
+        "body": dumps({"Files": results}, response_format),
+    }
+
+def __warm_pdf():
+    # pypdf の読み込み・分割の初回コスト (遅延インポートを含む) を先に払っておく
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(72, 72)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    page_writer = pypdf.PdfWriter()
+    page_writer.add_page(pypdf.PdfReader(io.BytesIO(buffer.getvalue())).pages[0])
+    page_writer.write(io.BytesIO())
+
+def __warm_connections():
+    # 優先度の高いリージョンの全プロジェクトのクライアントを作成し、認証トークンの取得と接続を済ませておく (モデルは呼ばない)
+    def connect(slot):
+        for _ in slot_router.client(slot).models.list(config={"page_size": 1}):
+            break
+    slots = [slot for slot in slot_router.slots if slot.rank < WARMUP_REGIONS]
+    with ThreadPoolExecutor(max_workers=len(slots)) as pool:
+        list(pool.map(connect, slots))
+
+warmer = Warmer({
+    "prompts": lambda: [read_prompt(prompt_file) for prompt_file in
+                        ["prompt_certificate_type.txt", *(prompt for prompt, _ in CERTIFICATE_EXTRACTORS.values())]],
+    "pdf": __warm_pdf,
+    "connections": __warm_connections,
+})
+
+def authorization_error(event) -> dict | None:
+    """403 response when the event does not carry the API key as a Bearer token, None when it does."""
+    headers = event.get("headers") or {}
+    authorization = headers.get("Authorization") or headers.get("authorization")
+
+    if not authorization:
+        return {
+            "statusCode": 403,
+            "headers": {"Content-Type": "application/json; charset=utf-8"},
+            "body": json.dumps({"error": "Authorization header is required"}),
+        }
+
+    if not authorization.startswith("Bearer "):
+        return {
+            "statusCode": 403,
+            "headers": {"Content-Type": "application/json; charset=utf-8"},
+            "body": json.dumps({"error": "Invalid authorization format. Use 'Bearer <token>'"}),
+        }
+
+    token = authorization[7:]  # Remove "Bearer " prefix
+
+    if token != API_KEY:
+        return {
+            "statusCode": 403,
+            "headers": {"Content-Type": "application/json; charset=utf-8"},
+            "body": json.dumps({"error": "Invalid API key"}),
+        }
+    return None
+
+def warm_up(event, context) -> dict:
+    """
+    Warm this container (and, with a concurrency above one, others) without model calls.
+
+    No authentication is needed to warm this container; a Function URL ping fans
+    out to other containers only with a valid Bearer token.
+    """
+    invoke = lambda_invoker(getattr(context, "invoked_function_arn", None))
+    concurrency = warmup_concurrency(event, authorized=authorization_error(event) is None)
+    result = warmer.run(concurrency, invoke, hold_container=bool(event.get("hold")))
+    print(f"Warm-up: {result}")
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json; charset=utf-8"},
+        "body": json.dumps({"Warmup": result}),
+    }
+
 def lambda_handler(event, context):
+    # プロファイルは指定・抽出されたリクエストだけで行う
+    mode = request_profiler.mode(event)
+    if mode is not None:
+        return request_profiler.run(lambda: handle_request(event, context), mode, requested_format(event))
+    return handle_request(event, context)
+
+def handle_request(event, context):
+    # Lambda の残り実行時間から処理の締め切りを決める
+    deadline = Deadline.from_lambda_context(context)
+    if is_warmup_event(event):
+        return warm_up(event, context)
     try:
         # Check Bearer token authentication
-        headers = event.get("headers", {})
-        authorization = headers.get("Authorization") or headers.get("authorization")
-        
-        if not authorization:
-            return {
-                "statusCode": 403,
-                "headers": {"Content-Type": "application/json; charset=utf-8"},
-                "body": json.dumps({"error": "Authorization header is required"}),
-            }
-        
-        if not authorization.startswith("Bearer "):
-            return {
-                "statusCode": 403,
-                "headers": {"Content-Type": "application/json; charset=utf-8"},
-                "body": json.dumps({"error": "Invalid authorization format. Use 'Bearer <token>'"}),
-            }
-        
-        token = authorization[7:]  # Remove "Bearer " prefix
-        
-        if token != API_KEY:
-            return {
-                "statusCode": 403,
-                "headers": {"Content-Type": "application/json; charset=utf-8"},
-                "body": json.dumps({"error": "Invalid API key"}),
-            }
-        
-        body = json.loads(event["body"])
-        data = body.get("data")  # image or pdf data in base64 format
-        media_type = body.get("media_type").lower()  # image/jpeg, image/png, or application/pdf
-        media_data = base64.b64decode(data)
-
-        # Create temporary file to save the media data
-        if media_type == "image/jpeg":
-            file_extension = ".jpg"
-        elif media_type == "image/png":
-            file_extension = ".png"
-        elif media_type == "application/pdf":
-            file_extension = ".pdf"
-        else:
-            raise ValueError(f"Unsupported media type: {media_type}")
+        error = authorization_error(event)
+        if error is not None:
+            return error
+
+        # バックエンドが飽和している間は全スロットを試す前に 429 で断る (待たせても失敗するだけのため)
+        retry_after = admission.retry_after()
+        if retry_after is not None:
+            print(f"Rejecting request, model backend saturated for {retry_after:.1f}s more")
+            return rejection(retry_after)
+
+        response_format = requested_format(event)  # "compact" は位置のプレースホルダーと空リストを省略する
+        if is_batch_request(event):
+            return process_batch(event, deadline, response_format)
+
+        # JSON (base64), raw binary, or multipart/form-data; optionally gzip-encoded
+        media_data, media_type, options = parse_upload(event)  # image/jpeg, image/png, or application/pdf
+        type_hint = options.get("certificate_type_hint")  # optional: expected certificate type for speculative extraction
+
+        # 同じ文書が処理中に再送された場合は、処理中のリクエストの結果を共有する
+        key = content_key(media_data, media_type, PROMPT_VERSION)
+        result, coalesced = single_flight.run(
+            key, lambda: process_document(media_data, media_type, type_hint, deadline), deadline
+        )
+        response_headers = {"Content-Type": "application/json; charset=utf-8"}
+        print(f"Model output stats: {output_stats.summary()}")
+        print(f"Model tier stats: {model_router.summary()}")
+        print(f"Concurrency limit: {call_limiter.summary()}")
+        print(f"Quota pool slots: {slot_router.summary()}")
+        print(f"Admission control: {admission.summary()}")
+        if coalesced:
+            print(f"Coalesced duplicate request ({coalesced}): {dict(single_flight.stats)}")
+            response_headers["X-Coalesced"] = coalesced
 
-        temp_fd, filepath = tempfile.mkstemp(suffix=file_extension)
-        
-        try:
-            # Save the media data to the temporary file
-            with os.fdopen(temp_fd, 'wb') as temp_file:
-                temp_file.write(media_data)
-
-            documents = []
-            if media_type == "image/jpeg" or media_type == "image/png":
-                document = execute_extraction(filepath, 1, media_type)
-                documents.append(document)
-            elif media_type == "application/pdf":
-                with open(filepath, 'rb') as file:
-                    pdf_reader = pypdf.PdfReader(file)
-                    num_pages = len(pdf_reader.pages)
-
-                    if num_pages >= 20:
-                        raise ValueError(f"Too many pages ({num_pages}) in {filepath}. Please split the PDF into smaller files.")
-
-                    for page_num in range(num_pages):
-                        page = page_num + 1
-                        new_pdf_writer = pypdf.PdfWriter()
-                        new_pdf_writer.add_page(pdf_reader.pages[page_num])
-                        temp_fd_page, temp_page_filepath = tempfile.mkstemp(suffix=f'_page_{page}.pdf')
-
-                        try:
-                            with os.fdopen(temp_fd_page, 'wb') as temp_file:
-                                new_pdf_writer.write(temp_file)
-                            document = execute_extraction(temp_page_filepath, page, media_type)
-                            documents.append(document)
-                        except Exception as e:
-                            print(f"Error processing page {page} of {filepath}: {e}")
-                            raise e
-                        finally:
-                            if os.path.exists(temp_page_filepath):
-                                os.unlink(temp_page_filepath)
-
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json; charset=utf-8"},
-                "body": json.dumps({ "Documents": documents }, ensure_ascii=False),
-            }
-
-        finally:
-            # Clean up the main temporary file
-            if os.path.exists(filepath):
-                os.unlink(filepath)
+        return {
+            "statusCode": result["statusCode"],
+            "headers": response_headers,
+            "body": dumps(result["body"], response_format),
+        }
 
     except Exception as e:
         print(f"Lambda handler error: {e}")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Load generator for the extraction endpoint (deployed function URL or local_lambda_server.py).
+Replays sample documents at a fixed request rate (open loop) or with a fixed
+number of concurrent clients (closed loop) for a set duration, then reports
+latency percentiles, a latency histogram, errors by status and throughput.
+
+Usage:
+    python load_test.py --url http://127.0.0.1:8080/ --files "data_sample/*" --concurrency 8 --duration 60
+    python load_test.py --url <FUNCTION_URL> --rate 2 --duration 300 --output run.json --compare baseline.json
+"""
+
+import argparse
+import glob
+import json
+import mimetypes
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from test_lambda_endpoint import build_request
+
+# ヒストグラムの上限 (秒)。これを超えるものは最後のバケットに入る
+HISTOGRAM_BOUNDS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300]
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def load_documents(pattern: str) -> list[tuple[str, bytes, str]]:
+    documents = []
+    for filepath in sorted(glob.glob(pattern)):
+        media_type, _ = mimetypes.guess_type(filepath)
+        if media_type not in ("image/jpeg", "image/png", "application/pdf"):
+            continue
+        with open(filepath, "rb") as f:
+            documents.append((filepath, f.read(), media_type))
+    return documents
+
+
+class LoadRun:
+    """
+    Collects one result per request: (start offset, latency, status, response bytes).
+
+    Args:
+        url (str): Endpoint URL
+        documents (list): (path, data, media type) tuples, replayed round-robin
+        timeout (float): Per-request timeout in seconds
+        upload (str): Upload format passed to build_request
+        compress (bool): gzip request bodies
+        unique (bool): Append a request counter after the end of each file so that
+            repeated documents are not coalesced or served from the result store
+    """
+
+    def __init__(self, url: str, documents: list[tuple[str, bytes, str]], timeout: float,
+                 upload: str = "json", compress: bool = False, unique: bool = False):
+        self.url = url
+        self.timeout = timeout
+        self.unique = unique
+        self.upload = upload
+        self.compress = compress
+        self.documents = documents
+        # 毎回同じ内容を送る場合はリクエストを事前に組み立てておく
+        self.prepared = [build_request(data, media_type, upload, compress) for _, data, media_type in documents]
+        self.results = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, scheduled_at: float, started_at: float):
+        """Send the next document. Latency is measured from `scheduled_at`, so queueing delay counts."""
+        with self._lock:
+            index = self._next
+            self._next += 1
+        if self.unique:
+            # PDF/PNG/JPEG はファイル終端以降のバイトを無視するため、内容だけ一意にできる
+            _, data, media_type = self.documents[index % len(self.documents)]
+            body, headers = build_request(data + f"\n% load-test {index}\n".encode("ascii"), media_type, self.upload, self.compress)
+        else:
+            body, headers = self.prepared[index % len(self.prepared)]
+        try:
+            response = self._session().post(self.url, data=body, headers=headers, timeout=self.timeout)
+            status, size = str(response.status_code), len(response.content)
+        except requests.exceptions.Timeout:
+            status, size = "timeout", 0
+        except requests.exceptions.RequestException as e:
+            status, size = f"error:{e.__class__.__name__}", 0
+        latency = time.perf_counter() - scheduled_at
+        with self._lock:
+            self.results.append((scheduled_at - started_at, latency, status, size))
+
+    def run_closed(self, concurrency: int, duration: float) -> float:
+        started_at = time.perf_counter()
+
+        def client():
+            while time.perf_counter() - started_at < duration:
+                self.send(time.perf_counter(), started_at)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started_at
+
+    def run_open(self, rate: float, duration: float, max_in_flight: int) -> float:
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            sent = 0
+            while True:
+                scheduled_at = started_at + sent / rate
+                if scheduled_at - started_at >= duration:
+                    break
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, scheduled_at, started_at)
+                sent += 1
+        return time.perf_counter() - started_at
+
+    def summary(self, elapsed: float) -> dict:
+        latencies = sorted(latency for _, latency, _, _ in self.results)
+        ok_latencies = sorted(latency for _, latency, status, _ in self.results if status == "200")
+        statuses = Counter(status for _, _, status, _ in self.results)
+        histogram = Counter()
+        for latency in latencies:
+            bucket = next((f"<={bound}s" for bound in HISTOGRAM_BOUNDS if latency <= bound), f">{HISTOGRAM_BOUNDS[-1]}s")
+            histogram[bucket] += 1
+        total = len(self.results)
+        return {
+            "requests": total,
+            "elapsed_seconds": elapsed,
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "success_rps": statuses["200"] / elapsed if elapsed else 0.0,
+            "error_rate": (total - statuses["200"]) / total if total else 0.0,
+            "status_counts": dict(statuses),
+            "latency_seconds": {
+                "mean": sum(latencies) / total if total else None,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else None,
+                "success_p50": percentile(ok_latencies, 0.50),
+                "success_p95": percentile(ok_latencies, 0.95),
+            },
+            "histogram": {
+                bucket: histogram[bucket]
+                for bucket in [f"<={bound}s" for bound in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1]}s"]
+                if histogram[bucket]
+            },
+        }
+
+
+def print_summary(summary: dict, baseline: dict | None = None):
+    print(f"📊 {summary['requests']} requests in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['throughput_rps']:.2f} req/s, {summary['success_rps']:.2f} ok/s), "
+          f"error rate {summary['error_rate']:.1%}")
+    print(f"   Status: {summary['status_counts']}")
+    for name in ("mean", "p50", "p95", "p99", "max"):
+        value = summary["latency_seconds"][name]
+        line = f"   {name:>4}: {value:8.3f}s" if value is not None else f"   {name:>4}:        -"
+        previous = baseline["latency_seconds"].get(name) if baseline else None
+        if value is not None and previous:
+            line += f"  ({(value - previous) / previous:+.1%} vs. baseline)"
+        print(line)
+    if baseline:
+        print(f"   throughput: {summary['throughput_rps'] - baseline['throughput_rps']:+.2f} req/s, "
+              f"error rate: {summary['error_rate'] - baseline['error_rate']:+.1%} vs. baseline")
+    print("   Histogram:")
+    for bucket, count in summary["histogram"].items():
+        print(f"   {bucket:>7} {count:6d} {'#' * max(1, round(40 * count / summary['requests']))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # 本番のクォータを使わないよう、既定はローカルサーバー (local_lambda_server.py)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/", help="function URL or local server URL")
+    parser.add_argument("--files", default="data_sample/*", help="glob of documents to replay")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=4, help="concurrent clients (closed loop)")
+    mode.add_argument("--rate", type=float, help="requests per second (open loop)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="open loop: maximum outstanding requests")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to generate load")
+    parser.add_argument("--upload", choices=["json", "raw", "multipart"], default="json", help="upload format")
+    parser.add_argument("--gzip", action="store_true", help="gzip the request body")
+    parser.add_argument("--unique", action="store_true",
+                        help="make every request body unique so duplicates are not coalesced by the server")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout (seconds)")
+    parser.add_argument("--output", help="write the summary and configuration as JSON")
+    parser.add_argument("--compare", help="JSON output of a previous run to compare against")
+    args = parser.parse_args()
+
+    documents = load_documents(args.files)
+    if not documents:
+        print(f"❌ No supported documents match {args.files}")
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["summary"]
+
+    load = LoadRun(args.url, documents, args.timeout, args.upload, args.gzip, args.unique)
+    if args.rate:
+        print(f"🚀 {args.rate} req/s for {args.duration}s against {args.url} ({len(documents)} documents)")
+        elapsed = load.run_open(args.rate, args.duration, args.max_in_flight)
+    else:
+        print(f"🚀 {args.concurrency} clients for {args.duration}s against {args.url} ({len(documents)} documents)")
+        elapsed = load.run_closed(args.concurrency, args.duration)
+
+    summary = load.summary(elapsed)
+    print_summary(summary, baseline)
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "summary": summary, "finished_at": time.time()}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
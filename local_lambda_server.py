@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Local HTTP server wrapping lambda_handler, for load tests without deploying.
+Requests are converted to Lambda function URL events (binary bodies are
+base64-encoded with isBase64Encoded, as function URLs do) and each invocation
+gets a context with the Lambda time limit, so deadline handling behaves the same.
+
+Usage:
+    python local_lambda_server.py [--port 8080] [--timeout 300] [--fake]
+"""
+
+import argparse
+import base64
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+TEXT_CONTENT_TYPES = ("application/json", "text/")
+
+
+class LocalContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+
+def to_lambda_event(method: str, path: str, headers: dict, body: bytes) -> dict:
+    url = urlsplit(path)
+    content_type = headers.get("content-type", "")
+    is_text = content_type.startswith(TEXT_CONTENT_TYPES) and "content-encoding" not in headers
+    return {
+        "rawPath": url.path,
+        "headers": headers,
+        "queryStringParameters": dict(parse_qsl(url.query)) or None,
+        "requestContext": {"http": {"method": method, "path": url.path}},
+        "body": body.decode("utf-8") if is_text else base64.b64encode(body).decode("ascii"),
+        "isBase64Encoded": not is_text,
+    }
+
+
+def make_handler(lambda_handler, timeout: float):
+    class LambdaRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            headers = {key.lower(): value for key, value in self.headers.items()}
+            response = lambda_handler(to_lambda_event("POST", self.path, headers, body), LocalContext(timeout))
+
+            payload = response.get("body", "")
+            payload = base64.b64decode(payload) if response.get("isBase64Encoded") else payload.encode("utf-8")
+            self.send_response(response.get("statusCode", 200))
+            for key, value in (response.get("headers") or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass  # リクエストごとのアクセスログは出さない (lambda_handler のログのみ)
+
+    return LambdaRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--timeout", type=float, default=300, help="simulated Lambda timeout per invocation (seconds)")
+    parser.add_argument("--fake", action="store_true", help="use the fake Gemini backend (no quota, API_KEY defaults to 'local')")
+    parser.add_argument("--classify-latency", type=float, default=0.5, help="fake backend latency (seconds)")
+    parser.add_argument("--extract-latency", type=float, default=1.0, help="fake backend latency (seconds)")
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ.setdefault("VERTEX_AI_PROJECT_ID", "local-project")
+        os.environ.setdefault("API_KEY", "local")
+    import lambda_function
+
+    if args.fake:
+        import fake_gemini
+
+        fake_gemini.install(lambda_function, fake_gemini.FakeGeminiClient(args.classify_latency, args.extract_latency))
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(lambda_function.lambda_handler, args.timeout))
+    print(f"Serving lambda_handler on http://{args.host}:{args.port}/{' (fake backend)' if args.fake else ''}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
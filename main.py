@@ -1,8 +1,6 @@
-import base64
-import json
+import argparse
 import glob
 import os
-import random
 import mimetypes
 from google import genai
 from google.genai import types
@@ -10,12 +8,31 @@ import time
 from pprint import pprint
 import pypdf
 import tempfile
+from typing import Callable
+from cassette import cassette
+from concurrency_limit import call_limiter
+from deadline import DEADLINE_PAGE_RESERVE, Deadline
+from model_routing import model_router
+from page_isolation import page_error, run_page
+from pipeline import BatchPipeline
+from progress import BatchProgress
+from result_store import JsonlResultStore, file_hash, prompt_version
+from watch_folder import FolderWatcher
+from quota_pool import SlotRouter
+from retry_policy import RetryPolicy
+from scheduling import BATCH_SCHEDULE, POLICIES, CompletionTracker, file_cost, order_files
+from speculation import SpeculativeExtractor, SPECULATIVE_EXTRACTION_BUDGET
+from structured_output import (
+    CLASSIFICATION_SCHEMA,
+    EXTRACTION_SCHEMAS,
+    STRUCTURED_OUTPUT_SCHEMAS,
+    MalformedOutputError,
+    output_stats,
+    parse_output,
+)
 
 VERTEX_AI_PROJECT_ID = os.environ.get("VERTEX_AI_PROJECT_ID")
 VERTEX_AI_LOCATION = os.environ.get("VERTEX_AI_LOCATION", "asia-northeast1")
-client = genai.Client(
-    vertexai=True, project=VERTEX_AI_PROJECT_ID, location=VERTEX_AI_LOCATION
-)
 VERTEX_AI_REGIONS = [
     "asia-northeast1",  # Tokyo
     "us-central1",  # Iowa
@@ -29,98 +46,70 @@ VERTEX_AI_REGIONS = [
     "europe-west4",  # Netherlands
     "global"
 ]
-available_regions = VERTEX_AI_REGIONS.copy()
-current_region_index = 0
-
-def __switch_to_next_region():
-    global current_region_index
-    current_region_index = (current_region_index + 1) % len(available_regions)
-    current_region = available_regions[current_region_index]
-    print(f"Switching to region: {current_region}")
-    __initialize_vertex_client()
-
-def __initialize_vertex_client():
-    global current_region_index, client
-    current_region = available_regions[current_region_index]
-    client = genai.Client(vertexai=True, project=VERTEX_AI_PROJECT_ID, location=current_region)
-
-
+# プロジェクト x リージョンのスロットに呼び出しを分散する (VERTEX_AI_LOCATION を最優先)
+slot_router = SlotRouter.from_env(
+    VERTEX_AI_PROJECT_ID,
+    [VERTEX_AI_LOCATION, *(region for region in VERTEX_AI_REGIONS if region != VERTEX_AI_LOCATION)],
+    lambda project, region, credentials: genai.Client(
+        vertexai=True, project=project, location=region, credentials=credentials
+    ),
+)
 
-def json_string_to_json(json_string) -> list[dict]:
-    try:
-        cleaned_json_string = (
-            json_string.replace("```json", "").replace("```", "").strip()
+retry_policy = RetryPolicy.from_env()
+
+def __execute_vertex_ai_with_retry(filepath: str, prompt: str, mime_type: str, schema: types.Schema, stage: str,
+                                   deadline: Deadline | None = None) -> dict | list[dict]:
+    """
+    Execute on the project x region slots with the configured retry policy; malformed output is retried once.
+    Every attempt counts against the adaptive concurrency limit.
+    Output the stage's light model handles poorly is redone on the escalation model.
+    """
+    def run(model: str, attempt: int):
+        return retry_policy.execute(
+            lambda timeout: call_limiter.run(
+                lambda: slot_router.run(
+                    lambda client: execute_gemini(client, filepath, prompt, mime_type, schema, stage, model, timeout, attempt)
+                ),
+                stage,
+                timeout,
+            ),
+            regions=len(slot_router.slots),
+            failover=lambda: None,  # 失敗したスロットは冷却中になり、次の呼び出しは別のスロットを選ぶ
+            deadline=deadline,
         )
-        python_dict = json.loads(cleaned_json_string)
-        return python_dict
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        return []
-
-def __execute_vertex_ai_with_retry(filepath: str, prompt: str, mime_type: str, max_retries: int = 3,
-    ) -> list[dict]:
-        """Execute with multi-region failover and exponential backoff"""
-        global current_region_index
-
-        # Phase 1: Try all regions
-        for region_attempt in range(len(available_regions)):
-            try:
-                # リージョン間の負荷分散用遅延
-                time.sleep(random.uniform(0.5, 1.0))
-
-                result = execute_gemini(filepath, prompt, mime_type)
-                if region_attempt > 0:
-                    current_region_index = 0
-                return result
-
-            except Exception as e:
-                if _is_error_429(e):
-                    print(f"Region {available_regions[current_region_index]} quota exhausted, switching region")
-                    __switch_to_next_region()
-                    continue
-                elif _is_error_503(e):
-                    print(f"Region {available_regions[current_region_index]} service unavailable, switching region")
-                    __switch_to_next_region()
-                    continue
-                else:
-                    raise e
-
-        # Phase 2: Exponential backoff across all regions if all failed with 429
-        for retry in range(max_retries):
-            delay = (2**retry) + random.uniform(0, 1)
-            print(f"All regions exhausted, retry {retry + 1}/{max_retries} after {delay:.1f}s")
-            __async_delay(delay)
 
-            for region_attempt in range(len(available_regions)):
-                try:
-                    result = execute_gemini(filepath, prompt, mime_type)
-                    current_region_index = 0
-                    return result
-
-                except Exception as e:
-                    if not _is_error_429(e) and not _is_error_503(e):
-                        raise e
-                    __switch_to_next_region()
-
-        # All retries exhausted
-        raise Exception("All retries exhausted")
-
-
-def _is_error_429(error: Exception) -> bool:
-        return "429" in str(error) or "Resource exhausted" in str(error)
-
-def _is_error_503(error: Exception) -> bool:
-    return "503" in str(error) or "Service unavailable" in str(error) or "Candidates token count is None" in str(error)
+    model = model_router.model(stage)
+    try:
+        output = run(model, 0)
+    except MalformedOutputError as e:
+        # 不正な出力はこの呼び出しだけを1回やり直す (ページ全体は再処理しない)。軽量モデルなら昇格する
+        if model_router.can_escalate(stage):
+            model_router.record_escalation(stage, "malformed")
+            model = model_router.escalation_model
+        print(f"Malformed {stage} output, retrying once on {model}: {e}")
+        try:
+            output = run(model, 1)
+        except MalformedOutputError:
+            output_stats.record_retry(stage, recovered=False)
+            raise
+        output_stats.record_retry(stage, recovered=True)
+        return output
+
+    reason = model_router.escalation_reason(stage, output)
+    if reason is not None:
+        print(f"Escalating {stage} from {model} to {model_router.escalation_model}: {reason}")
+        model_router.record_escalation(stage, reason)
+        try:
+            output = run(model_router.escalation_model, 0)
+        except Exception as e:
+            # 昇格に失敗した場合は軽量モデルの結果を使う
+            print(f"Escalation of {stage} failed, keeping the {model} result: {e}")
+    return output
 
-def __async_delay(seconds: float):
-    time.sleep(seconds)
-    
-def execute_gemini(filepath: str, prompt: str, mime_type: str) -> list[dict]:
+def execute_gemini(client, filepath: str, prompt: str, mime_type: str, schema: types.Schema, stage: str, model: str,
+                  timeout: float | None = None, attempt: int = 0) -> dict | list[dict]:
     with open(filepath, "rb") as f:
         file_data = f.read()
-        data = base64.b64encode(file_data).decode("utf-8")
-
-    output = []
 
     # --- 固定プロンプト & 入力画像 ----------------------------------
     contents = types.Content(
@@ -129,7 +118,7 @@ def execute_gemini(filepath: str, prompt: str, mime_type: str) -> list[dict]:
             types.Part(text=prompt),
             types.Part(
                 inline_data=types.Blob(
-                    mime_type=mime_type, data=base64.b64decode(data)
+                    mime_type=mime_type, data=file_data
                 )
             ),
         ]
@@ -140,34 +129,45 @@ def execute_gemini(filepath: str, prompt: str, mime_type: str) -> list[dict]:
         temperature=0,
         max_output_tokens=10240,
         response_mime_type="application/json",
+        response_schema=schema if STRUCTURED_OUTPUT_SCHEMAS else None,
         candidate_count=1,
         top_k=1,
         top_p=0.0,
-        seed=1234567890,
+        seed=1234567890 + attempt,  # 不正な出力のやり直しでは別の seed を使う
         thinking_config=types.ThinkingConfig(thinking_budget=0),
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
     )
 
     # --- 推論 --------------------------------
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
+    started_at = time.perf_counter()
+    response = cassette.generate_content(
+        client,
+        model=model,
         contents=contents,
         config=cfg,
     )
+    model_router.record(stage, model, time.perf_counter() - started_at, getattr(response, "usage_metadata", None))
     # --- レスポンスの処理 ------------------------------------------
+    text = None
     if response and response.candidates and len(response.candidates) > 0:
         candidate = response.candidates[0]
         if hasattr(candidate, "content") and candidate.content:
             text = candidate.content.parts[0].text if candidate.content.parts else None
-            if text:
-                output = json_string_to_json(text)
         elif hasattr(candidate, "text"):
             text = candidate.text
-            output = json_string_to_json(text)
         else:
             print("No text content in candidate")
     else:
         print("No candidates in response")
 
+    usage = getattr(response, "usage_metadata", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    try:
+        output = parse_output(text, schema)
+    except MalformedOutputError:
+        output_stats.record(stage, output_tokens, parse_failed=True)
+        raise
+    output_stats.record(stage, output_tokens)
     return output
 
 def get_default_api_response():
@@ -617,39 +617,53 @@ def get_small_mutual_aid_api_response(page: int, outputs: list[dict], certificat
         "SmallMutuals": small_mutual_aids,
     }
 
-def execute_extraction(filepath: str, page: int, mime_type: str) -> dict:
+# 帳票の種類 -> (抽出プロンプト, レスポンス生成関数)
+CERTIFICATE_EXTRACTORS = {
+    "1": ("prompt_life_insurance.txt", get_life_insurance_api_response),  # 生命保険控除証明書
+    "2": ("prompt_earthquake_insurance.txt", get_earthquake_insurance_api_response),  # 地震保険控除証明書
+    "3": ("prompt_social_insurance.txt", get_social_insurance_api_response),  # 社会保険控除証明書
+    "4": ("prompt_small_mutual_aid.txt", get_small_mutual_aid_api_response),  # 小規模共済控除証明書
+}
+speculative_extractor = SpeculativeExtractor(SPECULATIVE_EXTRACTION_BUDGET, CERTIFICATE_EXTRACTORS)
+
+def execute_extraction(filepath: str, page: int, mime_type: str, type_hint: str | None = None,
+                       deadline: Deadline | None = None, checkpoint: dict | None = None) -> dict:
     print(f"[EXTRACTING]: {os.path.basename(filepath)}...")
     start_time = time.time()
 
     with open("prompt_certificate_type.txt", "r", encoding="utf-8") as file:
         prompt_certificate_type = file.read()
 
-    output = __execute_vertex_ai_with_retry(filepath, prompt_certificate_type, mime_type)
-
-    certificate_type = output.get("帳票の種類")
-    print(f"Detected certificate type: {certificate_type}, varient type: {type(certificate_type)}")
-
-    if certificate_type == "1": # 生命保険控除証明書
-        with open("prompt_life_insurance.txt", "r", encoding="utf-8") as file:
+    def classify():
+        output = __execute_vertex_ai_with_retry(
+            filepath, prompt_certificate_type, mime_type, CLASSIFICATION_SCHEMA, "classification", deadline
+        )
+        certificate_type = output.get("帳票の種類")
+        print(f"Detected certificate type: {certificate_type}, varient type: {type(certificate_type)}")
+        if checkpoint is not None:
+            checkpoint["certificate_type"] = certificate_type
+        return certificate_type
+
+    def extract(certificate_type):
+        prompt_file, _ = CERTIFICATE_EXTRACTORS[certificate_type]
+        with open(prompt_file, "r", encoding="utf-8") as file:
             prompt = file.read()
-        outputs = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_life_insurance_api_response(page, outputs, certificate_type)
+        return __execute_vertex_ai_with_retry(
+            filepath, prompt, mime_type, EXTRACTION_SCHEMAS[certificate_type], f"extraction-{certificate_type}", deadline
+        )
 
-    elif certificate_type == "2": # 地震保険控除証明書
-        with open("prompt_earthquake_insurance.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_earthquake_insurance_api_response(page, output, certificate_type)
-    elif certificate_type == "3": # 社会保険控除証明書
-        with open("prompt_social_insurance.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output =  __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_social_insurance_api_response(page, output, certificate_type)
-    elif certificate_type == "4": # 小規模共済控除証明書
-        with open("prompt_small_mutual_aid.txt", "r", encoding="utf-8") as file:
-            prompt = file.read()
-        output = __execute_vertex_ai_with_retry(filepath, prompt, mime_type)
-        api_response = get_small_mutual_aid_api_response(page, output, certificate_type)
+    if checkpoint is not None and "certificate_type" in checkpoint:
+        # 前回の試行で判定済みの場合は抽出のみ再実行する
+        certificate_type = checkpoint["certificate_type"]
+        outputs = extract(certificate_type) if certificate_type in CERTIFICATE_EXTRACTORS else None
+    else:
+        # 残り時間が少ない場合は投機的な抽出を行わない
+        allow_speculation = deadline is None or deadline.allows(DEADLINE_PAGE_RESERVE)
+        certificate_type, outputs = speculative_extractor.run(classify, extract, type_hint, allow_speculation)
+
+    if certificate_type in CERTIFICATE_EXTRACTORS:
+        _, get_api_response = CERTIFICATE_EXTRACTORS[certificate_type]
+        api_response = get_api_response(page, outputs, certificate_type)
     else: # 判別できない場合
         print(f"Unknown certificate type: {certificate_type}. Using default response.")
         api_response = get_default_api_response()
@@ -658,55 +672,189 @@ def execute_extraction(filepath: str, page: int, mime_type: str) -> dict:
     print(f"Processed {os.path.basename(filepath)} in {elapsed:.2f} seconds.")
     return api_response
 
+SUPPORTED_MIME_TYPES = ("image/jpeg", "image/png", "application/pdf")
+
+def process_file(filepath: str, done_pages: set[int] = frozenset(),
+                 on_page: Callable[[int, dict | None, dict | None], None] | None = None,
+                 ) -> tuple[list[dict], list[dict]] | None:
+    """
+    Extract every page of one file. Returns (documents, errors), or None for unsupported files.
+    Pages in `done_pages` are skipped; `on_page(page, document, error)` is called as each page finishes.
+    """
+    documents = []
+    errors = []
+
+    def record(page: int, document: dict | None, error: dict | None):
+        documents.extend([document] if document else [])
+        errors.extend([error] if error else [])
+        if on_page is not None:
+            on_page(page, document, error)
+
+    mime_type = mimetypes.guess_type(filepath)[0]
+    if mime_type == "image/jpeg" or mime_type == "image/png":
+        if 1 not in done_pages:
+            document, error = run_page(lambda checkpoint: execute_extraction(filepath, 1, mime_type, checkpoint=checkpoint), 1)
+            record(1, document, error)
+    elif mime_type == "application/pdf":
+        with open(filepath, 'rb') as file:
+            pdf_reader = pypdf.PdfReader(file)
+            num_pages = len(pdf_reader.pages)
+
+            if num_pages >= 20:
+                raise ValueError(f"Too many pages ({num_pages}) in {filepath}. Please split the PDF into smaller files.")
+
+            for page_num in range(num_pages):
+                page = page_num + 1
+                if page in done_pages:
+                    continue
+                new_pdf_writer = pypdf.PdfWriter()
+                new_pdf_writer.add_page(pdf_reader.pages[page_num])
+                temp_fd, temp_filepath = tempfile.mkstemp(suffix=f'_page_{page}.pdf')
+
+                try:
+                    with os.fdopen(temp_fd, 'wb') as temp_file:
+                        new_pdf_writer.write(temp_file)
+                    document, error = run_page(
+                        lambda checkpoint: execute_extraction(temp_filepath, page, mime_type, checkpoint=checkpoint), page
+                    )
+                except Exception as e:
+                    print(f"Error processing page {page} of {filepath}: {e}")
+                    document, error = None, page_error(page, "preparation", e)
+                finally:
+                    if os.path.exists(temp_filepath):
+                        os.unlink(temp_filepath)
+                record(page, document, error)
+    else:
+        print(f"Unsupported file type: {mime_type} for {filepath}. Skipping.")
+        return None
+
+    return documents, errors
+
+def process_and_record(filepath: str, store: JsonlResultStore, version: str, progress: BatchProgress,
+                       resume: bool = True) -> int:
+    """
+    Process one file unless it is already finished in `store`, appending each page as it completes.
+
+    Returns:
+        int: Number of page errors recorded for the file (0 when it was skipped)
+    """
+    key = store.key(filepath, file_hash(filepath), version)
+    if resume and store.is_file_done(key):
+        progress.skip()
+        return 0
+    done_pages = store.done_pages(key) if resume else set()
+
+    try:
+        result = process_file(
+            filepath,
+            done_pages,
+            on_page=lambda page, document, error: store.record_page(key, page, document, error),
+        )
+    except Exception as e:
+        # 1ファイルの失敗でバッチ全体を止めない
+        print(f"Error processing {filepath}: {e}")
+        error = page_error(0, "preparation", e)
+        store.record_page(key, 0, error=error)
+        result = [], [error]
+    if result is None:
+        progress.skip()
+        return 0
+    documents, errors = result
+    store.record_file(key, len(done_pages) + len(documents) + len(errors), len(errors))
+    progress.advance(len(documents) + len(errors))
+
+    print("\nDocuments:")
+    pprint(documents)
+    if errors:
+        print("\nErrors:")
+        pprint(errors)
+    print(progress.summary())
+    print("\n" + "=" * 50 + "\n")
+    return len(errors)
+
 def main():
+    parser = argparse.ArgumentParser(description="Batch extraction of tax adjustment certificates")
+    parser.add_argument("--input", default="data_error/*", help="glob pattern of the files to process")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--no-resume", action="store_true", help="reprocess files already finished in --output")
+    parser.add_argument("--watch", metavar="DIR", help="keep running and process new or changed files dropped into DIR")
+    parser.add_argument("--workers", type=int, default=4, help="worker threads in --watch mode")
+    parser.add_argument("--queue-size", type=int, default=16, help="maximum queued files in --watch mode")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="run batches as a pipeline with this many PDF-preparation processes (0 = sequential)")
+    parser.add_argument("--io-workers", type=int, default=16, help="threads running model calls in --processes mode")
+    parser.add_argument("--schedule", choices=POLICIES, default=BATCH_SCHEDULE,
+                        help="file order: fifo (name order), sjf (fewest pages first), "
+                             "fair (round-robin across folders by pages served, fewest pages first)")
+    args = parser.parse_args()
+
+    store = JsonlResultStore(args.output)
+    version = prompt_version(extra=model_router.version())
+
+    if args.watch:
+        progress = BatchProgress(0)
+        watcher = FolderWatcher(
+            args.watch,
+            lambda filepath: process_and_record(filepath, store, version, progress, not args.no_resume),
+            workers=args.workers,
+            queue_size=args.queue_size,
+            accept=lambda filepath: mimetypes.guess_type(filepath)[0] in SUPPORTED_MIME_TYPES,
+        )
+        print(f"Watching {args.watch} (prompt version {version}), results -> {args.output}")
+        watcher.run()
+        return
 
-    filepaths = glob.glob(f"data_error/*", recursive=False)
+    filepaths = glob.glob(args.input, recursive=False)
     filepaths = sorted(filepaths)
-    filepaths = filepaths
+    # 大きな PDF が先頭にあると多数の小さなファイルが待たされるため、見込みコストで並べ替える
+    costs = {filepath: file_cost(filepath) for filepath in filepaths}
+    filepaths = order_files(filepaths, args.schedule, costs)
+    tracker = CompletionTracker()
+
+    if args.processes > 0:
+        pipeline = BatchPipeline(
+            lambda page_filepath, page, mime_type, checkpoint: execute_extraction(
+                page_filepath, page, mime_type, checkpoint=checkpoint
+            ),
+            store,
+            version,
+            processes=args.processes,
+            io_workers=args.io_workers,
+            queue_size=args.io_workers * 4,
+            on_file_done=tracker.done,
+        )
+        print(f"Processing {len(filepaths)} files with {args.processes} processes and {args.io_workers} I/O workers")
+        report = pipeline.run(filepaths, resume=not args.no_resume)
+        print("\nStage utilization:")
+        pprint(report)
+        print("\nCompletion times (schedule vs. FIFO):")
+        pprint(tracker.report(args.schedule, filepaths, costs, workers=args.io_workers))
+        print("\nModel output (tokens per call, parse failures):")
+        pprint(output_stats.summary())
+        print("\nModel tiers (latency, tokens, escalations):")
+        pprint(model_router.summary())
+        return
+
+    progress = BatchProgress(len(filepaths))
+    print(f"Processing {len(filepaths)} files ({args.schedule} order, prompt version {version}), results -> {args.output}")
 
     for filepath in filepaths:
         # if "SH" not in os.path.basename(filepath):
         #     continue
-        
-        documents = []
-        mime_type = mimetypes.guess_type(filepath)[0]
-        if mime_type == "image/jpeg" or mime_type == "image/png":
-            document = execute_extraction(filepath, 1, mime_type)
-            documents.append(document)
-        elif mime_type == "application/pdf":
-            with open(filepath, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-
-                if num_pages >= 20:
-                    raise ValueError(f"Too many pages ({num_pages}) in {filepath}. Please split the PDF into smaller files.")
-
-                for page_num in range(num_pages):
-                    page = page_num + 1
-                    new_pdf_writer = pypdf.PdfWriter()
-                    new_pdf_writer.add_page(pdf_reader.pages[page_num])
-                    temp_fd, temp_filepath = tempfile.mkstemp(suffix=f'_page_{page}.pdf')
-
-                    try:
-                        with os.fdopen(temp_fd, 'wb') as temp_file:
-                            new_pdf_writer.write(temp_file)
-                        document = execute_extraction(temp_filepath, page, mime_type)
-                        documents.append(document)
-                    except Exception as e:
-                        print(f"Error processing page {page} of {filepath}: {e}")
-                        raise e
-                    finally:
-                        if os.path.exists(temp_filepath):
-                            os.unlink(temp_filepath)
-
-        else:
-            print(f"Unsupported file type: {mime_type} for {filepath}. Skipping.")
-            continue
-        
-        print("\nDocuments:")
-        pprint(documents)
-        print("\n" + "=" * 50 + "\n")
-
+        process_and_record(filepath, store, version, progress, not args.no_resume)
+        tracker.done(filepath)
+
+    print("\nCompletion times (schedule vs. FIFO):")
+    pprint(tracker.report(args.schedule, filepaths, costs))
+
+    print("\nModel output (tokens per call, parse failures):")
+    pprint(output_stats.summary())
+    print("\nModel tiers (latency, tokens, escalations):")
+    pprint(model_router.summary())
+    print("\nConcurrency limit:")
+    pprint(call_limiter.summary())
+    print("\nQuota pool slots (calls, 429s, learned concurrency):")
+    pprint(slot_router.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import Counter
+from typing import Any, Optional
+
+# ステージごとのモデル (判定は1桁を返すだけなので軽量モデルで足りる)
+CLASSIFICATION_MODEL = os.environ.get("CLASSIFICATION_MODEL", "gemini-2.5-flash-lite")
+EXTRACTION_MODEL = os.environ.get("EXTRACTION_MODEL", "gemini-2.5-flash")
+# 軽量モデルの結果が不十分な場合にやり直すモデル (ステージのモデルと同じなら昇格しない)
+ESCALATION_MODEL = os.environ.get("ESCALATION_MODEL", "gemini-2.5-flash")
+# 抽出結果のうち値の入った項目の割合がこれを下回ると昇格する
+ESCALATION_MIN_FILLED = float(os.environ.get("ESCALATION_MIN_FILLED", "0.5"))
+
+CLASSIFICATION = "classification"
+EXTRACTION = "extraction"
+UNKNOWN_CERTIFICATE_TYPE = "0"
+
+
+def tier(stage: str) -> str:
+    """Collapse per-type stage names ("extraction-1") into the routing tier ("extraction")."""
+    return CLASSIFICATION if stage.startswith(CLASSIFICATION) else EXTRACTION
+
+
+def filled_ratio(outputs: Any) -> float:
+    """Share of extracted fields that have a value; an empty extraction counts as 0."""
+    rows = outputs if isinstance(outputs, list) else [outputs]
+    values = [value for row in rows if isinstance(row, dict) for value in row.values()]
+    if not values:
+        return 0.0
+    return sum(value not in (None, "") for value in values) / len(values)
+
+
+class ModelRouter:
+    """
+    Choose the model for each stage and decide when to escalate to the stronger model.
+
+    Classification runs on a light model and is escalated when it answers "0"
+    (unknown type). Extraction is escalated when its output is malformed or
+    fewer than `min_filled` of the fields have a value. Latency and token usage
+    are counted per stage and model so the tiers can be compared.
+
+    Args:
+        classification_model (str): Model for the certificate type classification
+        extraction_model (str): Model for the type-specific extraction
+        escalation_model (str): Model used when a stage's result is not good enough
+        min_filled (float): Minimum share of filled extraction fields before escalating
+    """
+
+    def __init__(self, classification_model: str = CLASSIFICATION_MODEL, extraction_model: str = EXTRACTION_MODEL,
+                 escalation_model: str = ESCALATION_MODEL, min_filled: float = ESCALATION_MIN_FILLED):
+        self.models = {CLASSIFICATION: classification_model, EXTRACTION: extraction_model}
+        self.escalation_model = escalation_model
+        self.min_filled = min_filled
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        return cls()
+
+    def model(self, stage: str) -> str:
+        return self.models[tier(stage)]
+
+    def can_escalate(self, stage: str) -> bool:
+        return self.model(stage) != self.escalation_model
+
+    def escalation_reason(self, stage: str, output: Any) -> Optional[str]:
+        """Return why `output` from the stage's model should be redone on the escalation model, or None."""
+        if not self.can_escalate(stage):
+            return None
+        if tier(stage) == CLASSIFICATION:
+            certificate_type = output.get("帳票の種類") if isinstance(output, dict) else None
+            return "unknown_type" if certificate_type == UNKNOWN_CERTIFICATE_TYPE else None
+        return "sparse_fields" if filled_ratio(output) < self.min_filled else None
+
+    def version(self) -> str:
+        """Routing configuration, mixed into the result version so cached results follow model changes."""
+        return f"{self.models[CLASSIFICATION]}/{self.models[EXTRACTION]}/{self.escalation_model}/{self.min_filled}"
+
+    def record(self, stage: str, model: str, latency: float, usage: Any = None):
+        key = f"{tier(stage)}@{model}"
+        with self._lock:
+            self.counts[f"{key}.calls"] += 1
+            self.counts[f"{key}.latency"] += latency
+            self.counts[f"{key}.input_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+            self.counts[f"{key}.output_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+
+    def record_escalation(self, stage: str, reason: str):
+        with self._lock:
+            self.counts[f"escalations.{tier(stage)}.{reason}"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        tiers = sorted({key.rsplit(".", 1)[0] for key in counts if not key.startswith("escalations.")})
+        return {
+            "tiers": {
+                key: {
+                    "calls": counts[f"{key}.calls"],
+                    "latency_per_call": counts[f"{key}.latency"] / counts[f"{key}.calls"],
+                    "input_tokens_per_call": counts[f"{key}.input_tokens"] / counts[f"{key}.calls"],
+                    "output_tokens_per_call": counts[f"{key}.output_tokens"] / counts[f"{key}.calls"],
+                }
+                for key in tiers
+            },
+            "escalations": {
+                key.removeprefix("escalations."): count for key, count in counts.items() if key.startswith("escalations.")
+            },
+        }
+
+
+model_router = ModelRouter.from_env()
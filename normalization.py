@@ -0,0 +1,96 @@
+import re
+import unicodedata
+from datetime import date
+from typing import Any, Optional
+
+from google.genai import types
+
+# yyyyMMdd に変換する項目
+DATE_FIELDS = {"契約日", "年金支払開始日", "契約開始日", "契約終了日"}
+
+# 元号 -> 元年の前年の西暦 (令和2年 = 2018 + 2 = 2020年)
+ERAS = {"令和": 2018, "平成": 1988, "昭和": 1925, "大正": 1911, "明治": 1867}
+ERA_LETTERS = {"R": "令和", "H": "平成", "S": "昭和", "T": "大正", "M": "明治"}
+
+WAREKI_DATE = re.compile(r"(令和|平成|昭和|大正|明治|[RHSTM])\.?(元|\d{1,2})[年./-](\d{1,2})[月./-](\d{1,2})日?")
+SEIREKI_DATE = re.compile(r"(\d{4})[年./-](\d{1,2})[月./-](\d{1,2})日?")
+COMPACT_DATE = re.compile(r"\d{8}")
+AMOUNT = re.compile(r"[¥]?(-?\d+)円?")
+CODE_WITH_LABEL = re.compile(r"(\d)\s*[:.]")
+
+
+def _halfwidth(text: str) -> str:
+    # 全角の数字・記号・空白を半角にし (NFKC)、空白を取り除く
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", text))
+
+
+def _yyyymmdd(year: int, month: int, day: int) -> Optional[str]:
+    try:
+        return date(year, month, day).strftime("%Y%m%d")
+    except ValueError:
+        return None
+
+
+def normalize_date(value: Any) -> Any:
+    """
+    Convert a date as printed on a certificate to yyyyMMdd.
+
+    Accepts wareki dates ("令和2年7月1日", "R2.7.1", "平成元年"), slash, dot and
+    kanji separated dates ("2020/07/01", "2020年7月1日") and yyyyMMdd itself,
+    with full-width digits. Anything else is returned trimmed, unchanged.
+    """
+    if not isinstance(value, str):
+        return value
+    text = _halfwidth(value)
+    if COMPACT_DATE.fullmatch(text):
+        return text
+    match = WAREKI_DATE.fullmatch(text)
+    if match:
+        era, year, month, day = match.groups()
+        year = 1 if year == "元" else int(year)
+        return _yyyymmdd(ERAS[ERA_LETTERS.get(era, era)] + year, int(month), int(day)) or value.strip()
+    match = SEIREKI_DATE.fullmatch(text)
+    if match:
+        return _yyyymmdd(*map(int, match.groups())) or value.strip()
+    return value.strip()
+
+
+def parse_amount(value: Any) -> Any:
+    """Parse an amount such as "50,000円" or "５０，０００" into an int; other values are returned unchanged."""
+    if not isinstance(value, str):
+        return value
+    match = AMOUNT.fullmatch(_halfwidth(value).replace(",", ""))
+    return int(match.group(1)) if match else value
+
+
+def normalize_output(value: Any, schema: types.Schema, key: Optional[str] = None) -> Any:
+    """
+    Normalize decoded model output in place of instructions in the prompts.
+
+    Walks the output along `schema`: integer fields are parsed as amounts, date
+    fields (DATE_FIELDS) are converted to yyyyMMdd, code fields answered as
+    "2:新" are reduced to the code and every other string is trimmed. Values of
+    an unexpected shape are left for the schema validation to reject.
+    """
+    if schema.type == types.Type.OBJECT and isinstance(value, dict):
+        properties = schema.properties or {}
+        return {
+            name: normalize_output(item, properties[name], name) if name in properties else item
+            for name, item in value.items()
+        }
+    if schema.type == types.Type.ARRAY:
+        if isinstance(value, dict):
+            return normalize_output(value, schema.items)
+        if isinstance(value, list):
+            return [normalize_output(item, schema.items) for item in value]
+        return value
+    if schema.type == types.Type.INTEGER:
+        return parse_amount(value)
+    if not isinstance(value, str):
+        return value
+    if key in DATE_FIELDS:
+        return normalize_date(value)
+    if schema.enum:
+        match = CODE_WITH_LABEL.match(_halfwidth(value))
+        return match.group(1) if match and value.strip() not in schema.enum else value.strip()
+    return value.strip()
@@ -0,0 +1,180 @@
+import os
+import threading
+from collections import Counter
+from typing import Any, Callable, Hashable, Optional
+
+from google.genai import types
+
+from structured_output import MalformedOutputError
+
+# 1回の抽出呼び出しにまとめる画像の最大数 (1 = まとめない)
+PACK_SIZE = int(os.environ.get("PACK_SIZE", "1"))
+# まとめる帳票の種類 (社会保険・小規模共済は1枚が小さく、プロンプトの比重が大きい)
+PACK_CERTIFICATE_TYPES = [value.strip() for value in os.environ.get("PACK_CERTIFICATE_TYPES", "3,4").split(",") if value.strip()]
+# 同じ種類の画像が揃うのを待つ最大時間 (秒)
+PACK_LINGER_SECONDS = float(os.environ.get("PACK_LINGER_SECONDS", "0.3"))
+
+PACK_IMAGE_KEY = "画像番号"
+PACK_RESULT_KEY = "証明書"
+
+
+def packed_schema(schema: types.Schema) -> types.Schema:
+    """Schema of a packed extraction: one {画像番号, 証明書} entry per attached image."""
+    return types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties={PACK_IMAGE_KEY: types.Schema(type=types.Type.INTEGER), PACK_RESULT_KEY: schema},
+            required=[PACK_IMAGE_KEY, PACK_RESULT_KEY],
+            property_ordering=[PACK_IMAGE_KEY, PACK_RESULT_KEY],
+        ),
+    )
+
+
+def packed_prompt(prompt: str, images: int) -> str:
+    """The extraction prompt followed by the instructions for several attached images."""
+    return (
+        f"{prompt.rstrip()}\n\n"
+        "** 複数の画像: **\n"
+        f"{images}枚の画像が順に添付されています。画像ごとに上記の情報を抽出し、次の形式の配列で返してください。\n"
+        f'[{{"{PACK_IMAGE_KEY}": 1, "{PACK_RESULT_KEY}": [画像1の抽出結果]}}, '
+        f'{{"{PACK_IMAGE_KEY}": 2, "{PACK_RESULT_KEY}": [画像2の抽出結果]}}, ...]\n'
+        f"{PACK_IMAGE_KEY}は添付の順に1から数え、情報を読み取れない画像も空の配列で必ず含めてください。\n"
+    )
+
+
+def unpack(outputs: Any, images: int) -> Optional[list]:
+    """Per-image results of a packed extraction in attachment order, or None when they do not map one to one."""
+    if not isinstance(outputs, list) or len(outputs) != images:
+        return None
+    results = {}
+    for output in outputs:
+        number = output.get(PACK_IMAGE_KEY) if isinstance(output, dict) else None
+        if not isinstance(number, int) or not 1 <= number <= images or number in results:
+            return None
+        results[number] = output.get(PACK_RESULT_KEY)
+    return [results[number] for number in range(1, images + 1)]
+
+
+class _Pack:
+    def __init__(self):
+        self.filepaths = []
+        self.closed = False
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None  # 画像ごとの結果 (None = 個別に抽出し直す)
+        self.error = None
+
+
+class ExtractionPacker:
+    """
+    Pack the extractions of concurrent same-type pages into one model call.
+
+    The first page of a key (certificate type and media type) opens a pack and
+    waits up to `linger` seconds for more pages with the same key, or until
+    `pack_size` pages joined; then it runs one extraction with every image
+    attached and hands each page its own result, mapped back by image number.
+    When the output does not map one to one onto the images (or stays
+    malformed), every page of the pack falls back to a single-image call. A
+    pack that nobody joined runs as a single-image call right away.
+
+    Args:
+        pack_size (int): Maximum images per call (1 = no packing)
+        certificate_types (list[str]): Certificate types that may be packed
+        linger (float): Seconds the first page waits for others
+    """
+
+    def __init__(self, pack_size: int = PACK_SIZE, certificate_types: list[str] = PACK_CERTIFICATE_TYPES,
+                 linger: float = PACK_LINGER_SECONDS):
+        self.pack_size = pack_size
+        self.certificate_types = set(certificate_types)
+        self.linger = linger
+        self.stats = Counter()
+        self._open = {}  # キー -> 画像を受け付けている _Pack
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ExtractionPacker":
+        return cls()
+
+    def accepts(self, certificate_type: Optional[str]) -> bool:
+        return self.pack_size > 1 and certificate_type in self.certificate_types
+
+    def _join(self, key: Hashable, filepath: str) -> tuple[_Pack, int, bool]:
+        with self._lock:
+            pack = self._open.get(key)
+            leader = pack is None
+            if leader:
+                pack = self._open[key] = _Pack()
+            pack.filepaths.append(filepath)
+            if len(pack.filepaths) >= self.pack_size:
+                self._close(key, pack)
+            return pack, len(pack.filepaths) - 1, leader
+
+    def _close(self, key: Hashable, pack: _Pack):
+        pack.closed = True
+        if self._open.get(key) is pack:
+            del self._open[key]
+        pack.full.set()
+
+    def _run(self, pack: _Pack, extract_pack: Callable[[list[str]], Any]):
+        images = len(pack.filepaths)
+        try:
+            results = unpack(extract_pack(list(pack.filepaths)), images)
+            reason = "results did not map back to the images"
+        except MalformedOutputError as e:
+            results, reason = None, f"malformed output ({e})"
+        with self._lock:
+            self.stats["packed_calls"] += 1
+            self.stats["packed_images"] += images
+            self.stats["mismatches"] += results is None
+        if results is None:
+            print(f"Packed extraction of {images} images failed, extracting them one by one: {reason}")
+        pack.results = results if results is not None else [None] * images
+
+    def extract(self, key: Hashable, filepath: str, extract_pack: Callable[[list[str]], Any],
+                extract_single: Callable[[], Any], redo: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Extract one page, packed with other pages of the same key when they arrive in time.
+
+        Args:
+            key: Pages with equal keys may share a call (certificate type, media type)
+            filepath: The page's file
+            extract_pack: Runs the packed extraction on the given files
+            extract_single: Runs this page's own single-image extraction
+            redo: Returns True for a packed result that should be redone on its own (e.g. too sparse)
+        """
+        pack, index, leader = self._join(key, filepath)
+        if leader:
+            pack.full.wait(self.linger)
+            with self._lock:
+                if not pack.closed:
+                    self._close(key, pack)
+            if len(pack.filepaths) == 1:
+                # 誰も加わらなかった場合は通常の1画像の呼び出し
+                with self._lock:
+                    self.stats["single_calls"] += 1
+                return extract_single()
+            try:
+                self._run(pack, extract_pack)
+            except Exception as e:
+                pack.error = e
+            finally:
+                pack.done.set()
+        else:
+            pack.done.wait()
+
+        if pack.error is not None:
+            raise pack.error
+        result = pack.results[index]
+        if result is None or (redo is not None and redo(result)):
+            with self._lock:
+                self.stats["fallback_calls"] += 1
+            return extract_single()
+        return result
+
+    def summary(self) -> dict:
+        with self._lock:
+            # まとめた画像の数だけ呼び出しが減り、減った呼び出しの分だけプロンプトの送信が減る
+            saved = self.stats["packed_images"] - self.stats["packed_calls"] - self.stats["fallback_calls"]
+            return {**self.stats, "calls_saved": saved}
@@ -0,0 +1,56 @@
+import os
+from typing import Callable, Optional
+
+from deadline import DeadlineExceededError
+from retry_policy import TERMINAL, RetryExhaustedError, classify_error
+from structured_output import MalformedOutputError
+
+# 失敗したページを段階単位で再試行する回数
+PAGE_STAGE_RETRIES = int(os.environ.get("PAGE_STAGE_RETRIES", "1"))
+
+
+def page_error(page: int, stage: str, error: Exception, attempts: int = 1) -> dict:
+    """Structured per-page error returned next to the successful documents."""
+    return {
+        "Page": page,
+        "Stage": stage,
+        "ErrorType": error.__class__.__name__,
+        "Message": str(error),
+        "Attempts": attempts,
+    }
+
+
+def run_page(extract_page: Callable[[dict], dict], page: int,
+             retries: int = PAGE_STAGE_RETRIES) -> tuple[Optional[dict], Optional[dict]]:
+    """
+    Run one page in isolation, retrying only the stage that failed.
+
+    `extract_page` receives a checkpoint dict that survives between attempts;
+    `execute_extraction` stores the detected certificate type in it, so a
+    retry after a failed extraction does not repeat the classification.
+    Deadline errors are not retried and propagate to the caller. A failed
+    extraction is retried after the call-level retry policy gave up on it
+    (RetryExhaustedError) or the model kept returning malformed output, since
+    the retry resumes from the checkpoint and costs only the extraction call.
+    A classification that failed that way, and other terminal errors (4xx),
+    are not retried; repeating the whole page would only spend the same time
+    again.
+
+    Returns:
+        tuple: (document, None) on success, (None, error) after the last failed attempt
+    """
+    checkpoint = {}
+    for attempt in range(1, retries + 2):
+        try:
+            return extract_page(checkpoint), None
+        except DeadlineExceededError:
+            raise
+        except Exception as e:
+            stage = "extraction" if "certificate_type" in checkpoint else "classification"
+            print(f"Page {page} failed at {stage} (attempt {attempt}/{retries + 1}): {e}")
+            error = page_error(page, stage, e, attempt)
+            # 判定済みなら抽出だけをやり直せるので、呼び出し単位で諦めたエラーも再試行する
+            resumable = stage == "extraction" and isinstance(e, (RetryExhaustedError, MalformedOutputError))
+            if not resumable and (isinstance(e, RetryExhaustedError) or classify_error(e) == TERMINAL):
+                break
+    return None, error
@@ -0,0 +1,210 @@
+import mimetypes
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import pypdf
+
+from page_isolation import page_error, run_page
+from progress import BatchProgress
+from result_store import JsonlResultStore, file_hash
+
+MAX_PDF_PAGES = 20
+
+
+def prepare_file(filepath: str, skip_hashes: frozenset = frozenset()) -> dict:
+    """
+    CPU-bound preparation, run in a worker process: hash the file and split PDFs into single-page files.
+    Files whose hash is in `skip_hashes` (already finished) are hashed but not split.
+    """
+    started_at = time.perf_counter()
+    prepared = {"filepath": filepath, "mime_type": mimetypes.guess_type(filepath)[0], "pages": [],
+                "content_hash": None, "temp_dir": None, "error": None, "skipped": False}
+    try:
+        prepared["content_hash"] = file_hash(filepath)
+        if prepared["content_hash"] in skip_hashes:
+            prepared["skipped"] = True
+        elif prepared["mime_type"] in ("image/jpeg", "image/png"):
+            prepared["pages"] = [(1, filepath)]
+        elif prepared["mime_type"] == "application/pdf":
+            with open(filepath, "rb") as file:
+                pdf_reader = pypdf.PdfReader(file)
+                num_pages = len(pdf_reader.pages)
+                if num_pages >= MAX_PDF_PAGES:
+                    raise ValueError(f"Too many pages ({num_pages}) in {filepath}. Please split the PDF into smaller files.")
+
+                prepared["temp_dir"] = tempfile.mkdtemp(prefix="ocr_pages_")
+                for page_num in range(num_pages):
+                    page = page_num + 1
+                    new_pdf_writer = pypdf.PdfWriter()
+                    new_pdf_writer.add_page(pdf_reader.pages[page_num])
+                    page_filepath = os.path.join(prepared["temp_dir"], f"page_{page}.pdf")
+                    with open(page_filepath, "wb") as page_file:
+                        new_pdf_writer.write(page_file)
+                    prepared["pages"].append((page, page_filepath))
+        else:
+            prepared["skipped"] = True
+    except Exception as e:
+        prepared["error"] = f"{e.__class__.__name__}: {e}"
+    prepared["busy"] = time.perf_counter() - started_at
+    return prepared
+
+
+class BatchPipeline:
+    """
+    Two-stage batch pipeline: a process pool prepares files (hashing, PDF splitting)
+    and a thread pool runs the I/O-bound model calls for each page.
+
+    Stages are connected by a bounded page queue, so preparation pauses when the
+    model-call workers fall behind (backpressure). Busy time is tracked per stage
+    so the pools can be sized from `report()`.
+
+    Args:
+        extract_page (Callable): (page_filepath, page, mime_type, checkpoint) -> document
+        store (JsonlResultStore): Result store; finished files and pages are skipped
+        version (str): Prompt version used in the result keys
+        processes (int): Worker processes for preparation
+        io_workers (int): Threads running model calls
+        queue_size (int): Maximum pages waiting for an I/O worker
+        on_file_done (Callable): Called with the filepath when a file is finished or skipped
+    """
+
+    def __init__(self, extract_page: Callable[[str, int, str, dict], dict], store: JsonlResultStore,
+                 version: str, processes: int = 4, io_workers: int = 16, queue_size: int = 64,
+                 on_file_done: Callable[[str], None] | None = None):
+        self.extract_page = extract_page
+        self.on_file_done = on_file_done
+        self.store = store
+        self.version = version
+        self.processes = processes
+        self.io_workers = io_workers
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.prepare_busy = 0.0
+        self.io_busy = 0.0
+        self.enqueue_blocked = 0.0  # 準備段がキュー満杯で待った時間
+        self.io_starved = 0.0  # I/O ワーカーがキュー空で待った時間
+        self.queue_samples = []
+        self.resume = True
+        self._files = {}  # key -> 残りページ数と結果
+        self._lock = threading.Lock()
+
+    def _enqueue(self, prepared: dict, progress: BatchProgress):
+        self.prepare_busy += prepared["busy"]
+        filepath = prepared["filepath"]
+        key = self.store.key(filepath, prepared["content_hash"] or "", self.version)
+
+        if prepared["error"]:
+            print(f"Error processing {filepath}: {prepared['error']}")
+            self.store.record_page(key, 0, error=page_error(0, "preparation", Exception(prepared["error"])))
+            self.store.record_file(key, 0, 1)
+            progress.advance()
+            self._file_done(filepath)
+            return
+        if prepared["skipped"] or (self.resume and self.store.is_file_done(key)):
+            progress.skip()
+            self._cleanup(prepared)
+            self._file_done(filepath)
+            return
+
+        done_pages = self.store.done_pages(key) if self.resume else set()
+        pages = [(page, path) for page, path in prepared["pages"] if page not in done_pages]
+        if not pages:
+            self.store.record_file(key, len(done_pages), 0)
+            progress.advance()
+            self._cleanup(prepared)
+            self._file_done(filepath)
+            return
+
+        with self._lock:
+            self._files[key] = {"remaining": len(pages), "done": len(done_pages), "pages": 0, "errors": 0,
+                                "prepared": prepared}
+        for page, path in pages:
+            blocked_at = time.perf_counter()
+            self.pages.put((key, page, path, prepared["mime_type"]))
+            self.enqueue_blocked += time.perf_counter() - blocked_at
+            self.queue_samples.append(self.pages.qsize())
+
+    def _file_done(self, filepath: str):
+        if self.on_file_done is not None:
+            self.on_file_done(filepath)
+
+    def _cleanup(self, prepared: dict):
+        if prepared.get("temp_dir"):
+            shutil.rmtree(prepared["temp_dir"], ignore_errors=True)
+
+    def _io_worker(self, progress: BatchProgress):
+        while True:
+            waited_at = time.perf_counter()
+            task = self.pages.get()
+            started_at = time.perf_counter()
+            with self._lock:
+                self.io_starved += started_at - waited_at
+            if task is None:
+                return
+            key, page, path, mime_type = task
+            document, error = run_page(
+                lambda checkpoint: self.extract_page(path, page, mime_type, checkpoint), page
+            )
+            self.store.record_page(key, page, document, error)
+            with self._lock:
+                self.io_busy += time.perf_counter() - started_at
+                state = self._files[key]
+                state["remaining"] -= 1
+                state["pages"] += 1
+                state["errors"] += 1 if error else 0
+                finished = state["remaining"] == 0
+                if finished:
+                    del self._files[key]
+            if finished:
+                self.store.record_file(key, state["done"] + state["pages"], state["errors"])
+                self._cleanup(state["prepared"])
+                self._file_done(state["prepared"]["filepath"])
+                progress.advance(state["pages"])
+                print(progress.summary())
+
+    def run(self, filepaths: list[str], resume: bool = True) -> dict:
+        self.resume = resume
+        progress = BatchProgress(len(filepaths))
+        finished_hashes = {}
+        if resume:
+            for path, content_hash, version in self.store.finished_files:
+                if version == self.version:
+                    finished_hashes.setdefault(path, set()).add(content_hash)
+        started_at = time.perf_counter()
+        workers = [threading.Thread(target=self._io_worker, args=(progress,), daemon=True)
+                   for _ in range(self.io_workers)]
+        for worker in workers:
+            worker.start()
+
+        # 準備済みファイルを先読みしすぎないよう、投入中のファイル数をプロセス数の2倍までに抑える
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            in_flight = deque()
+            for filepath in filepaths:
+                skip_hashes = frozenset(finished_hashes.get(os.path.abspath(filepath), ()))
+                in_flight.append(pool.submit(prepare_file, filepath, skip_hashes))
+                while len(in_flight) >= self.processes * 2:
+                    self._enqueue(in_flight.popleft().result(), progress)
+            while in_flight:
+                self._enqueue(in_flight.popleft().result(), progress)
+
+        for _ in workers:
+            self.pages.put(None)
+        for worker in workers:
+            worker.join()
+        return self.report(time.perf_counter() - started_at)
+
+    def report(self, wall: float) -> dict:
+        return {
+            "wall_seconds": wall,
+            "prepare_utilization": self.prepare_busy / (wall * self.processes) if wall else 0.0,
+            "io_utilization": self.io_busy / (wall * self.io_workers) if wall else 0.0,
+            "prepare_blocked_seconds": self.enqueue_blocked,
+            "io_starved_seconds": self.io_starved,
+            "mean_queue_depth": sum(self.queue_samples) / len(self.queue_samples) if self.queue_samples else 0.0,
+        }
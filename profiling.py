@@ -0,0 +1,240 @@
+import cProfile
+import functools
+import hmac
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+from response_format import FULL, dumps
+
+try:
+    import resource
+except ImportError:
+    resource = None  # optional dependency; not available on Windows
+
+# リクエストを抽出してプロファイルする割合 (0 = しない)。結果はログにのみ出力する
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# X-Profile ヘッダーにこの値を付けたリクエストはプロファイルし、結果をレスポンスにも含める (空なら無効)
+PROFILE_ADMIN_KEY = os.environ.get("PROFILE_ADMIN_KEY", "")
+# レポートに含める関数・割り当て箇所の数
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "15"))
+# 割り当て箇所として記録するスタックの深さ
+PROFILE_TRACEBACK_FRAMES = int(os.environ.get("PROFILE_TRACEBACK_FRAMES", "1"))
+
+# 自己時間を集計する分類 (ファイル名・関数名に含まれる文字列)
+CATEGORIES = {
+    "pdf": ("pypdf",),
+    "base64": ("base64", "binascii"),
+    "json": ("json", "orjson"),
+    "network": ("_ssl", "socket", "httpx", "httpcore", "h11", "urllib3", "ssl.py"),
+    "wait": ("acquire' of '_thread", "time.sleep", "threading.py"),
+}
+
+_session = None  # プロファイル中のリクエスト (同時に1つだけ)
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def profiled(function: Callable) -> Callable:
+    """Profile `function` in whatever thread runs it while a request is being profiled; a plain call otherwise."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        session = _session
+        if session is None or getattr(_local, "profiling", False):
+            return function(*args, **kwargs)
+        return session.call(function, *args, **kwargs)
+    return wrapper
+
+
+def _category(filename: str, name: str) -> str:
+    location = f"{filename}:{name}"
+    for category, markers in CATEGORIES.items():
+        if any(marker in location for marker in markers):
+            return category
+    return "other"
+
+
+def _short_path(filename: str) -> str:
+    # パッケージが分かるように親ディレクトリまで残す (pypdf/_reader.py など)
+    return os.path.join(*os.path.normpath(filename).split(os.sep)[-2:])
+
+
+def _function_name(filename: str, line: int, name: str) -> str:
+    return name if filename == "~" else f"{_short_path(filename)}:{line}({name})"
+
+
+class ProfileSession:
+    """
+    cProfile and tracemalloc data of one request, gathered from every thread that works on it.
+
+    Each profiled call runs under its own cProfile.Profile (cProfile only sees
+    the thread that enabled it) and is merged here when it returns. Memory is
+    traced process-wide; the live allocations are snapshotted whenever a
+    profiled call ends with more traced memory than any earlier one.
+    """
+
+    def __init__(self, top: int):
+        self.top = top
+        self.started_at = time.perf_counter()
+        self.stats = None
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self._lock = threading.Lock()
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        profile = cProfile.Profile()
+        _local.profiling = True
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            _local.profiling = False
+            self._merge(profile)
+
+    def _merge(self, profile: cProfile.Profile):
+        current, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot() if current > self.snapshot_bytes else None
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            if snapshot is not None and current > self.snapshot_bytes:
+                self.snapshot, self.snapshot_bytes = snapshot, current
+
+    def report(self, peak_bytes: int) -> dict:
+        entries = self.stats.stats if self.stats is not None else {}
+        hotspots = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+        categories = {}
+        for (filename, _, name), (_, _, self_seconds, _, _) in entries.items():
+            category = _category(filename, name)
+            categories[category] = categories.get(category, 0.0) + self_seconds
+
+        allocations = []
+        if self.snapshot is not None:
+            snapshot = self.snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            for statistic in snapshot.statistics("traceback" if PROFILE_TRACEBACK_FRAMES > 1 else "lineno")[:self.top]:
+                frame = statistic.traceback[0]
+                allocations.append({
+                    "location": f"{_short_path(frame.filename)}:{frame.lineno}",
+                    "bytes": statistic.size,
+                    "count": statistic.count,
+                })
+
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started_at, 3),
+            # スレッドごとの自己時間の合計 (並列に動いたスレッドの分だけ wall_seconds を超える)
+            "self_seconds_by_category": {key: round(value, 3) for key, value in
+                                         sorted(categories.items(), key=lambda item: item[1], reverse=True)},
+            "hotspots": [
+                {
+                    "function": _function_name(filename, line, name),
+                    "calls": calls,
+                    "self_seconds": round(self_seconds, 4),
+                    "cumulative_seconds": round(cumulative_seconds, 4),
+                }
+                for (filename, line, name), (_, calls, self_seconds, cumulative_seconds, _) in hotspots
+            ],
+            "peak_traced_bytes": peak_bytes,
+            "largest_live_bytes": self.snapshot_bytes,
+            "largest_live_allocations": allocations,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None,
+        }
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request profiling with cProfile and tracemalloc.
+
+    A request is profiled when it carries `X-Profile: <admin key>` (the report
+    is then also returned in the response body as "Profile") or when it is
+    drawn by `sample_rate` (the report is only logged). Only one request is
+    profiled at a time; others run unprofiled meanwhile. Functions decorated
+    with `profiled` are profiled in the threads that run them, so with
+    concurrent requests in one process (server.py) their calls may be
+    included as well. Without a profiled request the only cost is one global
+    lookup per decorated call.
+
+    Args:
+        sample_rate (float): Share of requests profiled for the logs
+        admin_key (str): Value of the X-Profile header that enables profiling ("" = header ignored)
+        top (int): Functions and allocation sites in the report
+        rng (random.Random): Random source for the sampling
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, admin_key: str = PROFILE_ADMIN_KEY,
+                 top: int = PROFILE_TOP, rng: Optional[random.Random] = None):
+        self.sample_rate = sample_rate
+        self.admin_key = admin_key
+        self.top = top
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        return cls()
+
+    def mode(self, event: dict) -> Optional[str]:
+        """"header" (report returned and logged), "sampled" (logged only) or None (not profiled)."""
+        if not self.admin_key and not self.sample_rate:
+            return None
+        headers = event.get("headers") or {}
+        requested = headers.get("X-Profile") or headers.get("x-profile")
+        if self.admin_key and requested and hmac.compare_digest(requested, self.admin_key):
+            return "header"
+        if self.sample_rate and self.rng.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def run(self, handler: Callable[[], dict], mode: str, response_format: str = FULL) -> dict:
+        """
+        Run `handler()` as a profiled request and log (and for "header", attach) the report.
+
+        Args:
+            handler: Handles the request and returns the response
+            mode: "header" or "sampled" (see `mode`)
+            response_format: Format the response body was serialized in; kept when the report is attached
+        """
+        global _session
+        with _session_lock:
+            if _session is not None:
+                print("Profiling skipped, another request is being profiled")
+                return handler()
+            session = _session = ProfileSession(self.top)
+
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        try:
+            response = session.call(handler)
+        finally:
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+            with _session_lock:
+                _session = None
+
+        report = session.report(peak_bytes)
+        print(f"Request profile ({mode}): {json.dumps(report)}")
+        if mode == "header":
+            try:
+                body = json.loads(response.get("body") or "{}")
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                body["Profile"] = report
+                response = {**response, "body": dumps(body, response_format)}
+        return response
+
+
+request_profiler = RequestProfiler.from_env()
@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class BatchProgress:
+    """
+    Progress and ETA for a batch run, based on the throughput observed so far.
+    Skipped (already finished) files are counted separately so they do not inflate the rate.
+
+    Args:
+        total (int): Number of files in the run (0 when unknown, e.g. watch mode)
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.skipped = 0
+        self.pages = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def advance(self, pages: int = 0):
+        with self._lock:
+            self.done += 1
+            self.pages += pages
+
+    def summary(self) -> str:
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            finished = self.done + self.skipped
+            remaining = self.total - finished
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = format_duration(remaining / rate) if rate > 0 and remaining > 0 else "--"
+            position = f"[{finished}/{self.total}] {finished / self.total:.1%}" if self.total else f"[{finished}]"
+            return (
+                f"{position} | skipped {self.skipped} | "
+                f"{rate * 60:.1f} files/min, {self.pages / elapsed * 60 if elapsed > 0 else 0:.1f} pages/min | "
+                f"elapsed {format_duration(elapsed)} | ETA {eta}"
+            )
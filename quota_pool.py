@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Optional
+
+from google.oauth2 import service_account
+
+from retry_policy import THROTTLED, UNAVAILABLE, classify_error, retry_after_hint
+
+# クォータを合算するプロジェクトと認証情報の組 ("プロジェクト=サービスアカウントのキー,..."。キーを省略すると既定の認証情報)
+VERTEX_AI_PROJECTS = os.environ.get("VERTEX_AI_PROJECTS", "")
+# スロット (プロジェクト x リージョン) ごとの同時呼び出し数の初期値。429 で半減し、成功で少しずつ戻る
+POOL_SLOT_CONCURRENCY = float(os.environ.get("POOL_SLOT_CONCURRENCY", "8"))
+# 429/5xx を返したスロットを使わない時間 (連続するたびに倍、上限 POOL_MAX_COOLDOWN)
+POOL_COOLDOWN = float(os.environ.get("POOL_COOLDOWN", "1.0"))
+POOL_MAX_COOLDOWN = float(os.environ.get("POOL_MAX_COOLDOWN", "30"))
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+
+def parse_projects(value: str, default_project: Optional[str]) -> list[tuple[str, Optional[str]]]:
+    """Parse VERTEX_AI_PROJECTS into (project, credentials file or None); falls back to the single default project."""
+    projects = []
+    for entry in value.split(","):
+        project, _, credentials = entry.strip().partition("=")
+        if project:
+            projects.append((project.strip(), credentials.strip() or None))
+    return projects or [(default_project, None)]
+
+
+class Slot:
+    """One project x region pair with its own client, health and learned concurrency."""
+
+    def __init__(self, index: int, project: str, credentials: Optional[str], region: str, rank: int, capacity: float):
+        self.index = index
+        self.project = project
+        self.credentials = credentials
+        self.region = region
+        self.rank = rank  # リージョンの優先順位 (0 = 最優先)
+        self.capacity = capacity
+        self.in_flight = 0
+        self.failures = 0  # 連続した 429/5xx の回数
+        self.cooldown_until = 0.0
+        self.stats = Counter()
+
+    @property
+    def name(self) -> str:
+        return f"{self.project}/{self.region}"
+
+
+class SlotRouter:
+    """
+    Spread model calls over every project x region slot.
+
+    Each call takes the best slot that is not cooling down: preferred regions
+    first, and within a region the project with the fewest calls in flight
+    (then the fewest calls so far), until the slots of that region are at their learned concurrency; then the
+    next region. A 429 or 5xx puts the slot into a cool-down (the server's
+    retry hint, or POOL_COOLDOWN doubled per consecutive failure) and halves
+    its concurrency; successes while busy raise it again by about one per
+    round. When every slot is cooling down, the one that recovers first is used.
+
+    Args:
+        projects: [(project, service account key file or None), ...]
+        regions: Regions in order of preference
+        client_factory: (project, region, credentials or None) -> genai client
+        capacity (float): Initial concurrency per slot
+        cooldown (float): First cool-down in seconds
+        max_cooldown (float): Longest cool-down in seconds
+        clock (Callable): Monotonic clock (injected by simulations)
+    """
+
+    def __init__(self, projects: list[tuple[str, Optional[str]]], regions: list[str],
+                 client_factory: Callable[[str, str, Any], Any], capacity: float = POOL_SLOT_CONCURRENCY,
+                 cooldown: float = POOL_COOLDOWN, max_cooldown: float = POOL_MAX_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        # リージョンの優先順、同じリージョンではプロジェクトの順に並べる
+        pairs = [(rank, region, project, credentials)
+                 for rank, region in enumerate(regions) for project, credentials in projects]
+        self.slots = [Slot(index, project, credentials, region, rank, capacity)
+                      for index, (rank, region, project, credentials) in enumerate(pairs)]
+        self.client_factory = client_factory
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.initial_capacity = capacity
+        self.max_capacity = capacity * 4
+        self._clients = {}
+        self._credentials = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, default_project: Optional[str], regions: list[str],
+                 client_factory: Callable[[str, str, Any], Any]) -> "SlotRouter":
+        return cls(parse_projects(VERTEX_AI_PROJECTS, default_project), regions, client_factory)
+
+    def client(self, slot: Slot):
+        """The slot's client, built on first use (service account keys are loaded once per file)."""
+        with self._lock:
+            if slot.index in self._clients:
+                return self._clients[slot.index]
+            credentials = self._credentials.get(slot.credentials)
+        # クライアントの作成はロックの外で行う (他のスロットの選択を待たせない)
+        if slot.credentials and credentials is None:
+            credentials = service_account.Credentials.from_service_account_file(slot.credentials, scopes=SCOPES)
+        client = self.client_factory(slot.project, slot.region, credentials)
+        with self._lock:
+            if slot.credentials:
+                self._credentials.setdefault(slot.credentials, credentials)
+            return self._clients.setdefault(slot.index, client)
+
+    def reset(self):
+        """Drop the cached clients and the health of every slot (e.g. after the client factory changed)."""
+        with self._lock:
+            self._clients.clear()
+            for slot in self.slots:
+                slot.capacity = self.initial_capacity
+                slot.failures = 0
+                slot.cooldown_until = 0.0
+                slot.stats.clear()
+
+    def acquire(self) -> Slot:
+        with self._lock:
+            now = self.clock()
+            ready = [slot for slot in self.slots if slot.cooldown_until <= now]
+            if ready:
+                # 優先リージョンのスロットから、学習した同時実行数に空きのあるものを選ぶ
+                # 同じ条件ならこれまでの呼び出しが少ないプロジェクトへ (分単位のクォータも均等に使う)
+                slot = min(ready, key=lambda s: (
+                    int(s.in_flight // max(1.0, s.capacity)), s.rank, s.in_flight, s.stats["calls"], s.index
+                ))
+            else:
+                slot = min(self.slots, key=lambda s: s.cooldown_until)
+            slot.in_flight += 1
+            slot.stats["calls"] += 1
+            return slot
+
+    def release(self, slot: Slot, error: Optional[Exception] = None):
+        with self._lock:
+            slot.in_flight -= 1
+            kind = classify_error(error) if error is not None else None
+            if kind in (THROTTLED, UNAVAILABLE):
+                slot.stats[kind] += 1
+                slot.failures += 1
+                hint = retry_after_hint(error)
+                cooldown = hint if hint is not None else self.cooldown * 2 ** min(slot.failures - 1, 10)
+                slot.cooldown_until = max(slot.cooldown_until, self.clock() + min(cooldown, self.max_cooldown))
+                if kind == THROTTLED:
+                    slot.capacity = max(1.0, slot.capacity / 2)
+            elif error is None:
+                slot.failures = 0
+                if slot.in_flight + 1 >= slot.capacity:
+                    slot.capacity = min(self.max_capacity, slot.capacity + 1 / slot.capacity)
+
+    def run(self, call: Callable[[Any], Any]) -> Any:
+        """Run `call(client)` on the best available slot and record the outcome for that slot."""
+        slot = self.acquire()
+        try:
+            result = call(self.client(slot))
+        except Exception as e:
+            self.release(slot, e)
+            raise
+        self.release(slot)
+        return result
+
+    def summary(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            return {
+                slot.name: {
+                    "calls": slot.stats["calls"],
+                    "throttled": slot.stats[THROTTLED],
+                    "unavailable": slot.stats[UNAVAILABLE],
+                    "in_flight": slot.in_flight,
+                    "capacity": round(slot.capacity, 2),
+                    "cooling_seconds": round(max(0.0, slot.cooldown_until - now), 2),
+                }
+                for slot in self.slots
+                if slot.stats["calls"] or slot.in_flight
+            }
@@ -0,0 +1,56 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional dependency; fall back to the standard json module
+    orjson = None
+
+FULL = "full"
+COMPACT = "compact"
+RESPONSE_FORMAT_HEADER = "x-response-format"
+PLACEHOLDER_POSITION_KEYS = ("X", "Y", "Width", "Height")
+
+
+def requested_format(event: dict) -> str:
+    """
+    Response format requested by the client, from the `X-Response-Format` header
+    or the `format` query parameter. Anything other than "compact" is the full format.
+    """
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+    query = event.get("queryStringParameters") or {}
+    value = headers.get(RESPONSE_FORMAT_HEADER) or query.get("format") or FULL
+    return COMPACT if str(value).strip().lower() == COMPACT else FULL
+
+
+def _is_placeholder_position(value) -> bool:
+    return isinstance(value, dict) and all(value.get(key) == 0 for key in PLACEHOLDER_POSITION_KEYS)
+
+
+def compact(value):
+    """Drop placeholder positions (all coordinates zero) and empty lists, recursively."""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key == "Position" and _is_placeholder_position(item):
+                continue
+            item = compact(item)
+            if isinstance(item, list) and not item:
+                continue
+            result[key] = item
+        return result
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
+
+
+def dumps(body: dict, response_format: str = FULL) -> str:
+    """
+    Serialize a response body. The full format keeps the existing `json.dumps` output
+    byte for byte; the compact format is minified and uses orjson when it is installed.
+    """
+    if response_format != COMPACT:
+        return json.dumps(body, ensure_ascii=False)
+    body = compact(body)
+    if orjson is not None:
+        return orjson.dumps(body).decode("utf-8")
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
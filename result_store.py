@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+PROMPT_FILES = [
+    "prompt_certificate_type.txt",
+    "prompt_life_insurance.txt",
+    "prompt_earthquake_insurance.txt",
+    "prompt_social_insurance.txt",
+    "prompt_small_mutual_aid.txt",
+]
+
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_version(prompt_files: list[str] = PROMPT_FILES, extra: str = "") -> str:
+    """
+    Short hash of every prompt file and `extra` (e.g. the model routing configuration);
+    results from other prompt versions are not reused.
+    """
+    digest = hashlib.sha256()
+    for prompt_file in prompt_files:
+        with open(prompt_file, "rb") as f:
+            digest.update(f.read())
+    digest.update(extra.encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class JsonlResultStore:
+    """
+    Append-only JSONL store for batch results, one record per page and one per finished file.
+
+    Records are keyed by (path, content hash, prompt version), so a changed file
+    or prompt is processed again. Each record is flushed and fsynced as soon as
+    it is written; a record truncated by a crash is ignored when loading.
+
+    Args:
+        path (str): Output JSONL file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.finished_pages: dict[tuple, set[int]] = {}
+        self.finished_files: set[tuple] = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(path: str, content_hash: str, version: str) -> tuple:
+        return (os.path.abspath(path), content_hash, version)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                key = (record.get("path"), record.get("content_hash"), record.get("prompt_version"))
+                if record.get("type") == "page" and record.get("document") is not None:
+                    self.finished_pages.setdefault(key, set()).add(record.get("page"))
+                elif record.get("type") == "file" and not record.get("errors"):
+                    self.finished_files.add(key)
+
+    def _append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def is_file_done(self, key: tuple) -> bool:
+        return key in self.finished_files
+
+    def done_pages(self, key: tuple) -> set[int]:
+        return set(self.finished_pages.get(key, set()))
+
+    def record_page(self, key: tuple, page: int, document: Optional[dict] = None, error: Optional[dict] = None):
+        path, content_hash, version = key
+        self._append({
+            "type": "page",
+            "path": path,
+            "content_hash": content_hash,
+            "prompt_version": version,
+            "page": page,
+            "document": document,
+            "error": error,
+            "finished_at": time.time(),
+        })
+        if document is not None:
+            with self._lock:
+                self.finished_pages.setdefault(key, set()).add(page)
+
+    def record_file(self, key: tuple, pages: int, errors: int):
+        path, content_hash, version = key
+        self._append({
+            "type": "file",
+            "path": path,
+            "content_hash": content_hash,
+            "prompt_version": version,
+            "pages": pages,
+            "errors": errors,
+            "finished_at": time.time(),
+        })
+        if not errors:
+            with self._lock:
+                self.finished_files.add(key)
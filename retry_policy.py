@@ -0,0 +1,188 @@
+import email.utils
+import os
+import random
+import time
+from typing import Any, Callable, Optional
+
+import httpx
+from google.genai import errors
+
+from deadline import DEADLINE_CALL_RESERVE, Deadline, DeadlineExceededError
+
+# エラーの分類
+THROTTLED = "throttled"  # 429: リージョンのクォータ枯渇
+UNAVAILABLE = "unavailable"  # 5xx: サービス側の一時的な障害
+TRANSIENT = "transient"  # タイムアウト・接続エラー
+TERMINAL = "terminal"  # リトライしても結果が変わらないエラー
+
+RETRYABLE_SERVER_CODES = {500, 502, 503, 504}
+RETRYABLE_CLIENT_CODES = {408}
+
+# SDK が空の候補を受け取った場合に送出するメッセージ (型付きエラーではないため個別に判定)
+EMPTY_CANDIDATE_MESSAGES = ("Candidates token count is None",)
+
+
+class RetryExhaustedError(Exception):
+    """Raised when the retry policy gives up on a call."""
+
+    def __init__(self, message: str = "All retries exhausted", last_error: Optional[Exception] = None):
+        super().__init__(message if last_error is None else f"{message}: {last_error}")
+        self.last_error = last_error
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, errors.APIError):
+        if error.code == 429:
+            return THROTTLED
+        if error.code in RETRYABLE_SERVER_CODES:
+            return UNAVAILABLE
+        if error.code in RETRYABLE_CLIENT_CODES:
+            return TRANSIENT
+        return TERMINAL
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if any(message in str(error) for message in EMPTY_CANDIDATE_MESSAGES):
+        return UNAVAILABLE
+    return TERMINAL
+
+
+def _parse_duration(value: Any) -> Optional[float]:
+    """Parse `Retry-After` (seconds or HTTP-date) or a protobuf duration such as "2.5s"."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value.rstrip("s")))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def retry_after_hint(error: Exception) -> Optional[float]:
+    """Return the server's retry hint in seconds, if the error carries one."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        hint = _parse_duration(headers.get("Retry-After") or headers.get("retry-after"))
+        if hint is not None:
+            return hint
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        container = details.get("error", details)
+        for detail in (container.get("details") if isinstance(container, dict) else None) or []:
+            if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("RetryInfo"):
+                return _parse_duration(detail.get("retryDelay"))
+    return None
+
+
+class RetryPolicy:
+    """
+    Retry policy for model calls with multi-region failover.
+
+    Throttled and unavailable errors fail over to the next region right away.
+    Once every region has failed in a sweep, the policy waits for the server's
+    retry hint (or a decorrelated-jitter backoff without one), then sweeps again.
+    Terminal errors are raised immediately, and the whole call is bounded by
+    `total_budget` seconds and by the request deadline, if one is given.
+
+    Args:
+        base_delay (float): Minimum backoff between sweeps in seconds
+        max_delay (float): Maximum backoff between sweeps in seconds
+        total_budget (float): Maximum seconds spent on one call, including retries
+        max_sweeps (int): Maximum number of sweeps over all regions
+        sleep (Callable): Sleep function (injected by simulations)
+        clock (Callable): Monotonic clock (injected by simulations)
+        rng (random.Random): Random source for the jitter
+    """
+
+    def __init__(self, base_delay: float = 0.5, max_delay: float = 16.0, total_budget: float = 120.0,
+                 max_sweeps: int = 4, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic, rng: Optional[random.Random] = None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.total_budget = total_budget
+        self.max_sweeps = max_sweeps
+        self.sleep = sleep
+        self.clock = clock
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            base_delay=float(os.environ.get("RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.environ.get("RETRY_MAX_DELAY", "16")),
+            total_budget=float(os.environ.get("RETRY_TOTAL_BUDGET", "120")),
+            max_sweeps=int(os.environ.get("RETRY_MAX_SWEEPS", "4")),
+        )
+
+    def classify(self, error: Exception) -> str:
+        return classify_error(error)
+
+    def backoff(self, previous_delay: float) -> float:
+        """Decorrelated jitter: uniform(base, previous * 3), capped at max_delay."""
+        return min(self.max_delay, self.rng.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
+
+    def execute(self, call: Callable[[Optional[float]], Any], regions: int, failover: Callable[[], None],
+                recovered: Optional[Callable[[], None]] = None, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Run `call` until it succeeds, fails terminally or the budget runs out.
+
+        Args:
+            call: The model call; receives the per-attempt timeout in seconds (None = no limit)
+            regions: Number of regions available for failover
+            failover: Switches the client to the next region
+            recovered: Called after a success that needed a failover
+            deadline: Request deadline; no attempt or backoff is started past it
+        """
+        started_at = self.clock()
+        delay = self.base_delay
+        failed_over = False
+        last_error = None
+
+        for sweep in range(self.max_sweeps):
+            hints = []
+            for _ in range(max(1, regions)):
+                timeout = None
+                if deadline is not None:
+                    deadline.check(DEADLINE_CALL_RESERVE)
+                    timeout = deadline.remaining() if deadline.expires_at is not None else None
+                try:
+                    result = call(timeout)
+                except Exception as e:
+                    kind = self.classify(e)
+                    if kind == TERMINAL:
+                        raise
+                    last_error = e
+                    hint = retry_after_hint(e)
+                    if hint is not None:
+                        hints.append(hint)
+                    if kind == TRANSIENT:
+                        # 同じリージョンで再試行する
+                        break
+                    print(f"Model call {kind} ({e.__class__.__name__}), switching region")
+                    failover()
+                    failed_over = True
+                    continue
+
+                if failed_over and recovered is not None:
+                    recovered()
+                return result
+
+            if sweep == self.max_sweeps - 1:
+                break
+            delay = self.backoff(delay)
+            # サーバーの待機指示がある場合は最も早く回復するリージョンに合わせる
+            wait = max(min(hints), self.base_delay) if hints else delay
+            if deadline is not None and not deadline.allows(wait + DEADLINE_CALL_RESERVE):
+                raise DeadlineExceededError(f"Deadline exceeded while retrying: {last_error}") from last_error
+            remaining = self.total_budget - (self.clock() - started_at)
+            if wait >= remaining:
+                raise RetryExhaustedError("Retry budget exhausted", last_error)
+            print(f"All regions exhausted, retry {sweep + 1}/{self.max_sweeps - 1} after {wait:.1f}s")
+            self.sleep(wait)
+
+        raise RetryExhaustedError("All retries exhausted", last_error)
@@ -0,0 +1,135 @@
+import heapq
+import mimetypes
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable
+
+import pypdf
+
+# バッチ実行でファイルを処理する順序
+#   fifo: ファイル名順 (従来の動作)
+#   sjf:  見込みコスト (ページ数、バイト数) の小さい順
+#   fair: フォルダ (顧客) ごとに処理済みのページ数が最も少ないフォルダから、その中で最小のファイルを選ぶ
+BATCH_SCHEDULE = os.environ.get("BATCH_SCHEDULE", "fair")
+POLICIES = ("fifo", "sjf", "fair")
+
+
+def file_cost(filepath: str) -> tuple[int, int]:
+    """Estimated cost of a file as (pages, bytes); pages are counted without splitting the PDF."""
+    try:
+        size = os.path.getsize(filepath)
+    except OSError:
+        return 1, 0
+    if mimetypes.guess_type(filepath)[0] != "application/pdf":
+        return 1, size
+    try:
+        with open(filepath, "rb") as f:
+            return max(1, len(pypdf.PdfReader(f, strict=False).pages)), size
+    except Exception:
+        return 1, size  # 読めない PDF は処理時にエラーとして記録される
+
+
+def tenant_of(filepath: str) -> str:
+    """Fair-share group of a file: its folder (one folder per customer in mixed runs)."""
+    return os.path.dirname(os.path.abspath(filepath))
+
+
+def order_files(filepaths: list[str], policy: str, costs: dict[str, tuple[int, int]],
+                tenant: Callable[[str], str] = tenant_of) -> list[str]:
+    """
+    Order the files of a batch run.
+
+    Args:
+        filepaths: Files in name order
+        policy: "fifo", "sjf" or "fair"
+        costs: filepath -> (pages, bytes) from file_cost
+        tenant: filepath -> fair-share group
+    """
+    if policy == "fifo":
+        return list(filepaths)
+    if policy == "sjf":
+        return sorted(filepaths, key=lambda path: costs[path])
+    if policy != "fair":
+        raise ValueError(f"Unknown schedule policy: {policy}")
+
+    queues = defaultdict(list)
+    for path in sorted(filepaths, key=lambda path: costs[path], reverse=True):
+        queues[tenant(path)].append(path)  # 末尾が最小のファイル
+    # 割り当て済みのページ数が最も少ないグループから順に取り出す
+    served = [(0, group) for group in sorted(queues)]
+    ordered = []
+    while served:
+        pages, group = heapq.heappop(served)
+        path = queues[group].pop()
+        ordered.append(path)
+        if queues[group]:
+            heapq.heappush(served, (pages + costs[path][0], group))
+    return ordered
+
+
+def simulate_completion(order: list[str], costs: dict[str, tuple[int, int]], workers: int = 1) -> dict[str, float]:
+    """Completion time of each file, in page units, when pages are run in `order` on `workers` parallel slots."""
+    slots = [0.0] * max(1, workers)
+    completion = {}
+    for path in order:
+        finished_at = 0.0
+        for _ in range(costs[path][0]):
+            started_at = heapq.heappop(slots)
+            finished_at = max(finished_at, started_at + 1)
+            heapq.heappush(slots, started_at + 1)
+        completion[path] = finished_at
+    return completion
+
+
+def _mean(values) -> float:
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
+
+
+class CompletionTracker:
+    """
+    Record when each file of a batch run finishes and compare the schedule with FIFO.
+
+    Measured completion times come from the run itself. Completion times for the
+    other policies are estimated by replaying the page counts on the same number
+    of workers, scaled by the measured seconds per page.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.completed = {}
+        self._lock = threading.Lock()
+
+    def done(self, filepath: str):
+        with self._lock:
+            self.completed.setdefault(filepath, time.perf_counter() - self.started_at)
+
+    def report(self, policy: str, filepaths: list[str], costs: dict[str, tuple[int, int]], workers: int = 1,
+               tenant: Callable[[str], str] = tenant_of) -> dict:
+        with self._lock:
+            completed = dict(self.completed)
+        if not completed:
+            return {"policy": policy, "files": 0}
+
+        by_group = defaultdict(list)
+        for path, seconds in completed.items():
+            by_group[tenant(path)].append(seconds)
+        ranked = sorted(completed.values())
+        pages = sum(costs[path][0] for path in filepaths)
+        seconds_per_page = ranked[-1] * max(1, workers) / pages if pages else 0.0
+
+        estimated = {}
+        for candidate in POLICIES:
+            simulated = simulate_completion(order_files(sorted(filepaths), candidate, costs, tenant), costs, workers)
+            estimated[candidate] = _mean(simulated.values()) * seconds_per_page
+        return {
+            "policy": policy,
+            "files": len(completed),
+            "mean_completion_seconds": _mean(ranked),
+            "p95_completion_seconds": ranked[min(len(ranked) - 1, int(len(ranked) * 0.95))],
+            "folder_mean_completion_seconds": {group: _mean(values) for group, values in sorted(by_group.items())},
+            "estimated_mean_completion_seconds": estimated,
+            "estimated_speedup_vs_fifo": estimated["fifo"] / estimated[policy] if estimated[policy] else 1.0,
+        }
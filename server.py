@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Self-hosted HTTP server for the extraction pipeline (runs outside Lambda).
+Exposes the same contract as lambda_handler (Bearer auth, the Documents response
+and the same status codes) on an asyncio server. Requests run on a bounded
+worker pool that shares the process's long-lived genai client.
+
+Endpoints:
+    POST /          extraction (same request and response as the function URL)
+    GET  /healthz   200 while serving, 503 on open connections while draining
+    GET  /metrics   Prometheus text format
+
+Usage:
+    python server.py [--port 8080] [--workers 8] [--request-timeout 0] [--fake]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import admission, rejection
+from concurrency_limit import call_limiter
+from local_lambda_server import LocalContext, to_lambda_event
+from warmup import is_warmup_event
+
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "8"))
+# 0 はタイムアウトなし (Lambda の 300 秒制限を受けない)
+SERVER_REQUEST_TIMEOUT = float(os.environ.get("SERVER_REQUEST_TIMEOUT", "0"))
+SERVER_SHUTDOWN_GRACE = float(os.environ.get("SERVER_SHUTDOWN_GRACE", "300"))
+SERVER_MAX_BODY_BYTES = int(os.environ.get("SERVER_MAX_BODY_BYTES", str(50 * 1024 * 1024)))
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300]
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+           503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class ExtractionServer:
+    """
+    asyncio HTTP/1.1 server that runs `handler(event, context)` on a thread pool.
+
+    At most `workers` requests run at once; further requests wait for a free
+    worker (queue wait is reported in /metrics). Authentication and admission
+    control run on the event loop before a request waits: a request without a
+    valid token gets a 403 and, while the model backend is saturated, an
+    authenticated one gets a 429 with Retry-After, both without waiting. On
+    SIGTERM/SIGINT the listener is closed, /healthz answers 503 on connections
+    that are still open, and in-flight requests get `shutdown_grace` seconds to
+    finish.
+
+    Args:
+        handler (Callable): lambda_handler-compatible function
+        workers (int): Concurrent extractions
+        request_timeout (float): Time budget passed to the handler as the Lambda context (0 = unbounded)
+        shutdown_grace (float): Seconds to wait for in-flight requests on shutdown
+        slot_summary (Callable): Per project x region slot counters for /metrics (SlotRouter.summary)
+        authorize (Callable): event -> 403 response or None (lambda_function.authorization_error)
+    """
+
+    def __init__(self, handler, workers: int = SERVER_WORKERS, request_timeout: float = SERVER_REQUEST_TIMEOUT,
+                 shutdown_grace: float = SERVER_SHUTDOWN_GRACE, slot_summary=dict, authorize=lambda event: None):
+        self.handler = handler
+        self.authorize = authorize
+        self.slot_summary = slot_summary
+        self.workers = workers
+        self.request_timeout = request_timeout
+        self.shutdown_grace = shutdown_grace
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extraction")
+        self.draining = False
+        self.started_at = time.time()
+        self.in_flight = 0
+        self.waiting = 0
+        self.status_counts = Counter()
+        self.latency_counts = Counter()
+        self.latency_sum = 0.0
+        self.queue_wait_sum = 0.0
+        self._semaphore = None
+        self._idle = None
+        self._server = None
+        self._stop = None
+
+    # --- HTTP ------------------------------------------------------------
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, version = request_line.decode("latin-1").strip().split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return method, path, version, headers
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: int, headers: dict, body: bytes,
+                              keep_alive: bool):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+        for key, value in headers.items():
+            lines.append(f"{key}: {value}")
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, version, headers = request
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                if "content-length" not in headers and method == "POST":
+                    status, response_headers, body = self._json(411, {"error": "Content-Length is required"})
+                    keep_alive = False
+                elif int(headers.get("content-length") or 0) > SERVER_MAX_BODY_BYTES:
+                    status, response_headers, body = self._json(413, {"error": "Request body too large"})
+                    keep_alive = False
+                else:
+                    request_body = await reader.readexactly(int(headers.get("content-length") or 0))
+                    status, response_headers, body = await self._dispatch(method, path, headers, request_body)
+
+                keep_alive = keep_alive and not self.draining
+                await self._write_response(writer, status, response_headers, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _json(status: int, body: dict) -> tuple[int, dict, bytes]:
+        return status, {"Content-Type": "application/json; charset=utf-8"}, json.dumps(body).encode("utf-8")
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        route = path.split("?", 1)[0]
+        if route == "/healthz":
+            if self.draining:
+                return self._json(503, {"status": "draining", "in_flight": self.in_flight})
+            return self._json(200, {"status": "ok", "in_flight": self.in_flight, "waiting": self.waiting})
+        if route == "/metrics":
+            return 200, {"Content-Type": "text/plain; version=0.0.4"}, self.metrics().encode("utf-8")
+        if method != "POST":
+            return self._json(405, {"error": f"Method {method} not allowed"})
+        if self.draining:
+            return self._json(503, {"error": "Server is shutting down"})
+        return await self._extract(method, path, headers, body)
+
+    def _early_response(self, event: dict) -> dict | None:
+        """403 or 429 response decided without a worker, or None to run the handler."""
+        if is_warmup_event(event):
+            return None  # ウォームアップは認証なしでハンドラーが扱う
+        response = self.authorize(event)
+        if response is not None:
+            return response
+        # ここでは回復の確認 (probe) を割り当てない。受け付けたリクエストはハンドラーで改めて確認される
+        retry_after = admission.retry_after(probe=False)
+        if retry_after is not None:
+            print(f"Rejecting request, model backend saturated for {retry_after:.1f}s more")
+            return rejection(retry_after)
+        return None
+
+    async def _run_handler(self, event: dict) -> tuple[dict, float]:
+        self.waiting += 1
+        self._idle.clear()
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            started_at = time.perf_counter()
+            try:
+                context = LocalContext(self.request_timeout) if self.request_timeout else None
+                response = await asyncio.get_running_loop().run_in_executor(self.executor, self.handler, event, context)
+            except Exception as e:
+                print(f"Server handler error: {e}")
+                response = {"statusCode": 500, "headers": {"Content-Type": "application/json; charset=utf-8"},
+                            "body": json.dumps({"error": f"Internal server error: {str(e)}"})}
+            finally:
+                self.in_flight -= 1
+                if self.in_flight == 0 and self.waiting == 0:
+                    self._idle.set()
+        return response, started_at
+
+    async def _extract(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        received_at = time.perf_counter()
+        event = to_lambda_event(method, path, headers, body)
+        # 認証と飽和時の受付制御はワーカーを待つ前に行う (断るリクエストをキューに並ばせない)
+        response = self._early_response(event)
+        if response is None:
+            response, started_at = await self._run_handler(event)
+        else:
+            started_at = received_at
+
+        status = response.get("statusCode", 200)
+        latency = time.perf_counter() - received_at
+        self.status_counts[status] += 1
+        self.latency_sum += latency
+        self.queue_wait_sum += started_at - received_at
+        for bound in LATENCY_BUCKETS:
+            if latency <= bound:
+                self.latency_counts[bound] += 1
+        payload = response.get("body", "")
+        return status, response.get("headers") or {}, payload.encode("utf-8")
+
+    # --- metrics ---------------------------------------------------------
+    def metrics(self) -> str:
+        total = sum(self.status_counts.values())
+        limiter = call_limiter.summary()
+        slots = sorted(self.slot_summary().items())
+        saturation = admission.summary()
+        lines = [
+            "# TYPE ocr_requests_total counter",
+            *[f'ocr_requests_total{{status="{status}"}} {count}' for status, count in sorted(self.status_counts.items())],
+            "# TYPE ocr_requests_in_flight gauge",
+            f"ocr_requests_in_flight {self.in_flight}",
+            "# TYPE ocr_requests_waiting gauge",
+            f"ocr_requests_waiting {self.waiting}",
+            "# TYPE ocr_request_seconds histogram",
+            *[f'ocr_request_seconds_bucket{{le="{bound}"}} {self.latency_counts[bound]}' for bound in LATENCY_BUCKETS],
+            f'ocr_request_seconds_bucket{{le="+Inf"}} {total}',
+            f"ocr_request_seconds_sum {self.latency_sum:.6f}",
+            f"ocr_request_seconds_count {total}",
+            "# TYPE ocr_queue_wait_seconds_sum counter",
+            f"ocr_queue_wait_seconds_sum {self.queue_wait_sum:.6f}",
+            "# TYPE ocr_model_concurrency_limit gauge",
+            f"ocr_model_concurrency_limit {limiter['limit']:.2f}",
+            "# TYPE ocr_model_calls_in_flight gauge",
+            f"ocr_model_calls_in_flight {limiter['in_flight']}",
+            "# TYPE ocr_model_calls_overloaded_total counter",
+            f"ocr_model_calls_overloaded_total {limiter.get('overloaded', 0)}",
+            "# TYPE ocr_model_slot_calls_total counter",
+            *[f'ocr_model_slot_calls_total{{slot="{name}"}} {slot["calls"]}' for name, slot in slots],
+            "# TYPE ocr_model_slot_throttled_total counter",
+            *[f'ocr_model_slot_throttled_total{{slot="{name}"}} {slot["throttled"]}' for name, slot in slots],
+            "# TYPE ocr_model_slot_cooling_seconds gauge",
+            *[f'ocr_model_slot_cooling_seconds{{slot="{name}"}} {slot["cooling_seconds"]}' for name, slot in slots],
+            "# TYPE ocr_backend_saturated_seconds gauge",
+            f"ocr_backend_saturated_seconds {saturation['saturated_seconds']}",
+            "# TYPE ocr_admission_rejected_total counter",
+            f"ocr_admission_rejected_total {saturation.get('rejected', 0)}",
+            "# TYPE ocr_workers gauge",
+            f"ocr_workers {self.workers}",
+            "# TYPE ocr_uptime_seconds gauge",
+            f"ocr_uptime_seconds {time.time() - self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    # --- lifecycle -------------------------------------------------------
+    async def serve(self, host: str, port: int):
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self._stop.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # メインスレッド以外 (ベンチマーク) ではシグナルを扱えない
+        print(f"Serving on http://{host}:{port}/ with {self.workers} workers")
+        async with self._server:
+            await self._stop.wait()
+            await self._drain()
+
+    async def _drain(self):
+        print(f"Shutting down: waiting up to {self.shutdown_grace:.0f}s for {self.in_flight} in-flight requests")
+        self.draining = True
+        self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.shutdown_grace)
+        except asyncio.TimeoutError:
+            print(f"Shutdown grace period expired with {self.in_flight} requests in flight")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        print("Server stopped")
+
+    def stop(self, loop: asyncio.AbstractEventLoop):
+        """Request a graceful shutdown from another thread."""
+        loop.call_soon_threadsafe(self._stop.set)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="concurrent extractions")
+    parser.add_argument("--request-timeout", type=float, default=SERVER_REQUEST_TIMEOUT,
+                        help="time budget per request in seconds (0 = unbounded)")
+    parser.add_argument("--shutdown-grace", type=float, default=SERVER_SHUTDOWN_GRACE)
+    parser.add_argument("--fake", action="store_true", help="use the fake Gemini backend (no quota, API_KEY defaults to 'local')")
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ.setdefault("VERTEX_AI_PROJECT_ID", "local-project")
+        os.environ.setdefault("API_KEY", "local")
+    import lambda_function
+
+    if args.fake:
+        import fake_gemini
+
+        fake_gemini.install(lambda_function, fake_gemini.FakeGeminiClient())
+
+    server = ExtractionServer(lambda_function.lambda_handler, args.workers, args.request_timeout, args.shutdown_grace,
+                              lambda_function.slot_router.summary, lambda_function.authorization_error)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# 投機実行で許容する無駄な抽出呼び出しの割合 (0 で無効)
+SPECULATIVE_EXTRACTION_BUDGET = float(os.environ.get("SPECULATIVE_EXTRACTION_BUDGET", "0"))
+SPECULATIVE_MIX_WINDOW = int(os.environ.get("SPECULATIVE_MIX_WINDOW", "50"))
+SPECULATIVE_MIN_SAMPLES = 5
+
+
+class SpeculativeExtractor:
+    """
+    Run classification and the most likely type-specific extraction at the same time.
+
+    The likely type comes from an explicit hint or from the recent traffic mix.
+    The speculative result is kept when classification agrees; otherwise it is
+    discarded and the correct extractor runs. Speculation only happens while the
+    expected and observed share of wasted extraction calls stay within `budget`.
+    """
+
+    def __init__(self, budget: float, extractable_types, window: int = SPECULATIVE_MIX_WINDOW):
+        self.budget = budget
+        self.extractable_types = set(extractable_types)
+        self.recent_types = deque(maxlen=window)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
+
+    def record(self, certificate_type: Optional[str]):
+        with self._lock:
+            self.recent_types.append(certificate_type)
+
+    def predict(self, type_hint: Optional[str] = None) -> Optional[str]:
+        """Return the type to speculate on, or None when speculation is not worth it."""
+        if self.budget <= 0:
+            return None
+
+        with self._lock:
+            pages = self.stats["pages"]
+            if pages and self.stats["wasted_calls"] / pages >= self.budget:
+                return None
+
+            if type_hint is not None:
+                return type_hint if type_hint in self.extractable_types else None
+
+            if len(self.recent_types) < SPECULATIVE_MIN_SAMPLES:
+                return None
+            certificate_type, count = Counter(self.recent_types).most_common(1)[0]
+            share = count / len(self.recent_types)
+
+        if certificate_type not in self.extractable_types or 1 - share > self.budget:
+            return None
+        return certificate_type
+
+    def _discard(self, future: Future):
+        if not future.cancel():
+            with self._lock:
+                self.stats["wasted_calls"] += 1
+
+    def run(self, classify: Callable[[], Optional[str]], extract: Callable[[str], Any],
+            type_hint: Optional[str] = None, allow: bool = True) -> tuple[Optional[str], Any]:
+        """
+        Classify a page and run its extraction, speculatively when allowed.
+
+        Args:
+            classify: Returns the detected certificate type
+            extract: Runs the extraction prompt for the given certificate type
+            type_hint: Certificate type expected by the caller, if known
+            allow: False disables speculation for this call (e.g. deadline is near)
+
+        Returns:
+            tuple: (certificate_type, extraction output or None for unknown types)
+        """
+        speculative_type = self.predict(type_hint) if allow else None
+
+        if speculative_type is None:
+            certificate_type = classify()
+            outputs = extract(certificate_type) if certificate_type in self.extractable_types else None
+        else:
+            speculative_future = self._executor.submit(extract, speculative_type)
+            try:
+                certificate_type = classify()
+            except BaseException:
+                # 判定に失敗したページの投機結果は使われない (始まっていれば無駄な呼び出しとして数える)
+                self._discard(speculative_future)
+                with self._lock:
+                    self.stats["speculated"] += 1
+                    self.stats["pages"] += 1
+                raise
+            if certificate_type == speculative_type:
+                outputs = speculative_future.result()
+                with self._lock:
+                    self.stats["hits"] += 1
+            else:
+                # 判定結果と異なるため投機結果は破棄する
+                self._discard(speculative_future)
+                print(f"Speculative extraction missed: expected {speculative_type}, detected {certificate_type}")
+                outputs = extract(certificate_type) if certificate_type in self.extractable_types else None
+            with self._lock:
+                self.stats["speculated"] += 1
+
+        with self._lock:
+            self.stats["pages"] += 1
+        self.record(certificate_type)
+        return certificate_type, outputs
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+from collections import Counter
+from typing import Any, Optional
+
+from google.genai import types
+
+from normalization import normalize_output
+
+# 0 にするとスキーマを渡さない (JSON モードのみ)。スキーマ有無の比較用
+STRUCTURED_OUTPUT_SCHEMAS = os.environ.get("STRUCTURED_OUTPUT_SCHEMAS", "1") != "0"
+
+
+def _string(enum: Optional[list[str]] = None) -> types.Schema:
+    return types.Schema(type=types.Type.STRING, nullable=True, enum=enum)
+
+
+def _amount() -> types.Schema:
+    return types.Schema(type=types.Type.INTEGER, nullable=True)
+
+
+def _rows(fields: dict[str, types.Schema]) -> types.Schema:
+    return types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties=fields,
+            required=list(fields),
+            property_ordering=list(fields),
+        ),
+    )
+
+
+# 帳票の種類の判定
+CLASSIFICATION_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={"帳票の種類": types.Schema(type=types.Type.STRING, enum=["0", "1", "2", "3", "4"])},
+    required=["帳票の種類"],
+)
+
+# 帳票の種類 -> 抽出結果のスキーマ (プロンプトの抽出項目と同じ並び)
+EXTRACTION_SCHEMAS = {
+    "1": _rows({  # 生命保険控除証明書
+        "保険区分": _string(["0", "1", "2", "3"]),
+        "保険会社名": _string(),
+        "契約番号": _string(),
+        "保険種類": _string(),
+        "契約日": _string(),
+        "保険期間": _string(),
+        "保険契約者名": _string(),
+        "保険受取人名": _string(),
+        "新・旧制度区分": _string(["0", "1", "2"]),
+        "証明額": _amount(),
+        "年金支払開始日": _string(),
+    }),
+    "2": _rows({  # 地震保険控除証明書
+        "保険会社名": _string(),
+        "契約番号": _string(),
+        "保険種類": _string(),
+        "契約開始日": _string(),
+        "契約終了日": _string(),
+        "保険期間": _string(),
+        "保険契約者名": _string(),
+        "保険対象物件": _string(),
+        "地震控除証明額": _amount(),
+        "旧長期控除証明額": _amount(),
+        "満期返戻金有無": _string(["0", "1", "2"]),
+    }),
+    "3": _rows({  # 社会保険控除証明書
+        "保険種類": _string(),
+        "保険料支払先名称": _string(),
+        "保険料負担者氏名": _string(),
+        "保険料支払額": _amount(),
+    }),
+    "4": _rows({  # 小規模共済控除証明書
+        "掛金の種類": _string(["0", "1", "2", "3", "4"]),
+        "掛金": _amount(),
+    }),
+}
+
+
+class MalformedOutputError(ValueError):
+    """Raised when the model output is not valid JSON or does not match the expected schema."""
+
+
+def _validate(value: Any, schema: types.Schema, path: str) -> Any:
+    if value is None:
+        if schema.nullable:
+            return None
+        raise MalformedOutputError(f"{path}: null is not allowed")
+
+    if schema.type == types.Type.OBJECT:
+        if not isinstance(value, dict):
+            raise MalformedOutputError(f"{path}: expected an object, got {type(value).__name__}")
+        missing = [key for key in schema.required or [] if key not in value]
+        if missing:
+            raise MalformedOutputError(f"{path}: missing {', '.join(missing)}")
+        properties = schema.properties or {}
+        return {
+            key: _validate(item, properties[key], f"{path}.{key}") if key in properties else item
+            for key, item in value.items()
+        }
+    if schema.type == types.Type.ARRAY:
+        if isinstance(value, dict):
+            value = [value]  # 1件だけの場合にオブジェクトで返されることがある
+        if not isinstance(value, list):
+            raise MalformedOutputError(f"{path}: expected an array, got {type(value).__name__}")
+        return [_validate(item, schema.items, f"{path}[{index}]") for index, item in enumerate(value)]
+    if schema.type == types.Type.STRING:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            raise MalformedOutputError(f"{path}: expected a string, got {type(value).__name__}")
+        if schema.enum and value not in schema.enum:
+            raise MalformedOutputError(f"{path}: {value!r} is not one of {schema.enum}")
+        return value
+    if schema.type == types.Type.INTEGER:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise MalformedOutputError(f"{path}: expected an integer, got {value!r}")
+        return value
+    return value
+
+
+def parse_output(text: Optional[str], schema: types.Schema) -> Any:
+    """
+    Parse model output strictly: the JSON must decode and match `schema`.
+    Markdown code fences (returned by some schema-less responses) are removed first,
+    and dates, amounts and strings are normalized locally before the validation.
+
+    Raises:
+        MalformedOutputError: the output is empty, truncated or has the wrong shape
+    """
+    if not text or not text.strip():
+        raise MalformedOutputError("empty output")
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try:
+        value = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        raise MalformedOutputError(f"invalid JSON ({e}): {cleaned[:80]!r}") from e
+    # プロンプトは日付・金額の書式を指示しないため、正規化は常に必要
+    value = normalize_output(value, schema)
+    return _validate(value, schema, "$")
+
+
+class OutputStats:
+    """Per-stage counters for output tokens and parse failures, for comparing prompt and schema changes."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, output_tokens: Optional[int], parse_failed: bool = False):
+        with self._lock:
+            self.counts[f"{stage}.calls"] += 1
+            self.counts[f"{stage}.output_tokens"] += output_tokens or 0
+            self.counts[f"{stage}.parse_failures"] += 1 if parse_failed else 0
+
+    def record_retry(self, stage: str, recovered: bool):
+        with self._lock:
+            self.counts[f"{stage}.retries"] += 1
+            self.counts[f"{stage}.recovered"] += 1 if recovered else 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = sorted({key.split(".")[0] for key in self.counts})
+            return {
+                stage: {
+                    "calls": self.counts[f"{stage}.calls"],
+                    "output_tokens_per_call": (
+                        self.counts[f"{stage}.output_tokens"] / self.counts[f"{stage}.calls"]
+                        if self.counts[f"{stage}.calls"] else 0.0
+                    ),
+                    "parse_failure_rate": (
+                        self.counts[f"{stage}.parse_failures"] / self.counts[f"{stage}.calls"]
+                        if self.counts[f"{stage}.calls"] else 0.0
+                    ),
+                    "retries": self.counts[f"{stage}.retries"],
+                    "recovered": self.counts[f"{stage}.recovered"],
+                }
+                for stage in stages
+            }
+
+
+output_stats = OutputStats()
@@ -2,23 +2,64 @@
 """
 Test script for the deployed Lambda function endpoint.
 This script tests the actual deployed API endpoint.
+
+Usage:
+    python test_lambda_endpoint.py <file> [--url URL] [--upload json|raw|multipart] [--gzip]
 """
 
+import argparse
 import json
 import base64
-import sys
+import gzip
 import os
 import mimetypes
+import time
+import uuid
 import requests
 
+DEFAULT_ENDPOINT_URL = "https://aaw3hzxo522jzmiidkmvpoulmm0gtdeo.lambda-url.ap-northeast-1.on.aws/"
+
+
+def build_request(file_data: bytes, media_type: str, upload: str = "json", compress: bool = False) -> tuple[bytes, dict]:
+    """
+    Build the request body and headers for the given upload format.
+
+    Args:
+        file_data (bytes): File contents
+        media_type (str): image/jpeg, image/png, or application/pdf
+        upload (str): "json" (base64 in a JSON body), "raw" (binary body) or "multipart" (multipart/form-data)
+        compress (bool): gzip the body and send Content-Encoding: gzip
+    """
+    if upload == "raw":
+        body, content_type = file_data, media_type
+    elif upload == "multipart":
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="upload"\r\n'
+            f"Content-Type: {media_type}\r\n\r\n"
+        ).encode("utf-8") + file_data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        content_type = f"multipart/form-data; boundary={boundary}"
+    else:
+        payload = {"data": base64.b64encode(file_data).decode("utf-8"), "media_type": media_type}
+        body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+
+    headers = {"Content-Type": content_type, "Authorization": f"Bearer {os.getenv('API_KEY')}"}
+    if compress:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
 
-def test_lambda_endpoint(endpoint_url: str, file_path: str):
+def test_lambda_endpoint(endpoint_url: str, file_path: str, upload: str = "json", compress: bool = False):
     """
     Test the deployed Lambda function endpoint.
 
     Args:
         endpoint_url (str): The Lambda function URL
         file_path (str): Path to the file to test
+        upload (str): Upload format, "json", "raw" or "multipart"
+        compress (bool): Send the body gzip-compressed
     """
     if not os.path.exists(file_path):
         print(f"❌ File not found: {file_path}")
@@ -27,21 +68,22 @@ def test_lambda_endpoint(endpoint_url: str, file_path: str):
     # Read and encode file
     with open(file_path, "rb") as f:
         file_data = f.read()
-        data = base64.b64encode(file_data).decode("utf-8")
 
     # Prepare request payload
     media_type, _ = mimetypes.guess_type(file_path)
-    payload = {"data": data, "media_type": media_type}
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('API_KEY')}"}
+    encode_started_at = time.time()
+    body, headers = build_request(file_data, media_type, upload, compress)
+    encode_time = time.time() - encode_started_at
+    print(f"📦 Upload: {upload}{' + gzip' if compress else ''}, {len(body):,} bytes "
+          f"({len(body) / len(file_data):.0%} of the {len(file_data):,}-byte file), encoded in {encode_time * 1000:.1f} ms")
 
     try:
         print("🚀 Sending request to Lambda endpoint...")
-        import time
 
         start_time = time.time()
 
         response = requests.post(
-            endpoint_url, json=payload, headers=headers, timeout=120
+            endpoint_url, data=body, headers=headers, timeout=120
         )
 
         elapsed_time = time.time() - start_time
@@ -70,8 +112,10 @@ def test_lambda_endpoint(endpoint_url: str, file_path: str):
 
 
 if __name__ == "__main__":
-    file_path = sys.argv[1]
-    test_lambda_endpoint(
-        "https://aaw3hzxo522jzmiidkmvpoulmm0gtdeo.lambda-url.ap-northeast-1.on.aws/",
-        file_path,
-    )
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file_path")
+    parser.add_argument("--url", default=DEFAULT_ENDPOINT_URL, help="Lambda function URL")
+    parser.add_argument("--upload", choices=["json", "raw", "multipart"], default="json", help="upload format")
+    parser.add_argument("--gzip", action="store_true", help="gzip the request body")
+    args = parser.parse_args()
+    test_lambda_endpoint(args.url, args.file_path, args.upload, args.gzip)
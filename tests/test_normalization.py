@@ -0,0 +1,70 @@
+import pytest
+from google.genai import types
+
+from normalization import normalize_date, normalize_output, parse_amount
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("令和元年5月1日", "20190501"),
+    ("令和2年7月1日", "20200701"),
+    ("R1.5.1", "20190501"),
+    ("R元.5.1", "20190501"),
+    ("Ｒ１．５．１", "20190501"),
+    ("H31/4/30", "20190430"),
+    ("平成元年1月8日", "19890108"),
+    ("昭和64年1月7日", "19890107"),
+    ("２０２０年７月１日", "20200701"),
+    ("2020/07/01", "20200701"),
+    ("2020-7-1", "20200701"),
+    ("20200701", "20200701"),
+    (" 令和 2年 7月 1日 ", "20200701"),
+])
+def test_normalize_date(value, expected):
+    assert normalize_date(value) == expected
+
+
+@pytest.mark.parametrize("value", ["令和2年2月30日", "R2.13.1", "不明", "2020年7月"])
+def test_unparseable_date_is_returned_trimmed(value):
+    assert normalize_date(f" {value} ") == value
+
+
+def test_non_string_date_is_unchanged():
+    assert normalize_date(None) is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("50,000円", 50000),
+    ("５０，０００円", 50000),
+    ("５００００", 50000),
+    ("¥1,234", 1234),
+    ("１ ２３４ 円", 1234),
+    ("-500", -500),
+    (12000, 12000),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value", ["約5万円", "1.5", "", None])
+def test_unparseable_amount_is_unchanged(value):
+    assert parse_amount(value) == value
+
+
+def test_normalize_output_follows_the_schema():
+    schema = types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.OBJECT, properties={
+        "契約日": types.Schema(type=types.Type.STRING),
+        "保険料": types.Schema(type=types.Type.INTEGER),
+        "区分": types.Schema(type=types.Type.STRING, enum=["1", "2"]),
+        "名称": types.Schema(type=types.Type.STRING),
+    }))
+    output = [{"契約日": "R1.5.1", "保険料": "１２，０００円", "区分": "2:新", "名称": " 日本生命 ", "余分": " x "}]
+    assert normalize_output(output, schema) == [
+        {"契約日": "20190501", "保険料": 12000, "区分": "2", "名称": "日本生命", "余分": " x "}
+    ]
+
+
+def test_normalize_output_wraps_a_single_object_in_an_array_schema():
+    schema = types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.OBJECT, properties={
+        "保険料": types.Schema(type=types.Type.INTEGER),
+    }))
+    assert normalize_output({"保険料": "1,000"}, schema) == {"保険料": 1000}
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+from packing import PACK_IMAGE_KEY, PACK_RESULT_KEY, ExtractionPacker, unpack
+from structured_output import MalformedOutputError
+
+
+def entry(number, result):
+    return {PACK_IMAGE_KEY: number, PACK_RESULT_KEY: result}
+
+
+def test_unpack_maps_results_back_in_attachment_order():
+    outputs = [entry(2, ["b"]), entry(1, ["a"]), entry(3, [])]
+    assert unpack(outputs, 3) == [["a"], ["b"], []]
+
+
+@pytest.mark.parametrize("outputs", [
+    [entry(1, ["a"]), entry(1, ["b"])],  # 画像番号の重複
+    [entry(1, ["a"])],  # 画像の結果が欠けている
+    [entry(1, ["a"]), entry(2, ["b"]), entry(3, ["c"])],  # 画像より多い
+    [entry(1, ["a"]), entry(3, ["b"])],  # 範囲外の画像番号
+    [entry(0, ["a"]), entry(1, ["b"])],
+    [entry("1", ["a"]), entry(2, ["b"])],  # 数値でない画像番号
+    [{PACK_RESULT_KEY: ["a"]}, entry(2, ["b"])],  # 画像番号がない
+    [["a"], ["b"]],
+    {"1": ["a"], "2": ["b"]},
+    None,
+])
+def test_unpack_rejects_results_that_do_not_map_one_to_one(outputs):
+    assert unpack(outputs, 2) is None
+
+
+def run_pages(packer: ExtractionPacker, filepaths: list[str], extract_pack, extract_single=None) -> list:
+    results = [None] * len(filepaths)
+    single = extract_single or (lambda path: f"single:{path}")
+
+    def page(index: int, path: str):
+        try:
+            results[index] = packer.extract("3", path, extract_pack, lambda: single(path))
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=page, args=(index, path)) for index, path in enumerate(filepaths)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_packer_shares_one_call_and_maps_results_back():
+    calls = []
+
+    def extract_pack(paths):
+        calls.append(list(paths))
+        return [entry(number, f"packed:{path}") for number, path in enumerate(paths, start=1)]
+
+    packer = ExtractionPacker(pack_size=3, certificate_types=["3"], linger=5.0)
+    assert run_pages(packer, ["a", "b", "c"], extract_pack) == ["packed:a", "packed:b", "packed:c"]
+    assert len(calls) == 1 and sorted(calls[0]) == ["a", "b", "c"]
+    assert packer.summary()["calls_saved"] == 2
+
+
+def test_packer_falls_back_to_single_calls_on_a_mismatch():
+    packer = ExtractionPacker(pack_size=2, certificate_types=["3"], linger=5.0)
+    results = run_pages(packer, ["a", "b"], lambda paths: [entry(1, "x"), entry(1, "y")])
+    assert results == ["single:a", "single:b"]
+    assert packer.summary()["mismatches"] == 1 and packer.summary()["calls_saved"] == -1
+
+
+def test_packer_falls_back_on_malformed_output():
+    def extract_pack(paths):
+        raise MalformedOutputError("truncated")
+
+    packer = ExtractionPacker(pack_size=2, certificate_types=["3"], linger=5.0)
+    assert run_pages(packer, ["a", "b"], extract_pack) == ["single:a", "single:b"]
+
+
+def test_packer_propagates_other_errors_to_every_page():
+    def extract_pack(paths):
+        raise RuntimeError("quota")
+
+    packer = ExtractionPacker(pack_size=2, certificate_types=["3"], linger=5.0)
+    results = run_pages(packer, ["a", "b"], extract_pack)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_lone_page_runs_a_single_call_after_the_linger():
+    packer = ExtractionPacker(pack_size=4, certificate_types=["3"], linger=0.01)
+    assert run_pages(packer, ["a"], lambda paths: pytest.fail("packed a single page")) == ["single:a"]
+    assert packer.summary()["single_calls"] == 1
+
+
+def test_accepts_only_configured_types_when_enabled():
+    assert ExtractionPacker(pack_size=4, certificate_types=["3", "4"]).accepts("4")
+    assert not ExtractionPacker(pack_size=4, certificate_types=["3", "4"]).accepts("1")
+    assert not ExtractionPacker(pack_size=1, certificate_types=["3", "4"]).accepts("3")
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "test-project")
+
+import fake_gemini
+import lambda_function
+from deadline import DeadlineExceededError
+from fake_gemini import FakeInjectedError
+from page_isolation import run_page
+from quota_pool import SlotRouter
+from retry_policy import RetryExhaustedError, RetryPolicy
+from structured_output import MalformedOutputError
+
+
+def staged_page(classify_errors=(), extract_errors=()):
+    """A page that fails with the given errors in order, checkpointing its classification like execute_extraction."""
+    calls = {"classify": 0, "extract": 0}
+    classify_errors, extract_errors = list(classify_errors), list(extract_errors)
+
+    def extract_page(checkpoint):
+        if "certificate_type" not in checkpoint:
+            calls["classify"] += 1
+            if classify_errors:
+                raise classify_errors.pop(0)
+            checkpoint["certificate_type"] = "1"
+        calls["extract"] += 1
+        if extract_errors:
+            raise extract_errors.pop(0)
+        return {"type": checkpoint["certificate_type"]}
+
+    return extract_page, calls
+
+
+@pytest.mark.parametrize("error", [
+    RetryExhaustedError(last_error=TimeoutError("timed out")),
+    MalformedOutputError("truncated JSON"),
+    ConnectionError("reset"),
+])
+def test_failed_extraction_is_retried_without_classifying_again(error):
+    extract_page, calls = staged_page(extract_errors=[error])
+    document, error = run_page(extract_page, 1, retries=1)
+    assert document == {"type": "1"}
+    assert error is None
+    assert calls == {"classify": 1, "extract": 2}
+
+
+def test_error_reports_the_stage_and_attempts_after_the_last_retry():
+    extract_page, calls = staged_page(extract_errors=[MalformedOutputError("bad")] * 3)
+    document, error = run_page(extract_page, 3, retries=2)
+    assert document is None
+    assert error["Page"] == 3
+    assert error["Stage"] == "extraction"
+    assert error["ErrorType"] == "MalformedOutputError"
+    assert error["Attempts"] == 3
+    assert calls == {"classify": 1, "extract": 3}
+
+
+@pytest.mark.parametrize("error", [
+    RetryExhaustedError(last_error=TimeoutError("timed out")),
+    MalformedOutputError("truncated JSON"),
+    FakeInjectedError("terminal"),
+])
+def test_exhausted_or_terminal_classification_is_not_retried(error):
+    extract_page, calls = staged_page(classify_errors=[error])
+    document, error = run_page(extract_page, 1, retries=1)
+    assert document is None
+    assert error["Stage"] == "classification"
+    assert error["Attempts"] == 1
+    assert calls == {"classify": 1, "extract": 0}
+
+
+def test_terminal_extraction_error_is_not_retried():
+    extract_page, calls = staged_page(extract_errors=[FakeInjectedError("terminal")])
+    _, error = run_page(extract_page, 1, retries=1)
+    assert error["Stage"] == "extraction"
+    assert calls == {"classify": 1, "extract": 1}
+
+
+def test_deadline_errors_propagate():
+    extract_page, _ = staged_page(extract_errors=[DeadlineExceededError("no time left")])
+    with pytest.raises(DeadlineExceededError):
+        run_page(extract_page, 1, retries=1)
+
+
+def test_execute_extraction_resumes_from_the_checkpoint(tmp_path, monkeypatch):
+    # 抽出の呼び出しだけが失敗し、1リージョン1巡の再試行ポリシーを使い切る
+    fake = fake_gemini.FakeGeminiClient(0.0, 0.0, failure_rate=1.0, failure_kinds=("1", "2", "3", "4"),
+                                        failure_status=503)
+    monkeypatch.setattr(lambda_function, "slot_router", SlotRouter(
+        [("test-project", None)], ["us-central1"], lambda_function.slot_router.client_factory
+    ))
+    monkeypatch.setattr(lambda_function, "genai", lambda_function.genai)
+    monkeypatch.setattr(lambda_function, "retry_policy", RetryPolicy(base_delay=0.0, max_delay=0.0, max_sweeps=1))
+    fake_gemini.install(lambda_function, fake)
+    filepath = tmp_path / "page.png"
+    filepath.write_bytes(fake_gemini.make_document("1", doc_id="checkpoint"))
+
+    def extract_page(checkpoint):
+        try:
+            return lambda_function.execute_extraction(str(filepath), 1, "image/png", checkpoint=checkpoint)
+        finally:
+            fake.failure_rate = 0.0  # 2回目の試行では成功させる
+
+    document, error = run_page(extract_page, 1, retries=1)
+    assert error is None
+    assert document is not None
+    assert fake.calls["classify"] == 1
+    assert fake.calls["1"] == 2
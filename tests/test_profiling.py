@@ -0,0 +1,33 @@
+import json
+
+from profiling import RequestProfiler
+from response_format import COMPACT, FULL, dumps
+
+BODY = {"Documents": [{"帳票の種類": "1", "項目": [], "備考": "なし"}]}
+
+
+def profiled_response(response_format: str) -> dict:
+    profiler = RequestProfiler(admin_key="secret", top=3)
+    return profiler.run(lambda: {"statusCode": 200, "body": dumps(BODY, response_format)}, "header", response_format)
+
+
+def test_header_mode_keeps_the_compact_format():
+    body = profiled_response(COMPACT)["body"]
+    assert ": " not in body and ", " not in body  # 最小化されたまま
+    document = json.loads(body)
+    assert "Profile" in document
+    assert document["Documents"] == json.loads(dumps(BODY, COMPACT))["Documents"]
+
+
+def test_header_mode_keeps_the_full_format():
+    body = profiled_response(FULL)["body"]
+    document = json.loads(body)
+    assert "Profile" in document
+    assert document["Documents"] == BODY["Documents"]
+    assert body.startswith(json.dumps({"Documents": BODY["Documents"]}, ensure_ascii=False)[:-1])
+
+
+def test_sampled_mode_leaves_the_body_alone():
+    profiler = RequestProfiler(sample_rate=1.0)
+    response = {"statusCode": 200, "body": dumps(BODY, COMPACT)}
+    assert profiler.run(lambda: response, "sampled", COMPACT) is response
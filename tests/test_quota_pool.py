@@ -0,0 +1,55 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+import httpx
+from google.genai import errors
+
+from quota_pool import SlotRouter
+
+REGIONS = ["asia-northeast1", "us-central1", "us-east1"]
+
+
+class RegionClient:
+    def __init__(self, project: str, region: str):
+        self.project = project
+        self.region = region
+
+
+def test_concurrent_failovers_keep_one_client_per_slot():
+    # バッチの I/O スレッドが同時にフェイルオーバーしても、他のスレッドのリージョンやクライアントを書き換えない
+    router = SlotRouter([("p1", None), ("p2", None)], REGIONS, lambda project, region, credentials:
+                        RegionClient(project, region), cooldown=0.001, max_cooldown=0.01)
+    used = defaultdict(set)  # (プロジェクト, リージョン) -> 使われたクライアント
+    lock = threading.Lock()
+    errors_seen = []
+
+    def call(client: RegionClient, rng: random.Random):
+        with lock:
+            used[(client.project, client.region)].add(id(client))
+        time.sleep(rng.uniform(0, 0.001))
+        if rng.random() < 0.3:
+            raise errors.ClientError(429, {"error": {"code": 429}}, httpx.Response(429))
+        return client.region
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        for _ in range(50):
+            try:
+                assert router.run(lambda client: call(client, rng)) in REGIONS
+            except errors.ClientError:
+                pass
+            except Exception as e:
+                errors_seen.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors_seen == []
+    assert len(used) > 1 and all(len(clients) == 1 for clients in used.values())
+    assert all(slot.in_flight == 0 for slot in router.slots)
+    assert sum(slot.stats["calls"] for slot in router.slots) == 16 * 50
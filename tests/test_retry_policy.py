@@ -0,0 +1,120 @@
+import email.utils
+import time
+
+import httpx
+import pytest
+from google.genai import errors
+
+from retry_policy import (
+    TERMINAL,
+    THROTTLED,
+    TRANSIENT,
+    UNAVAILABLE,
+    RetryExhaustedError,
+    RetryPolicy,
+    classify_error,
+    retry_after_hint,
+)
+
+
+def api_error(code: int, headers: dict | None = None, details: list | None = None) -> errors.APIError:
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    body = {"error": {"code": code, "message": "error", **({"details": details} if details else {})}}
+    response = httpx.Response(code, headers=headers) if headers is not None else None
+    return error_class(code, body, response)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (api_error(429), THROTTLED),
+    (api_error(500), UNAVAILABLE),
+    (api_error(503), UNAVAILABLE),
+    (api_error(408), TRANSIENT),
+    (api_error(400), TERMINAL),
+    (api_error(403), TERMINAL),
+    (httpx.ReadTimeout("timed out"), TRANSIENT),
+    (ConnectionResetError("reset"), TRANSIENT),
+    (ValueError("Candidates token count is None"), UNAVAILABLE),
+    (ValueError("bad output"), TERMINAL),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_429_with_retry_after_seconds():
+    assert retry_after_hint(api_error(429, {"Retry-After": "7"})) == 7.0
+
+
+def test_429_with_retry_after_http_date():
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= retry_after_hint(api_error(429, {"Retry-After": retry_at})) <= 30
+
+
+def test_429_with_retry_info_detail():
+    details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "2.5s"}]
+    assert retry_after_hint(api_error(429, details=details)) == 2.5
+
+
+@pytest.mark.parametrize("error", [
+    api_error(429),
+    api_error(429, {}),
+    api_error(429, {"Retry-After": "soon"}),
+    api_error(429, details=[{"@type": "type.googleapis.com/google.rpc.ErrorInfo", "reason": "RATE_LIMIT"}]),
+    ConnectionResetError("reset"),
+])
+def test_429_without_usable_retry_after(error):
+    assert retry_after_hint(error) is None
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_policy_waits_for_the_retry_hint_after_a_full_sweep():
+    clock = VirtualClock()
+    policy = RetryPolicy(base_delay=0.5, total_budget=60, sleep=clock.sleep, clock=clock)
+    outcomes = [api_error(429, {"Retry-After": "3"}), api_error(429, {"Retry-After": "5"}), "ok"]
+
+    def call(timeout):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert policy.execute(call, regions=2, failover=lambda: None) == "ok"
+    assert clock.sleeps == [3.0]  # 最も早く回復するリージョンに合わせる
+
+
+def test_policy_raises_terminal_errors_at_once():
+    clock = VirtualClock()
+    policy = RetryPolicy(sleep=clock.sleep, clock=clock)
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        raise api_error(400)
+
+    with pytest.raises(errors.ClientError):
+        policy.execute(call, regions=3, failover=lambda: None)
+    assert len(calls) == 1 and clock.sleeps == []
+
+
+def test_policy_gives_up_when_the_hint_exceeds_the_budget():
+    clock = VirtualClock()
+    policy = RetryPolicy(total_budget=10, sleep=clock.sleep, clock=clock)
+
+    def call(timeout):
+        raise api_error(429, {"Retry-After": "30"})
+
+    with pytest.raises(RetryExhaustedError) as raised:
+        policy.execute(call, regions=2, failover=lambda: None)
+    assert classify_error(raised.value.last_error) == THROTTLED
+    assert clock.sleeps == []
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+from google.genai import errors
+
+os.environ.setdefault("VERTEX_AI_PROJECT_ID", "test-project")
+
+import lambda_function
+import server
+from admission import AdmissionController
+from local_lambda_server import to_lambda_event
+from retry_policy import RetryExhaustedError
+from server import ExtractionServer
+
+API_KEY = "test-key"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def saturated_controller(clock: Clock) -> AdmissionController:
+    controller = AdmissionController(cooldown=10, store=None, enabled=True, clock=clock)
+    throttled = errors.ClientError(429, {"error": {"code": 429, "message": "Quota exceeded"}})
+    controller.record_exhausted(RetryExhaustedError(last_error=throttled))
+    return controller
+
+
+def event(token: str | None, path: str = "/") -> dict:
+    headers = {"content-type": "image/png"}
+    if token is not None:
+        headers["authorization"] = f"Bearer {token}"
+    return to_lambda_event("POST", path, headers, b"\x89PNG\r\n\x1a\n")
+
+
+def test_peek_does_not_take_the_recovery_probe():
+    clock = Clock()
+    controller = saturated_controller(clock)
+    assert controller.retry_after(probe=False) == pytest.approx(10)
+
+    clock.now += 10
+    assert controller.retry_after(probe=False) is None
+    assert controller.retry_after(probe=False) is None
+    # 先に覗いただけなら、受け付けたリクエストが回復の確認に使われる
+    assert controller.retry_after() is None
+    assert controller.stats["probes"] == 1
+    assert controller.retry_after() is not None
+
+
+@pytest.fixture
+def extraction_server(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lambda_function, "API_KEY", API_KEY)
+    monkeypatch.setattr(server, "admission", saturated_controller(clock))
+    return ExtractionServer(lambda event, context: {"statusCode": 200, "body": "{}"}, workers=1,
+                            authorize=lambda_function.authorization_error), clock
+
+
+def test_unauthenticated_request_is_rejected_before_admission(extraction_server):
+    extraction, _ = extraction_server
+    assert extraction._early_response(event(None))["statusCode"] == 403
+    assert extraction._early_response(event("wrong"))["statusCode"] == 403
+    assert server.admission.stats["rejected"] == 0
+
+
+def test_saturated_backend_rejects_authenticated_requests_without_a_worker(extraction_server):
+    extraction, clock = extraction_server
+    response = extraction._early_response(event(API_KEY))
+    assert response["statusCode"] == 429
+    assert response["headers"]["Retry-After"] == "10"
+    assert json.loads(response["body"])["RetryAfter"] == 10
+
+    clock.now += 10
+    assert extraction._early_response(event(API_KEY)) is None
+    assert server.admission.stats["probes"] == 0
+
+
+def test_warmup_is_left_to_the_handler(extraction_server):
+    extraction, _ = extraction_server
+    assert extraction._early_response(event(None, "/warmup")) is None
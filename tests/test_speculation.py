@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from speculation import SpeculativeExtractor
+
+
+def extractor() -> SpeculativeExtractor:
+    return SpeculativeExtractor(budget=0.5, extractable_types="1234")
+
+
+def test_hit_uses_the_speculative_extraction():
+    speculation = extractor()
+    calls = []
+    certificate_type, outputs = speculation.run(lambda: "1", lambda kind: calls.append(kind) or [kind], type_hint="1")
+    assert (certificate_type, outputs) == ("1", ["1"])
+    assert calls == ["1"]
+    assert speculation.stats["hits"] == 1
+    assert speculation.stats["wasted_calls"] == 0
+
+
+def test_miss_counts_the_started_extraction_as_wasted():
+    speculation = extractor()
+    started = threading.Event()
+
+    def classify():
+        started.wait(5)  # 投機的な抽出が始まってから判定を返す
+        return "2"
+
+    def extract(kind):
+        started.set()
+        return [kind]
+
+    assert speculation.run(classify, extract, type_hint="1") == ("2", ["2"])
+    assert speculation.stats["wasted_calls"] == 1
+    assert speculation.stats["hits"] == 0
+
+
+def test_failed_classification_counts_the_started_extraction_as_wasted():
+    speculation = extractor()
+    started, finished = threading.Event(), threading.Event()
+
+    def classify():
+        started.wait(5)
+        raise RuntimeError("classification failed")
+
+    def extract(kind):
+        started.set()
+        finished.set()
+        return [kind]
+
+    with pytest.raises(RuntimeError):
+        speculation.run(classify, extract, type_hint="1")
+    assert finished.wait(5)
+    assert speculation.stats["wasted_calls"] == 1
+    assert speculation.stats["speculated"] == 1
+    assert speculation.stats["pages"] == 1
+
+
+def test_failed_classification_cancels_a_queued_extraction():
+    speculation = extractor()
+    release = threading.Event()
+    # 投機用のワーカーをすべて塞ぎ、抽出がキューで待つようにする
+    for _ in range(4):
+        speculation._executor.submit(release.wait, 5)
+    extracted = []
+
+    def classify():
+        raise RuntimeError("classification failed")
+
+    with pytest.raises(RuntimeError):
+        speculation.run(classify, extracted.append, type_hint="1")
+    release.set()
+    speculation._executor.shutdown(wait=True)
+    assert extracted == []
+    assert speculation.stats["wasted_calls"] == 0
@@ -0,0 +1,159 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+from upload import parse_batch_upload, parse_upload, sniff_media_type
+
+PDF = b"%PDF-1.4\n%fake"
+PNG = b"\x89PNG\r\n\x1a\nfake"
+JPEG = b"\xff\xd8\xff\xe0fake"
+
+
+def multipart(boundary: str, parts: list[tuple[str, str | None, str | None, bytes]], closing: bool = True) -> bytes:
+    body = b""
+    for name, filename, content_type, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if content_type:
+            body += f"Content-Type: {content_type}\r\n".encode()
+        body += b"\r\n" + content + b"\r\n"
+    if closing:
+        body += f"--{boundary}--\r\n".encode()
+    return body
+
+
+def event(body: bytes, content_type: str, **headers) -> dict:
+    return {
+        "headers": {"Content-Type": content_type, **headers},
+        "body": base64.b64encode(body).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
+
+@pytest.mark.parametrize("data, expected", [(PDF, "application/pdf"), (PNG, "image/png"), (JPEG, "image/jpeg"),
+                                            (b"GIF89a", None), (b"", None)])
+def test_sniff_media_type(data, expected):
+    assert sniff_media_type(data) == expected
+
+
+def test_json_upload():
+    body = json.dumps({"data": base64.b64encode(PDF).decode(), "media_type": "application/pdf",
+                       "certificate_type_hint": "3"}).encode()
+    assert parse_upload(event(body, "application/json")) == (PDF, "application/pdf", {"certificate_type_hint": "3"})
+
+
+def test_raw_upload_with_generic_type_is_sniffed():
+    data, media_type, _ = parse_upload(event(PNG, "application/octet-stream"))
+    assert (data, media_type) == (PNG, "image/png")
+
+
+def test_declared_type_contradicting_magic_bytes_is_rejected():
+    with pytest.raises(ValueError, match="does not match"):
+        parse_upload(event(PDF, "image/png"))
+
+
+def test_declared_type_is_kept_for_unrecognized_content():
+    # マジックバイトで判定できない内容は宣言を信じる
+    assert parse_upload(event(b"not sniffable", "image/jpeg"))[1] == "image/jpeg"
+
+
+def test_unsupported_type_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported media type"):
+        parse_upload(event(b"GIF89a", "image/gif"))
+
+
+def test_multipart_upload_with_fields():
+    body = multipart("XyZ", [("certificate_type_hint", None, None, b"4"),
+                             ("file", "scan.png", "image/png", PNG)])
+    assert parse_upload(event(body, "multipart/form-data; boundary=XyZ")) == (PNG, "image/png", {"certificate_type_hint": "4"})
+
+
+def test_multipart_boundary_inside_content_is_not_split():
+    # 境界文字列を含むが "--" で始まらないデータはパートの一部
+    data = PDF + b"\r\nXyZ middle"
+    body = multipart("XyZ", [("file", "a.pdf", "application/pdf", data)])
+    assert parse_upload(event(body, "multipart/form-data; boundary=XyZ"))[0] == data
+
+
+def test_multipart_without_boundary_parameter():
+    body = multipart("XyZ", [("file", "a.pdf", "application/pdf", PDF)])
+    with pytest.raises(ValueError, match="no boundary"):
+        parse_upload(event(body, "multipart/form-data"))
+
+
+def test_multipart_with_wrong_boundary_has_no_file_part():
+    body = multipart("XyZ", [("file", "a.pdf", "application/pdf", PDF)])
+    with pytest.raises(ValueError, match="no file part"):
+        parse_upload(event(body, "multipart/form-data; boundary=Other"))
+
+
+def test_multipart_without_closing_boundary_keeps_the_parts():
+    body = multipart("XyZ", [("file", "a.pdf", "application/pdf", PDF)], closing=False)
+    assert parse_upload(event(body, "multipart/form-data; boundary=XyZ"))[:2] == (PDF, "application/pdf")
+
+
+def test_multipart_part_without_header_separator_is_skipped():
+    body = b"--XyZ\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.pdf\"" + PDF + b"\r\n--XyZ--\r\n"
+    with pytest.raises(ValueError, match="no file part"):
+        parse_upload(event(body, "multipart/form-data; boundary=XyZ"))
+
+
+@pytest.mark.parametrize("parse", [parse_upload, parse_batch_upload])
+def test_multipart_field_that_is_not_utf8_is_rejected(parse):
+    body = multipart("XyZ", [("certificate_type_hint", None, None, "４".encode("shift_jis")),
+                             ("file", "scan.png", "image/png", PNG)])
+    with pytest.raises(ValueError, match="certificate_type_hint is not valid UTF-8"):
+        parse(event(body, "multipart/form-data; boundary=XyZ"))
+
+
+def test_gzip_upload():
+    data, media_type, _ = parse_upload(event(gzip.compress(PDF), "application/pdf", **{"Content-Encoding": "gzip"}))
+    assert (data, media_type) == (PDF, "application/pdf")
+
+
+def test_bad_gzip_is_rejected():
+    with pytest.raises(ValueError, match="not valid gzip"):
+        parse_upload(event(b"not gzip at all", "application/pdf", **{"Content-Encoding": "gzip"}))
+
+
+def test_truncated_gzip_is_rejected():
+    with pytest.raises(ValueError, match="not valid gzip"):
+        parse_upload(event(gzip.compress(PDF * 100)[:-10], "application/pdf", **{"Content-Encoding": "gzip"}))
+
+
+def test_gzip_bomb_is_rejected(monkeypatch):
+    monkeypatch.setattr("upload.MAX_UPLOAD_BYTES", 1024)
+    with pytest.raises(ValueError, match="exceeds"):
+        parse_upload(event(gzip.compress(b"\0" * 4096), "application/pdf", **{"Content-Encoding": "gzip"}))
+
+
+def test_batch_upload_marks_bad_files_without_failing_the_batch():
+    body = json.dumps({"files": [
+        {"name": "a.pdf", "data": base64.b64encode(PDF).decode()},
+        {"name": "b.png", "data": base64.b64encode(PDF).decode(), "media_type": "image/png"},
+        {"data": base64.b64encode(b"GIF89a").decode()},
+    ], "certificate_type_hint": "1"}).encode()
+    files = parse_batch_upload(event(body, "application/json"))
+    assert [(item["name"], item["media_type"], item["certificate_type_hint"]) for item in files] == [
+        ("a.pdf", "application/pdf", "1"), ("b.png", None, "1"), ("file3", None, "1"),
+    ]
+    assert files[0]["error"] is None
+    assert "does not match" in str(files[1]["error"])
+
+
+def test_batch_multipart_upload():
+    body = multipart("XyZ", [("files", "a.pdf", "application/pdf", PDF), ("files", "b.jpg", "image/jpeg", JPEG)])
+    files = parse_batch_upload(event(body, "multipart/form-data; boundary=XyZ"))
+    assert [(item["name"], item["media_type"]) for item in files] == [("a.pdf", "application/pdf"), ("b.jpg", "image/jpeg")]
+
+
+@pytest.mark.parametrize("body, content_type, message", [
+    (b'{"files": "a.pdf"}', "application/json", "\"files\" list"),
+    (b'{"files": []}', "application/json", "no files"),
+    (PDF, "application/pdf", "Unsupported batch content type"),
+])
+def test_invalid_batch_upload(body, content_type, message):
+    with pytest.raises(ValueError, match=message):
+        parse_batch_upload(event(body, content_type))
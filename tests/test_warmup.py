@@ -0,0 +1,38 @@
+import pytest
+
+from warmup import MAX_WARMUP_CONCURRENCY, is_warmup_event, warmup_concurrency
+
+
+def url_ping(concurrency):
+    return {"rawPath": "/warmup", "queryStringParameters": {"concurrency": concurrency}, "headers": {}}
+
+
+@pytest.mark.parametrize("event", [
+    {"warmup": True},
+    {"source": "aws.events", "detail-type": "Scheduled Event"},
+    {"rawPath": "/warmup"},
+    {"rawPath": "/prod/warmup/"},
+])
+def test_warmup_events(event):
+    assert is_warmup_event(event)
+
+
+def test_extraction_request_is_not_a_warmup_event():
+    assert not is_warmup_event({"rawPath": "/", "body": "{}"})
+
+
+def test_direct_and_eventbridge_pings_fan_out():
+    assert warmup_concurrency({"warmup": True, "concurrency": 4}) == 4
+    assert warmup_concurrency({"source": "aws.events", "concurrency": "3"}) == 3
+
+
+def test_url_ping_fans_out_only_when_authorized():
+    assert warmup_concurrency(url_ping("10")) == 1
+    assert warmup_concurrency(url_ping("10"), authorized=True) == 10
+
+
+@pytest.mark.parametrize("concurrency, expected", [
+    (0, 1), (-3, 1), ("many", 1), (None, 1), (MAX_WARMUP_CONCURRENCY + 5, MAX_WARMUP_CONCURRENCY),
+])
+def test_concurrency_is_clamped(concurrency, expected):
+    assert warmup_concurrency({"warmup": True, "concurrency": concurrency}) == expected
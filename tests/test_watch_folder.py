@@ -0,0 +1,48 @@
+from watch_folder import FolderWatcher
+
+
+def drain(watcher: FolderWatcher):
+    """Queue the settled files and process them on the calling thread."""
+    watcher._scan()
+    watcher._promote_settled()
+    watcher.queue.put(None)
+    watcher._worker()
+
+
+def test_failed_file_is_retried_only_after_it_changes(tmp_path):
+    processed = []
+
+    def process(path):
+        processed.append(path)
+        return 1  # ページのエラーを記録した
+
+    watcher = FolderWatcher(str(tmp_path), process, settle_seconds=0)
+    scan = tmp_path / "scan.pdf"
+    scan.write_bytes(b"%PDF-1.4 first")
+
+    drain(watcher)
+    drain(watcher)
+    assert processed == [str(scan)]
+    assert watcher.failed == 1
+
+    scan.write_bytes(b"%PDF-1.4 rescanned")
+    drain(watcher)
+    assert processed == [str(scan), str(scan)]
+    assert watcher.failed == 2
+
+
+def test_file_that_raised_is_not_requeued_while_unchanged(tmp_path):
+    calls = []
+
+    def process(path):
+        calls.append(path)
+        raise OSError("unreadable")
+
+    watcher = FolderWatcher(str(tmp_path), process, settle_seconds=0)
+    (tmp_path / "scan.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+
+    for _ in range(3):
+        drain(watcher)
+    assert len(calls) == 1
+    assert watcher.failed == 1
+    assert watcher.completed == 0
@@ -0,0 +1,198 @@
+import base64
+import gzip
+import io
+import json
+import os
+from email.parser import Parser
+from email.policy import HTTP
+
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/png", "application/pdf")
+# gzip の展開後サイズの上限 (圧縮爆弾対策)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAGIC_BYTES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+
+
+def sniff_media_type(data: bytes) -> str | None:
+    """Media type from the leading magic bytes, or None if the format is not supported."""
+    for magic, media_type in MAGIC_BYTES:
+        if data.startswith(magic):
+            return media_type
+    return None
+
+
+def _gunzip(data: bytes) -> bytes:
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+            decompressed = f.read(MAX_UPLOAD_BYTES + 1)
+    except (OSError, EOFError) as e:
+        # 壊れた・途中で切れた gzip も他の形式エラーと同じく ValueError にする
+        raise ValueError(f"Upload is not valid gzip: {e}") from e
+    if len(decompressed) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Decompressed upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    return decompressed
+
+
+def _media_type(declared: str | None, data: bytes) -> str:
+    declared = (declared or "").split(";")[0].strip().lower()
+    sniffed = sniff_media_type(data)
+    if declared in SUPPORTED_MEDIA_TYPES:
+        # 宣言と内容が異なる形式ならモデルに誤った MIME タイプを渡さない
+        if sniffed and sniffed != declared:
+            raise ValueError(f"Declared media type {declared} does not match the file content ({sniffed})")
+        return declared
+    # 宣言が無い・汎用的な場合はファイル先頭のマジックバイトで判定する
+    if sniffed:
+        return sniffed
+    raise ValueError(f"Unsupported media type: {declared or 'unknown'}")
+
+
+def _multipart_parts(content_type: str, body: bytes) -> tuple[list[tuple], dict]:
+    # email パッケージは数 MB のパートで遅いため、境界文字列で直接分割する
+    header = Parser(policy=HTTP).parsestr(f"Content-Type: {content_type}\r\n\r\n", headersonly=True)
+    boundary = header.get_param("boundary")
+    if not boundary:
+        raise ValueError("multipart/form-data body has no boundary")
+
+    file_parts, fields = [], {}
+    for chunk in body.split(b"--" + boundary.encode("latin-1"))[1:]:
+        if chunk.startswith(b"--"):
+            break  # 終端の境界
+        head, separator, content = chunk.partition(b"\r\n\r\n")
+        if not separator:
+            continue
+        content = content[:-2] if content.endswith(b"\r\n") else content
+        part = Parser(policy=HTTP).parsestr(head.decode("utf-8", "replace").strip() + "\r\n\r\n", headersonly=True)
+        name = part.get_param("name", header="content-disposition")
+        if part.get_filename() is not None or name in ("file", "data", "files"):
+            file_parts.append((name, part, content))
+        elif name:
+            try:
+                fields[name] = content.decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                # 壊れた gzip と同じく、どのフィールドが不正かを示す ValueError にする
+                raise ValueError(f"Form field {name} is not valid UTF-8: {e}") from e
+    return file_parts, fields
+
+
+def _parse_multipart(content_type: str, body: bytes) -> tuple[bytes, str, dict]:
+    file_parts, fields = _multipart_parts(content_type, body)
+    if not file_parts:
+        raise ValueError("multipart/form-data body has no file part")
+
+    _, part, data = file_parts[0]
+    declared = fields.get("media_type") or part.get_content_type()
+    return data, _media_type(declared, data), fields
+
+
+def _read_body(event: dict) -> tuple[bytes, dict]:
+    headers = {key.lower(): value for key, value in (event.get("headers") or {}).items()}
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    if headers.get("content-encoding", "").strip().lower() == "gzip":
+        body = _gunzip(body)
+    return body, headers
+
+
+def parse_upload(event: dict) -> tuple[bytes, str, dict]:
+    """
+    Extract the uploaded file from a Lambda function URL / API Gateway event.
+
+    Accepted bodies:
+      - JSON `{"data": <base64>, "media_type": ...}` (the original format)
+      - raw `application/pdf` / `image/jpeg` / `image/png` (or `application/octet-stream`)
+      - `multipart/form-data` with a file part and optional `media_type` /
+        `certificate_type_hint` fields
+    `isBase64Encoded` bodies and `Content-Encoding: gzip` are decoded first. When
+    the media type is missing or generic it is detected from the magic bytes.
+
+    Returns:
+        (file bytes, media type, request options such as certificate_type_hint)
+    """
+    body, headers = _read_body(event)
+    query = event.get("queryStringParameters") or {}
+
+    content_type = headers.get("content-type", "")
+    mime = content_type.split(";")[0].strip().lower()
+    options = {}
+    if mime == "multipart/form-data":
+        data, media_type, fields = _parse_multipart(content_type, body)
+        options = {key: fields[key] for key in ("certificate_type_hint",) if fields.get(key)}
+    elif mime in ("application/json", "text/plain", "") and body.lstrip()[:1] == b"{":
+        payload = json.loads(body)
+        data = base64.b64decode(payload.get("data"))
+        media_type = _media_type(payload.get("media_type"), data)
+        options = {key: payload[key] for key in ("certificate_type_hint",) if payload.get(key)}
+    else:
+        data = body
+        media_type = _media_type(mime, data)
+
+    # 生データのアップロードではヘッダーまたはクエリで指定する
+    type_hint = options.get("certificate_type_hint") or headers.get("x-certificate-type-hint") or query.get("certificate_type_hint")
+    if type_hint:
+        options["certificate_type_hint"] = type_hint
+    return data, media_type, options
+
+
+def is_batch_request(event: dict) -> bool:
+    """Batch uploads are posted to `/batch` (or with `?batch=1`) so single uploads are parsed only once."""
+    path = event.get("rawPath") or event.get("path") or ""
+    query = event.get("queryStringParameters") or {}
+    return path.rstrip("/").endswith("/batch") or str(query.get("batch", "")).lower() in ("1", "true")
+
+
+def _batch_file(name: str, data: bytes, declared: str | None, type_hint: str | None) -> dict:
+    # 1ファイルの形式エラーでバッチ全体を失敗させない
+    try:
+        media_type, error = _media_type(declared, data), None
+    except ValueError as e:
+        media_type, error = None, e
+    return {"name": name, "data": data, "media_type": media_type, "certificate_type_hint": type_hint, "error": error}
+
+
+def parse_batch_upload(event: dict) -> list[dict]:
+    """
+    Extract the files of a batch upload.
+
+    Accepted bodies:
+      - JSON `{"files": [{"name": ..., "data": <base64>, "media_type": ..., "certificate_type_hint": ...}, ...]}`
+      - `multipart/form-data` with one file part per document (e.g. `<input name="files" multiple>`);
+        an optional `certificate_type_hint` field applies to every file
+    `isBase64Encoded` bodies and `Content-Encoding: gzip` are decoded first.
+
+    Returns:
+        [{"name", "data", "media_type", "certificate_type_hint", "error"}, ...] in upload order;
+        "error" is set (and "media_type" is None) for a file whose format is not supported
+    """
+    body, headers = _read_body(event)
+    content_type = headers.get("content-type", "")
+    mime = content_type.split(";")[0].strip().lower()
+
+    files = []
+    if mime == "multipart/form-data":
+        file_parts, fields = _multipart_parts(content_type, body)
+        for index, (_, part, data) in enumerate(file_parts):
+            files.append(_batch_file(part.get_filename() or f"file{index + 1}", data, part.get_content_type(),
+                                     fields.get("certificate_type_hint")))
+    elif body.lstrip()[:1] == b"{":
+        payload = json.loads(body)
+        if not isinstance(payload.get("files"), list):
+            raise ValueError("Batch request body must have a \"files\" list")
+        for index, item in enumerate(payload["files"]):
+            files.append(_batch_file(item.get("name") or f"file{index + 1}", base64.b64decode(item.get("data") or ""),
+                                     item.get("media_type"),
+                                     item.get("certificate_type_hint") or payload.get("certificate_type_hint")))
+    else:
+        raise ValueError(f"Unsupported batch content type: {mime or 'unknown'}")
+
+    if not files:
+        raise ValueError("Batch request has no files")
+    if sum(len(item["data"]) for item in files) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Batch upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    return files
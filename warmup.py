@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+try:
+    import boto3
+except ImportError:  # optional dependency (included in the Lambda runtime); no fan-out without it
+    boto3 = None
+
+# ウォームアップで接続を開いておくリージョン数 (先頭から。フェイルオーバー先の一部も含める)
+WARMUP_REGIONS = int(os.environ.get("WARMUP_REGIONS", "3"))
+# 並列ウォームアップで各コンテナを占有しておく時間 (同じコンテナに割り当てられないようにする)
+WARMUP_HOLD_SECONDS = float(os.environ.get("WARMUP_HOLD_SECONDS", "0.2"))
+MAX_WARMUP_CONCURRENCY = int(os.environ.get("MAX_WARMUP_CONCURRENCY", "10"))
+
+# このコンテナの識別子と初期化時刻 (ウォームアップの応答で、どのコンテナが温まったかを返す)
+CONTAINER_ID = uuid.uuid4().hex[:12]
+INITIALIZED_AT = time.time()
+
+
+def _is_invoked_ping(event: dict) -> bool:
+    # 直接の呼び出しと EventBridge のイベントは IAM で保護されている (Function URL とは異なる)
+    return bool(event.get("warmup")) or event.get("source") == "aws.events"
+
+
+def is_warmup_event(event: dict) -> bool:
+    """
+    Warm-up pings: a direct invocation with {"warmup": true} (e.g. an EventBridge
+    schedule with constant input), a plain EventBridge scheduled event, or a
+    Function URL request to `/warmup`.
+    """
+    if _is_invoked_ping(event):
+        return True
+    path = event.get("rawPath") or event.get("path") or ""
+    return path.rstrip("/").endswith("/warmup")
+
+
+def warmup_concurrency(event: dict, authorized: bool = False) -> int:
+    """
+    Containers to warm, from the event's `concurrency` or the `concurrency` query parameter (1..MAX).
+
+    Direct and EventBridge invocations may fan out. A Function URL request fans
+    out only when `authorized` (it carried a valid Bearer token); otherwise anyone
+    who can reach the URL could multiply invocations, so it warms this container only.
+    """
+    if not _is_invoked_ping(event) and not authorized:
+        return 1
+    query = event.get("queryStringParameters") or {}
+    try:
+        concurrency = int(event.get("concurrency") or query.get("concurrency") or 1)
+    except (TypeError, ValueError):
+        concurrency = 1
+    return min(max(concurrency, 1), MAX_WARMUP_CONCURRENCY)
+
+
+class Warmer:
+    """
+    Run the warm-up steps of one container and, on request, fan the ping out to more containers.
+
+    Steps are named callables run once per ping (they are expected to be cheap
+    when already warm, e.g. cached prompts); a failing step is reported and does
+    not fail the ping. With a concurrency above one, the ping invokes the
+    function `concurrency - 1` more times at once while this container is busy,
+    and every invocation holds its container for `hold` seconds, so Lambda has
+    to route them to separate containers.
+
+    Args:
+        steps: name -> callable warming one resource
+        hold (float): Seconds each container stays busy during a parallel warm-up
+    """
+
+    def __init__(self, steps: dict[str, Callable[[], None]], hold: float = WARMUP_HOLD_SECONDS):
+        self.steps = steps
+        self.hold = hold
+        self.pings = 0
+        self._lock = threading.Lock()
+
+    def warm(self) -> dict:
+        with self._lock:
+            self.pings += 1
+            cold = self.pings == 1
+        seconds, errors = {}, {}
+        for name, step in self.steps.items():
+            started_at = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                errors[name] = str(e)
+            seconds[name] = round(time.perf_counter() - started_at, 4)
+        return {
+            "Container": CONTAINER_ID,
+            "Cold": cold,
+            "ContainerAgeSeconds": round(time.time() - INITIALIZED_AT, 1),
+            "StepSeconds": seconds,
+            **({"Errors": errors} if errors else {}),
+        }
+
+    def run(self, concurrency: int = 1, invoke: Callable[[], dict] | None = None,
+            hold_container: bool = False) -> dict:
+        """
+        Warm this container and `concurrency - 1` others.
+
+        Args:
+            concurrency: Containers to warm, including this one
+            invoke: Invokes the function once with a holding single-container warm-up event and returns its result
+            hold_container: Keep this container busy for `hold` seconds (set on the fanned-out invocations)
+        """
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency - 1)) as pool:
+            others = [pool.submit(invoke) for _ in range(concurrency - 1)] if invoke else []
+            result = self.warm()
+            # 他の呼び出しが別のコンテナに割り当てられるまで、このコンテナを空けない
+            if hold_container or concurrency > 1:
+                time.sleep(max(0.0, self.hold - (time.perf_counter() - started_at)))
+            containers = [result]
+            for future in others:
+                try:
+                    containers.append(future.result())
+                except Exception as e:
+                    containers.append({"Error": str(e)})
+        if concurrency > 1 and invoke is None:
+            result["Errors"] = {**result.get("Errors", {}), "fanout": "boto3 or the function ARN is not available"}
+        return {
+            **result,
+            "Containers": len({item.get("Container") for item in containers if item.get("Container")}),
+            **({"Peers": containers[1:]} if len(containers) > 1 else {}),
+        }
+
+
+def lambda_invoker(function_arn: str) -> Callable[[], dict] | None:
+    """Synchronous self-invocation with a single-container warm-up event, or None when boto3 is unavailable."""
+    if boto3 is None or not function_arn:
+        return None
+    client = boto3.client("lambda")
+
+    def invoke() -> dict:
+        response = client.invoke(
+            FunctionName=function_arn,
+            InvocationType="RequestResponse",
+            Payload=json.dumps({"warmup": True, "hold": True}).encode("utf-8"),
+        )
+        body = json.loads(response["Payload"].read())
+        return json.loads(body["body"])["Warmup"]
+
+    return invoke
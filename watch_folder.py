@@ -0,0 +1,191 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+try:
+    import inotify_simple
+except ImportError:  # optional dependency; fall back to polling
+    inotify_simple = None
+
+# 書き込み途中のファイルを避けるため、サイズと更新時刻がこの秒数変化しなくなるまで待つ
+WATCH_SETTLE_SECONDS = float(os.environ.get("WATCH_SETTLE_SECONDS", "2"))
+WATCH_POLL_SECONDS = float(os.environ.get("WATCH_POLL_SECONDS", "1"))
+
+
+def _signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class FolderWatcher:
+    """
+    Watch a directory for new or changed files and feed them to a bounded worker pool.
+
+    Changes are detected with inotify when `inotify_simple` is installed and by
+    periodic directory scans otherwise (scans also run with inotify, as a safety
+    net for missed events). A file is queued once its size and mtime have been
+    stable for `settle_seconds`. The queue is bounded, so detection waits when
+    the workers fall behind.
+
+    Args:
+        directory (str): Directory to watch
+        process (Callable): Called with the file path on a worker thread; returns the number of
+            errors recorded for the file (a file with errors, or one that raised, counts as failed
+            and is processed again only after its size or mtime changes)
+        workers (int): Number of worker threads
+        queue_size (int): Maximum number of files waiting for a worker
+        settle_seconds (float): Seconds a file must stay unchanged before it is queued
+        accept (Callable): Filter for file paths (e.g. supported extensions)
+    """
+
+    def __init__(self, directory: str, process: Callable[[str], Optional[int]], workers: int = 4,
+                 queue_size: int = 16, settle_seconds: float = WATCH_SETTLE_SECONDS,
+                 accept: Callable[[str], bool] = lambda path: True):
+        self.directory = directory
+        self.process = process
+        self.workers = workers
+        self.settle_seconds = settle_seconds
+        self.accept = accept
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.known = {}  # path -> 処理済みのシグネチャ
+        self.pending = {}  # path -> (シグネチャ, 最初に検知した時刻, 最後に変化した時刻)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    # --- 検知 ------------------------------------------------------------
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith("."):
+                self._touch(entry.path)
+
+    def _touch(self, path: str):
+        if not self.accept(path):
+            return
+        signature = _signature(path)
+        if signature is None or self.known.get(path) == signature:
+            return
+        now = time.time()
+        previous = self.pending.get(path)
+        if previous is None:
+            self.pending[path] = (signature, now, now)
+        elif previous[0] != signature:
+            self.pending[path] = (signature, previous[1], now)
+
+    def _promote_settled(self):
+        now = time.time()
+        for path, (signature, first_seen, last_change) in list(self.pending.items()):
+            if now - last_change < self.settle_seconds:
+                continue
+            if _signature(path) != signature:
+                self._touch(path)
+                continue
+            try:
+                self.queue.put((path, first_seen), timeout=0.1)
+            except queue.Full:
+                return  # ワーカーが空くまで待つ (バックプレッシャー)
+            del self.pending[path]
+            # 失敗してもシグネチャは残す (サイズか更新時刻が変わったときだけ再処理する)
+            self.known[path] = signature
+
+    # --- ワーカー --------------------------------------------------------
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, first_seen = item
+            with self._lock:
+                self.in_flight += 1
+            try:
+                errors = self.process(path)
+                with self._lock:
+                    if errors:
+                        self.failed += 1
+                    else:
+                        self.completed += 1
+                    self.latencies.append(time.time() - first_seen)
+            except Exception as e:
+                print(f"Error processing {path}: {e}")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies[-1000:])
+            return {
+                "queue_depth": self.queue.qsize(),
+                "pending": len(self.pending),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "latency_max": latencies[-1] if latencies else None,
+            }
+
+    def run(self, stats_interval: float = 30.0, initial_scan: bool = True):
+        """Block until stop() is called (or KeyboardInterrupt), printing stats every `stats_interval` seconds."""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        inotify = None
+        if inotify_simple is not None:
+            flags = inotify_simple.flags
+            inotify = inotify_simple.INotify()
+            inotify.add_watch(self.directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY)
+            print(f"Watching {self.directory} with inotify")
+        else:
+            print(f"Watching {self.directory} by polling every {WATCH_POLL_SECONDS}s (install inotify_simple for inotify)")
+
+        if initial_scan:
+            self._scan()
+        last_scan = last_stats = time.time()
+        try:
+            while not self._stop.is_set():
+                if inotify is not None:
+                    for event in inotify.read(timeout=int(WATCH_POLL_SECONDS * 1000)):
+                        if event.name:
+                            self._touch(os.path.join(self.directory, event.name))
+                else:
+                    self._stop.wait(WATCH_POLL_SECONDS)
+                now = time.time()
+                if inotify is None or now - last_scan >= 30:
+                    self._scan()
+                    last_scan = now
+                self._promote_settled()
+                if stats_interval and now - last_stats >= stats_interval:
+                    print(f"[WATCH] {self.stats()}")
+                    last_stats = now
+        except KeyboardInterrupt:
+            print("Stopping watcher...")
+        finally:
+            if inotify is not None:
+                inotify.close()
+            for _ in self._threads:
+                self.queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            print(f"[WATCH] {self.stats()}")
+
+    def stop(self):
+        self._stop.set()